@@ -178,7 +178,7 @@ RFLearner = {'maxDepth':["types.StringType", "values", "[int(round(x)) for x in
              'stratify':["types.StringType", "values", "['false' , 'true']",["No","Yes"],AZOrangeConfig.RFDEFAULTDICT["stratify"],False,False,"No and Yes"],\
              'priors':["types.StringType", "values", "[None]",[],str(AZOrangeConfig.RFDEFAULTDICT["priors"]),False,False,"Do not use for optimization, just to change the default values of priors"],\
              'useBuiltInMissValHandling':["types.BooleanType", "values", "[False , True]",["No","Yes"],str(AZOrangeConfig.RFDEFAULTDICT["useBuiltInMissValHandling"]),False,False,"Do not use for optimization, just for choosing the method to use when there are missing values on datasets."],\
-             'NumThreads':["types.StringType", "interval", "[0 , 999999]",[],str(AZOrangeConfig.RFDEFAULTDICT["NumThreads"]),False,False,"Do not use for optimization, just for choosing the number of threads to be used by openMP."]\
+             'NumThreads':["types.StringType", "interval", "[0 , 999999]",[],str(AZOrangeConfig.RFDEFAULTDICT["NumThreads"]),False,False,"Do not use for optimization, just for choosing the number of threads to be used by OpenCV. 0 or 'auto' use the thread policy of OPENCVNTHREADS in AZOrangeConfig."]\
             }
 
 
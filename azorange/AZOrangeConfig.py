@@ -26,6 +26,9 @@ STRUCTCLUSTDIR = os.path.join(os.environ["AZORANGEHOME"], "orangeDependencies/st
 #cinfonyToolkits = ["rdk","obabel","webel"]              # Testing Stability!!
 cinfonyToolkits = ["rdk","webel"]
 #cinfonyToolkits = ["rdk"]
+# Cache of the cinfony descriptors. Disabled (None) by default. To use it set a path, for example in AZOrangeExtraConfig.py:
+#DESCCACHEPATH = os.path.join(os.environ["HOME"],".AZOrange","descCache.sqlite")
+DESCCACHEPATH = None
 OWParamOptExecEnvs = [("Local serial", 0)]
  
 
@@ -200,6 +203,10 @@ else:
 QSARNEXTFOLDS = 10     #Number of Folds for the outer loop where data is splitted into External test and Modeling Set
 QSARNINNERFOLDS = 10   #Number of Folds to use in getUnbiasedAccuracy when data is splitted into train and test
 QSARNCVFOLDS = 5       #Number of CrossValidation folds used in getUnbiasedAccuracy when optimizing the MLmethods
+QSARNLOCALWORKERS = 0  #Number of local processes running the outer loop folds when queueType is 'Local'. 0 uses all the cores
+QSARNLOCALRESTARTS = 3 #Number of times a failed outer loop fold is run again when queueType is 'Local'
+OPENCVNTHREADS = "auto"  #Threads used by the OpenCV learners to train and predict: "auto" (CPUs available to the process) or a fixed number.
+                         #Processes of the local parallel pools are capped to their share of the CPUs. See AZutilities/threadPolicy.py
 QSARSTABILITYTHRESHOLD_CLASS_L = 0.1    #Max stability value for a model to be considered stable when testset has more than 50 cmpds
 QSARSTABILITYTHRESHOLD_CLASS_H = 0.1    #Max stability value for a model to be considered stable when testset has less than 50 cmpds
 QSARSTABILITYTHRESHOLD_REG_L = 0.1      #Max stability value for a model to be considered stable when testset has more than 50 cmpds
@@ -0,0 +1,104 @@
+"""
+Persistent evaluator for the Appspack parameter optimization.
+
+The dataset and the cross validation folds are loaded once by this process. Each point that
+appspack asks to be evaluated is sent through a unix socket by the lightweight runScript.py
+and evaluated in a child forked from this process, so there is no interpreter startup, no
+orange import and no dataset parsing for each point.
+
+Usage (started by paramOptUtilities.Appspack):
+    python AZEvalServer.py <evalScript> <dataSet> <sampling> <nFolds> <nExtFolds> <socketFile>
+
+    evalScript  - Script created from OptScriptModel.py that evaluates one point
+    sampling    - "CV" for cross validation, "LOO" for leave one out
+    nExtFolds   - Number of CV repetitions with different seeds (0 to use only one CV)
+
+Protocol: the client sends one line "<inputFile>\t<outputFile>" and the server answers with
+one line, "OK" or "ERROR", once the outputFile was written.
+"""
+import os
+import sys
+import signal
+import traceback
+import SocketServer
+
+import orange
+from AZutilities import dataUtilities
+
+
+def getCVIndices(dataSet, nFolds, nExtFolds):
+    """Returns the fold indices used by orngTest.crossValidation in the OptScriptModel.py script.
+       If nExtFolds, a list with the indices of each repetition is returned.
+    """
+    strat = orange.MakeRandomIndices.StratifiedIfPossible
+    if nExtFolds:
+        return [orange.MakeRandomIndicesCV(dataSet, nFolds, stratified = strat, randomGenerator = orange.RandomGenerator(1000*idx+1)) for idx in range(nExtFolds)]
+    else:
+        return orange.MakeRandomIndicesCV(dataSet, nFolds, stratified = strat, randomGenerator = 0)
+
+
+class EvalHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        request = self.rfile.readline().strip().split("\t")
+        if len(request) != 2:
+            self.wfile.write("ERROR\n")
+            return
+        self.wfile.write(self.server.evaluate(request[0], request[1]) + "\n")
+
+
+class EvalServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    """Unix socket server that evaluates each point in a forked child sharing the loaded data"""
+    def __init__(self, socketFile, evalScript, dataSet, CVIndices):
+        self.evalScript = evalScript
+        self.dataSet = dataSet
+        self.CVIndices = CVIndices
+        file = open(evalScript, "r")
+        self.code = compile(file.read(), evalScript, "exec")
+        file.close()
+        SocketServer.UnixStreamServer.__init__(self, socketFile, EvalHandler)
+
+    def evaluate(self, inputFile, outputFile):
+        """Runs the evaluation script with the preloaded data in the requested point"""
+        if os.path.isfile(outputFile):
+            os.remove(outputFile)
+        namespace = {"__name__":"__main__", "dataSet":self.dataSet, "CVIndices":self.CVIndices}
+        sys.argv = [self.evalScript, inputFile, outputFile]
+        try:
+            exec self.code in namespace
+        except SystemExit:
+            pass
+        except:
+            traceback.print_exc()
+            return "ERROR"
+        if os.path.isfile(outputFile):
+            return "OK"
+        else:
+            return "ERROR"
+
+
+def main(evalScript, dataSetFile, sampling, nFolds, nExtFolds, socketFile):
+    dataSet = dataUtilities.DataTable(dataSetFile)
+    if sampling == "CV":
+        CVIndices = getCVIndices(dataSet, nFolds, nExtFolds)
+    else:
+        CVIndices = None
+    if os.path.exists(socketFile):
+        os.remove(socketFile)
+    server = EvalServer(socketFile, evalScript, dataSet, CVIndices)
+    serverPID = os.getpid()
+
+    def shutdown(signum, frame):
+        # The forked children inherit this handler but must not remove the socket
+        if os.getpid() == serverPID and os.path.exists(socketFile):
+            os.remove(socketFile)
+        os._exit(0)
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 7:
+        print __doc__
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]), sys.argv[6])
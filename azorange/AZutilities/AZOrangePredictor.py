@@ -2,6 +2,9 @@ import os,copy
 import string
 import math
 import time
+import json
+import BaseHTTPServer
+import numpy
 
 from pprint import pprint
 
@@ -35,10 +38,12 @@ except:
 from AZutilities import dataUtilities
 from AZutilities import miscUtilities
 from AZutilities import descUtilities
+from AZutilities import evalUtilities
 from trainingMethods import AZBaseClasses
 
 from rdkit import Chem
 from rdkit.Chem import Draw
+from rdkit.Chem.Fingerprints import FingerprintMols
 from rdkit.Chem.Features.FeatDirUtilsRD import findNeighbors
 from rdkit.Chem.rdmolops import GetAdjacencyMatrix
 from rdkit.Chem.Draw import MolDrawing
@@ -66,8 +71,30 @@ class AZOrangePredictor:
     predictionOutcomes =  None   # to be used in Classification: [PosGradComponent, NegGradComponent]
 
 
-    def NNsearch(_self, _smi):
-        pass
+    def NNsearch(self, smi, n = None, resultsPath = None):
+        """Returns the nearest neighbors of smi found by evalUtilities.getNearestNeighbors in the NN dataset
+           defined in the [NN] section of data/modelDef.ini:
+               [NN]
+               data = NN_Data.txt                  # Tab file with the 'Molecule SMILES' and 'Compound Name' columns
+               fingerprints = NN_Fingerprints.txt  # Fingerprints of the data rows (see evalUtilities.getFingerprintStore)
+               n = 5                               # Number of neighbors
+           The paths are relative to the data dir of the model. The query fingerprint is the RDKit Daylight like
+           fingerprint of smi as a bit string, so the fingerprints file must have been created the same way.
+           Returns [] if the model does not define a NN dataset.
+        """
+        NNDataPath = self.getDef("NN", "data")
+        FPPath = self.getDef("NN", "fingerprints")
+        if not NNDataPath or not FPPath or not self.mountPoint:
+            return []
+        if n is None:
+            n = int(self.getDef("NN", "n") or 5)
+        mol = Chem.MolFromSmiles(smi)
+        if mol is None:
+            print "ERROR: Cannot search the nearest neighbors of the invalid SMILES ",smi
+            return []
+        query = FingerprintMols.FingerprintMol(mol).ToBitString()
+        dataDir = os.path.join(self.mountPoint, "data")
+        return evalUtilities.getNearestNeighbors(query, n, os.path.join(dataDir, NNDataPath), os.path.join(dataDir, FPPath), resultsPath)
 
 
     def getDef(self, section, option=None):
@@ -87,6 +114,7 @@ class AZOrangePredictor:
 
     def loadDefs(self):
         self.preDefSignatureFile = self.getDataFile(self.modelLocation)
+        self._preCalcData = None
 
         defFilePath = os.path.join(self.mountPoint,"data/modelDef.ini")
         if not os.path.isfile(defFilePath): return
@@ -117,8 +145,10 @@ class AZOrangePredictor:
         self.mountPoint = None
         self.modelLocation = modelPath
         self.preDefSignatureFile = self.getDataFile(modelPath)
+        self._preCalcData = None
+        self._descTypes = None
 
-        self.model = AZBaseClasses.modelRead(self.modelLocation) 
+        self.model = AZBaseClasses.modelRead(self.modelLocation, useCache = True) 
         if not self.model:
             print "ERROR: Cannot load model ",modelPath
             return None
@@ -142,7 +172,7 @@ class AZOrangePredictor:
         #    Signatures
         if "sign" in DescMethodsAvailable and signatureHeight:
             print "Calculating signatures..."
-            preCalcData = dataUtilities.DataTable(self.preDefSignatureFile)
+            preCalcData = self.getPreCalcData()
             startHeight = 0                # Not used desc ignored in model prediction
             endHeight = signatureHeight
             dataSign,cmpdSignDict, cmpdSignList, sdfStr  = getSignatures.getSignatures(smilesData, startHeight, endHeight, preCalcData, returnAtomID=True)
@@ -307,11 +337,27 @@ class AZOrangePredictor:
         return os.path.join(modelPath, infoFile)
 
 
+    def getPreCalcData(self):
+        """Returns a copy of the pre-calculated signatures data of the model. The file is only read once."""
+        if self._preCalcData is None:
+            self._preCalcData = dataUtilities.DataTable(self.preDefSignatureFile)
+        return dataUtilities.DataTable(self._preCalcData)
+
+
+    def getDescTypes(self):
+        """Returns the types of the model descriptors (see descUtilities.getDescTypes). They are only determined once."""
+        if self._descTypes is None:
+            self._descTypes = descUtilities.getDescTypes(self.model.varNames)
+        return self._descTypes
+
+
     def getSmilesData(self, smiles):
-        # Create an Orange ExampleTable with a smiles attribute
+        # Create an Orange ExampleTable with a smiles attribute, with one example for each SMILES if smiles is a list
+        if isinstance(smiles, basestring):
+            smiles = [smiles]
         smilesAttr = orange.StringVariable("SMILEStoPred")  
         myDomain = orange.Domain([smilesAttr], 0)
-        self.smilesData = dataUtilities.DataTable(myDomain, [[smiles]])
+        self.smilesData = dataUtilities.DataTable(myDomain, [[smi] for smi in smiles])
 
 
     def setDescriptors(self, ex):
@@ -320,11 +366,13 @@ class AZOrangePredictor:
 
 
     def getDescriptors(self, smiles):
+        """Calculates the model descriptors of smiles, a SMILES or a list of SMILES, and sets them in exToPred.
+           A single compound for which the descriptors could not be calculated is tried again up to 3 times.
+           In a list, those compounds are kept with missing descriptors, as they would make all the others to be
+           calculated again.
+        """
         self.getSmilesData(smiles)
 
-        # Calculate descriptors defined in the model files
-        descList = self.model.varNames
-   
         savedSmilesData = dataUtilities.DataTable(self.smilesData)
 
         #Try 3 time to get All compounds descriptors
@@ -336,12 +384,12 @@ class AZOrangePredictor:
                 traceLog = "Model Location:"+str(self.modelLocation)+"\n"
                 nBadEx = 0        
                 # Determine Signature and non-Signature descriptor names
-                cinfonyDesc, clabDesc, signatureHeight, bbrcDesc, signDesc = descUtilities.getDescTypes(descList)
+                cinfonyDesc, clabDesc, signatureHeight, bbrcDesc, signDesc = self.getDescTypes()
                 # Signatures
                 if "sign" in DescMethodsAvailable and signatureHeight:
                     traceLog += "Calculating signatures...\n"
                     print "Calculating signatures...."
-                    preCalcData = dataUtilities.DataTable(self.preDefSignatureFile)
+                    preCalcData = self.getPreCalcData()
                     startHeight = 0                # Not used desc ignored in model prediction
                     endHeight = signatureHeight  
                     self.smilesData  = getSignatures.getSignatures(self.smilesData, startHeight, endHeight, preCalcData)
@@ -368,7 +416,11 @@ class AZOrangePredictor:
                 for ex in self.smilesData:
                    if sum([ex[attr].isSpecial() for attr in self.smilesData.domain.attributes]) == len(self.smilesData.domain.attributes):
                         nBadEx +=1
-                if nBadEx:
+                if nBadEx and len(self.smilesData) > 1:
+                    traceLog += "WARNING: Desc. Calculation: From the "+str(len(self.smilesData))+" compounds, "+str(nBadEx)+" could not be calculated!\n"
+                    print "WARNING: Desc. Calculation: From the "+str(len(self.smilesData))+" compounds, "+str(nBadEx)+" could not be calculated!"
+                    nTry = 0
+                elif nBadEx:
                     traceLog += "WARNING: Desc. Calculation: From the "+str(len(self.smilesData))+" compounds, "+str(nBadEx)+" could not be calculated!\n"
                     print "WARNING: Desc. Calculation: From the "+str(len(self.smilesData))+" compounds, "+str(nBadEx)+" could not be calculated!"
                     print "WARNING:   Tying again..."
@@ -394,7 +446,7 @@ class AZOrangePredictor:
         self.getSmilesData(smiles) 
 
         # Signatures
-        preCalcData = dataUtilities.DataTable(self.preDefSignatureFile)
+        preCalcData = self.getPreCalcData()
         startHeight = 0
         endHeight = 1
         dataSign  = getSignatures.getSignatures(self.smilesData, startHeight, endHeight, preCalcData)
@@ -420,6 +472,52 @@ class AZOrangePredictor:
 
         return prediction
 
+    def predictBatch(self):
+        """Predicts all the compounds in exToPred at once (see AZBaseClasses.AZClassifier.predictBatch).
+           Returns a list with the prediction of each compound as returned by predict, or None for the compounds
+           that could not be predicted.
+        """
+        try:
+            values = self.model.predictBatch(self.exToPred)
+        except Exception, e:
+            raise Exception("Could not predict: " + str(e))
+        if values is None:
+            raise Exception("Could not predict: The descriptors are not compatible with the model")
+        predictions = []
+        for value in values:
+            if numpy.isnan(value):
+                predictions.append(None)
+            elif self.model.classVar.varType == orange.VarTypes.Discrete:
+                predictions.append(self.model.classVar.values[int(value)])
+            else:
+                predictions.append(float(value))
+        return predictions
+
+    def predictSmilesList(self, smilesList):
+        """Calculates the descriptors of all the SMILES in smilesList and predicts them in one batch.
+           Returns the tuple (predictions, stats) where predictions are in the order of smilesList and stats is
+           a dict with the number of compounds, the time in seconds spent calculating the descriptors and 
+           predicting, and the throughput in compounds per second.
+        """
+        startTime = time.time()
+        self.getDescriptors(smilesList)
+        descTime = time.time()
+        predictions = self.predictBatch()
+        predTime = time.time()
+        stats = {"nCmpds"     : len(smilesList),
+                 "descTime"   : descTime - startTime,
+                 "predTime"   : predTime - descTime,
+                 "totalTime"  : predTime - startTime,
+                 "cmpdsPerSec": len(smilesList) / max(predTime - startTime, 1e-6)}
+        return predictions, stats
+
+    def predictSmilesFile(self, smilesFile):
+        """Same as predictSmilesList with the SMILES in the file smilesFile (see readSmiles)"""
+        fileh = open(smilesFile)
+        smilesList = readSmiles(fileh.read())
+        fileh.close()
+        return self.predictSmilesList(smilesList)
+
     def processSignificance(self, smi, prediction, orderedDesc, res, resultsPath, exWithDesc = None, idx = 0, topN = 1, regMinIsDesired = True):
         """descs* = [(1.3, ["LogP"]), (0.2, ["[So2]", ...]), ...]
            res =  { "signature"     : "",       
@@ -760,6 +858,85 @@ class AZOrangePredictor:
         return res
         
 
+def readSmiles(text):
+    """Returns the list of SMILES in text: the first word of each line. Empty lines and lines starting with # are ignored."""
+    smilesList = []
+    for line in text.splitlines():
+        if line.strip() and not line.strip().startswith("#"):
+            smilesList.append(line.split()[0])
+    return smilesList
+
+
+class PredictorRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles the requests to the predictor server:
+           POST /predict   Body with one SMILES per line. Returns in JSON the predictions and the stats of the request
+           GET  /stats     Returns in JSON the accumulated stats of all the requests served
+    """
+    def _sendJSON(self, code, result):
+        body = json.dumps(result)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+        self._sendJSON(200, self.server.totals)
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_error(404)
+            return
+        smilesList = readSmiles(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+        if not smilesList:
+            self._sendJSON(400, {"error": "No SMILES to predict"})
+            return
+        try:
+            predictions, stats = self.server.predictor.predictSmilesList(smilesList)
+        except Exception, e:
+            self._sendJSON(500, {"error": str(e)})
+            return
+        totals = self.server.totals
+        totals["requests"] += 1
+        for key in ("nCmpds", "descTime", "predTime", "totalTime"):
+            totals[key] += stats[key]
+        totals["cmpdsPerSec"] = totals["nCmpds"] / max(totals["totalTime"], 1e-6)
+        self._sendJSON(200, {"predictions": [{"smiles": smi, "prediction": pred} for smi, pred in zip(smilesList, predictions)],
+                             "stats": stats})
+        print "Predicted %d compounds in %.3fs (descriptors %.3fs, prediction %.3fs): %.1f cmpds/s" % \
+              (stats["nCmpds"], stats["totalTime"], stats["descTime"], stats["predTime"], stats["cmpdsPerSec"])
+
+
+def createServer(modelPath, port = 8000, host = "localhost"):
+    """Returns the HTTPServer of the predictions of the model in modelPath on http://host:port (see PredictorRequestHandler),
+       or None if the model could not be loaded. Port 0 uses any free port (server.server_port).
+       The model, its domain and the descriptors definitions are loaded once and kept for all the requests.
+    """
+    predictor = AZOrangePredictor(modelPath)
+    if not predictor.model:
+        return None
+    server = BaseHTTPServer.HTTPServer((host, port), PredictorRequestHandler)
+    server.predictor = predictor
+    server.totals = {"requests": 0, "nCmpds": 0, "descTime": 0.0, "predTime": 0.0, "totalTime": 0.0, "cmpdsPerSec": 0.0}
+    return server
+
+
+def serve(modelPath, port = 8000, host = "localhost"):
+    """Serves the predictions of the model in modelPath on http://host:port until interrupted (see createServer)"""
+    server = createServer(modelPath, port, host)
+    if not server:
+        return None
+    print "Serving the predictions of "+str(modelPath)+" on http://"+host+":"+str(server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
 if __name__ == "__main__":
     #modelPath = "../../tests/source/data/DescModel.model"  # Just RDK descriptors and RDK Fingerprints
     modelPath = "../../tests/source/data/BBRC_RDK_RDKFP.model"
@@ -4,6 +4,7 @@ import Orange
 import orange
 import math
 import copy
+import numpy
 
 """
 Module for calculation of non conformity scores and the corresponding p-values and
@@ -11,12 +12,15 @@ conformal predictions for binary classifiers.
 getPvalue
 	|
 	|
-	getScore
+	getScore  or  NeighbourIndex.getScores
 		|
 		|
 		{Methods to calculate the non-conf score}
 """
 
+# Non-conformity scores that can be computed from a NeighbourIndex
+INDEXMETHODS = ["minNN", "avgNN", "kNNratio", "kNNratioStruct"]
+
 
 def meanStd(data):
     """ Calculate mean and standard deviation of data data[]: """
@@ -66,6 +70,184 @@ def getScore(idx, extTrain, method = "minNN", maxDistRatio = None, measure = Non
     return alpha
 
 
+class NeighbourIndex:
+    """
+    Nearest neighbour statistics of the examples in a training set for the non-conformity scores
+    minNN, avgNN, kNNratio and kNNratioStruct.
+    The distances between the training examples are computed only once. In getScores, only the distances
+    from the example to predict to the training examples are computed, and the statistics of each training
+    example are updated with that single new neighbour.
+    Without a measure, the Euclidean distances are normalized with the attribute ranges of the training set and
+    the example to predict, as done by getScore. When that example is out of the training ranges, the statistics
+    of the training examples are computed again with the new ranges.
+    With structural = True, the distances are the negative Tanimoto similarities of the SMILES_1 fingerprints.
+    """
+    def __init__(self, train, measure = None, structural = False, k = 10):
+        self.k = k
+        self.structural = structural
+        self.measure = measure
+        self.nTrain = len(train)
+        self.labels = numpy.array([str(ex.get_class().value) for ex in train])
+        self.X = None
+        self._lastEx = None
+        self._lastDist = None
+        if structural:
+            self.fps = [self.__fingerprint(ex) for ex in train]
+        else:
+            self.train = dataUtilities.attributeDeselectionData(train, ["SMILES_1"])
+            if not self.measure:
+                self.isDiscrete = numpy.array([attr.varType == orange.VarTypes.Discrete for attr in self.train.domain.attributes])
+                X = self.train.toNumpyMA()[0]
+                if numpy.ma.getmaskarray(X).any():
+                    # Use the Orange measure to handle the missing values
+                    self.measure = orange.ExamplesDistanceConstructor_Euclidean(self.train)
+                else:
+                    self.Xraw = numpy.ma.filled(X, 0).astype(float)
+                    self.Xmin = self.Xraw.min(0)
+                    self.Xmax = self.Xraw.max(0)
+                    self.__normalize(self.__ranges(self.Xmin, self.Xmax))
+        self.__buildStats()
+        # The statistics with the ranges of the training set, restored after an example out of those ranges
+        self._trainStats = None
+        if self.X is not None:
+            self._trainStats = (self.ranges, self.X, self.__getStats())
+
+    def __ranges(self, xMin, xMax):
+        ranges = xMax - xMin
+        ranges[ranges == 0] = 1.0
+        ranges[self.isDiscrete] = 1.0
+        return ranges
+
+    def __normalize(self, ranges):
+        self.ranges = ranges
+        self.X = self.Xraw / ranges
+
+    def __getStats(self):
+        return (self.sameNN, self.diffNN, self.kNN, self.maxDiff, self.nSameAtKm1, self.nSameAtK)
+
+    def __useRanges(self, ranges):
+        """Normalizes the training set with ranges and sets the statistics of the training examples for them"""
+        if (ranges == self.ranges).all():
+            return
+        if (ranges == self._trainStats[0]).all():
+            self.ranges, self.X, stats = self._trainStats
+            self.sameNN, self.diffNN, self.kNN, self.maxDiff, self.nSameAtKm1, self.nSameAtK = stats
+        else:
+            self.__normalize(ranges)
+            self.__buildStats()
+
+    def __fingerprint(self, ex):
+        from rdkit import Chem
+        from rdkit.Chem.Fingerprints import FingerprintMols
+        # Daylight like fp
+        return FingerprintMols.FingerprintMol(Chem.MolFromSmiles(ex["SMILES_1"].value))
+
+    def __distances(self, ex):
+        """Returns the distances from ex to all the training examples"""
+        if self.structural:
+            from rdkit import DataStructs
+            fp = self.__fingerprint(ex)
+            return -numpy.array(DataStructs.BulkTanimotoSimilarity(fp, self.fps))
+        ex = orange.Example(self.train.domain, ex)
+        if self.X is not None:
+            x = dataUtilities.DataTable(self.train.domain, [ex]).toNumpyMA()[0]
+            if not numpy.ma.getmaskarray(x).any():
+                x = numpy.ma.filled(x, 0)[0].astype(float)
+                self.__useRanges(self.__ranges(numpy.minimum(self.Xmin, x), numpy.maximum(self.Xmax, x)))
+                diff = self.X - x / self.ranges
+                diff[:, self.isDiscrete] = diff[:, self.isDiscrete] != 0
+                return numpy.sqrt((diff**2).sum(1))
+            self.__useRanges(self._trainStats[0])
+            if not self.measure:
+                self.measure = orange.ExamplesDistanceConstructor_Euclidean(self.train)
+        return numpy.array([self.measure(ex, trainEx) for trainEx in self.train])
+
+    def __smallest(self, dist):
+        """Returns the k smallest values in dist, sorted and padded with inf"""
+        smallest = numpy.empty(self.k)
+        smallest.fill(numpy.inf)
+        dist = numpy.sort(dist)[:self.k]
+        smallest[:len(dist)] = dist
+        return smallest
+
+    def __rowStats(self, dist, same):
+        """Returns the neighbour statistics for the distances dist, where same flags the neighbours with the same label"""
+        diffDist = dist[~same]
+        if len(diffDist):
+            maxDiff = diffDist.max()
+        else:
+            maxDiff = -numpy.inf
+        kNN = self.__smallest(dist)
+        nSameAtK = (same & (dist <= kNN[-1])).sum()
+        nSameAtKm1 = (same & (dist <= kNN[-2])).sum()
+        return self.__smallest(dist[same]), self.__smallest(diffDist), maxDiff, kNN, nSameAtKm1, nSameAtK
+
+    def __buildStats(self):
+        n = self.nTrain
+        self.sameNN = numpy.empty((n, self.k))
+        self.diffNN = numpy.empty((n, self.k))
+        self.kNN = numpy.empty((n, self.k))
+        self.maxDiff = numpy.empty(n)
+        self.nSameAtKm1 = numpy.empty(n)
+        self.nSameAtK = numpy.empty(n)
+        others = numpy.ones(n, bool)
+        for idx in range(n):
+            if self.structural:
+                from rdkit import DataStructs
+                dist = -numpy.array(DataStructs.BulkTanimotoSimilarity(self.fps[idx], self.fps))
+            elif self.X is not None:
+                diff = self.X - self.X[idx]
+                diff[:, self.isDiscrete] = diff[:, self.isDiscrete] != 0
+                dist = numpy.sqrt((diff**2).sum(1))
+            else:
+                dist = numpy.array([self.measure(self.train[idx], trainEx) for trainEx in self.train])
+            others[idx] = False
+            stats = self.__rowStats(dist[others], (self.labels == self.labels[idx])[others])
+            others[idx] = True
+            self.sameNN[idx], self.diffNN[idx], self.maxDiff[idx], self.kNN[idx], self.nSameAtKm1[idx], self.nSameAtK[idx] = stats
+
+    def __alpha(self, method, sameNN, diffNN, maxDiff, nSameKNN, maxDistRatio = None):
+        """Vectorized non-conformity scores from the neighbour statistics of each example"""
+        if method == "minNN":
+            minSame = sameNN[:,0]
+            minDiff = diffNN[:,0]
+            ratio = minSame/numpy.where(minDiff == 0, 1.0, minDiff)
+            if maxDistRatio:
+                return numpy.where(minDiff == 0, 1.0, ratio/maxDistRatio)
+            else:
+                return numpy.where(minDiff == 0, maxDiff, ratio)
+        elif method == "avgNN":
+            avgSame = numpy.where(numpy.isinf(sameNN), 0, sameNN).sum(1)/10.0
+            avgDiff = numpy.where(numpy.isinf(diffNN), 0, diffNN).sum(1)/10.0
+            return numpy.where(avgDiff == 0, maxDiff, avgSame/numpy.where(avgDiff == 0, 1.0, avgDiff))
+        else:   # kNNratio and kNNratioStruct
+            return 1.00 - nSameKNN/10.0
+
+    def getScores(self, predEx, label, method = "avgNN", maxDistRatio = None):
+        """
+        Returns the list of non-conformity scores of the training examples followed by the score of predEx
+        when predEx is appended to the training set with the class label
+        """
+        # The distances of predEx are reused for all the labels
+        if predEx is not self._lastEx:
+            self._lastEx = predEx
+            self._lastDist = self.__distances(predEx)
+        dist = self._lastDist
+        same = self.labels == str(label)
+        col = dist[:,numpy.newaxis]
+
+        # Update the statistics of the training examples with predEx as a new neighbour
+        sameNN = numpy.where(same[:,numpy.newaxis], numpy.sort(numpy.hstack([self.sameNN, col]), 1)[:, :self.k], self.sameNN)
+        diffNN = numpy.where(same[:,numpy.newaxis], self.diffNN, numpy.sort(numpy.hstack([self.diffNN, col]), 1)[:, :self.k])
+        maxDiff = numpy.where(same, self.maxDiff, numpy.maximum(self.maxDiff, dist))
+        kDist = self.kNN[:, -1]
+        nSameKNN = numpy.where(dist < kDist, self.nSameAtKm1 + same, self.nSameAtK + same * (dist == kDist))
+        alphas = list(self.__alpha(method, sameNN, diffNN, maxDiff, nSameKNN, maxDistRatio))
+
+        # The score of predEx itself
+        predSameNN, predDiffNN, predMaxDiff, predKNN, predNSameAtKm1, predNSameAtK = self.__rowStats(dist, same)
+        alphas.append(self.__alpha(method, predSameNN[numpy.newaxis], predDiffNN[numpy.newaxis], numpy.array([predMaxDiff]), numpy.array([predNSameAtK]), maxDistRatio)[0])
+        return [float(alpha) for alpha in alphas]
 
 
 def descRange(idx, extTrain):
@@ -552,33 +734,40 @@ def getMinDistRatio(train):
     return maxDistRatio 
         
 
-def getPvalue(train, predEx, label, method = "avgNN", measure = None):
+def getPvalue(train, predEx, label, method = "avgNN", measure = None, index = None, useIndex = True):
     """
     method; avgNN, scaledMinNN, minNN, kNNratio
+    index; NeighbourIndex of train to be reused between calls. Only used by the methods in INDEXMETHODS
+    useIndex; If False, the scores of the methods in INDEXMETHODS are computed pair by pair with getScore
     """
 
-    # Set label to class of predEx
-    newPredEx = Orange.data.Table(predEx.domain, [predEx])
-    newPredEx[0][newPredEx.domain.classVar] = label
+    # Calculate a non-conf score for each ex in train + predEx with given label
+    if method in INDEXMETHODS and useIndex:
+        if not index:
+            index = NeighbourIndex(train, measure, structural = method == "kNNratioStruct")
+        nonConfList = index.getScores(predEx, label, method)
+    else:
+        # Set label to class of predEx
+        newPredEx = Orange.data.Table(predEx.domain, [predEx])
+        newPredEx[0][newPredEx.domain.classVar] = label
 
-    # Add predEx to train
-    extTrain = dataUtilities.concatenate([train, newPredEx])
-    extTrain = extTrain[0]
+        # Add predEx to train
+        extTrain = dataUtilities.concatenate([train, newPredEx])
+        extTrain = extTrain[0]
 
-    # Calculate a non-conf score for each ex in train + predEx with given label
-    if method == "scaledMinNN":
-        # Calculate average and std of min distanses in train set
-        maxDistRatio = getMinDistRatio(train)
-    nonConfList = []
-    for idx in range(len(extTrain)):
         if method == "scaledMinNN":
-            alpha = getScore(idx, extTrain, method, maxDistRatio)
-        else:
-            alpha = getScore(idx, extTrain, method, None, measure)
-        nonConfList.append(alpha)
-        #if idx == 1: 
-        #    print "Breaking after one ex!!"
-        #    break
+            # Calculate average and std of min distanses in train set
+            maxDistRatio = getMinDistRatio(train)
+        nonConfList = []
+        for idx in range(len(extTrain)):
+            if method == "scaledMinNN":
+                alpha = getScore(idx, extTrain, method, maxDistRatio)
+            else:
+                alpha = getScore(idx, extTrain, method, None, measure)
+            nonConfList.append(alpha)
+            #if idx == 1: 
+            #    print "Breaking after one ex!!"
+            #    break
 
     nonConfListSorted = copy.deepcopy(nonConfList)
     nonConfListSorted.sort()
@@ -819,11 +1008,19 @@ def getIndPvalue(model, NClist, predEx, label, method = "avgNN", measure = None)
     return pvalue
 
 
-def getConfPred(train, work, method, measure = None, resultsFile = "CPresults.txt", verbose = False):
+def getConfPred(train, work, method, measure = None, resultsFile = "CPresults.txt", verbose = False, useIndex = True):
     """
     method - non-conformity score method
+    useIndex - If False, the scores are computed pair by pair with getScore instead of with a NeighbourIndex
     """
 
+    # The neighbours in train are computed once for all the examples in work
+    index = None
+    if useIndex and method in INDEXMETHODS:
+        index = NeighbourIndex(train, measure, structural = method == "kNNratioStruct")
+    elif useIndex and method == "combo":
+        index = NeighbourIndex(train, measure)
+
     # Get conformal predictions
     resDict = {}
     idx = 0
@@ -832,11 +1029,11 @@ def getConfPred(train, work, method, measure = None, resultsFile = "CPresults.tx
         pvalues = []
         for label in labels:
             if method == "combo":
-                pvalue1 = getPvalue(train, predEx, label, "kNNratio", measure)
+                pvalue1 = getPvalue(train, predEx, label, "kNNratio", measure, index, useIndex)
                 pvalue2 = getPvalue(train, predEx, label, "probPred")
                 pvalue = (pvalue1 + pvalue2)/2.0
             else:
-                pvalue = getPvalue(train, predEx, label, method, measure)
+                pvalue = getPvalue(train, predEx, label, method, measure, index, useIndex)
             pvalues.append(pvalue)
         actualLabel = predEx.get_class().value
         prediction = printResults(pvalues, labels, actualLabel, method, resultsFile)
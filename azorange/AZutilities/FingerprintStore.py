@@ -0,0 +1,166 @@
+"""
+In-process store of binary fingerprints for bulk Tanimoto similarity searches.
+
+The fingerprints are kept packed in a 2D numpy array of uint64 words, one row per fingerprint,
+together with the number of ON bits of each one. A query is compared against the whole store
+with a few vectorized operations (AND of the words and a byte lookup table popcount) instead of
+one Python long at a time as in evalUtilities.fastTanimotoSimilarity.
+
+    store = FingerprintStore.fromFile("fingerprints.txt")
+    sims = store.tanimoto("0100110...")           # Similarity to all the stored fingerprints
+    top = store.nearest("0100110...", 5)          # [(idx, similarity), ...] best first
+"""
+import numpy
+
+# Number of ON bits of each possible byte
+POPCOUNT8 = numpy.array([bin(x).count("1") for x in range(256)], dtype = numpy.uint8)
+
+# Maximum number of words compared at once in the many-vs-many searches (bounds the temporary arrays)
+MAXCHUNKWORDS = 2**22
+
+
+def popcount(words):
+    """Returns the number of ON bits in each row of the uint64 2D array words"""
+    words = numpy.ascontiguousarray(words, dtype = numpy.uint64)
+    asBytes = words.view(numpy.uint8).reshape(words.shape[:-1] + (words.shape[-1] * 8,))
+    return POPCOUNT8[asBytes].sum(axis = -1, dtype = numpy.int32)
+
+
+def packFingerprints(fingerprints, nBits = None):
+    """Packs the fingerprints into a 2D uint64 array with one row per fingerprint.
+       Each fingerprint can be a string of '0' and '1' (as used by evalUtilities.tanimotoSimilarity),
+       a long integer (as used by evalUtilities.fastTanimotoSimilarity) or a sequence of 0/1 values.
+       nBits is the size of the fingerprints. If not defined, the size of the longest bit string is used.
+       Returns the tuple (packed, nBits)
+    """
+    bitStrings = []
+    for fp in fingerprints:
+        if isinstance(fp, (int, long)):
+            bitStrings.append(bin(fp)[2:])
+        elif isinstance(fp, str):
+            bitStrings.append(fp.strip())
+        else:
+            bitStrings.append("".join([str(int(bit)) for bit in fp]))
+    if nBits is None:
+        nBits = max([len(bits) for bits in bitStrings] + [1])
+    nWords = (nBits + 63) / 64
+    bits = numpy.zeros((len(bitStrings), nWords * 64), dtype = numpy.uint8)
+    for idx, bitStr in enumerate(bitStrings):
+        if len(bitStr) > nBits:
+            raise ValueError("Fingerprint " + str(idx) + " has more than " + str(nBits) + " bits")
+        # Right aligned so that bit strings and longs of the same fingerprint are packed the same way
+        bits[idx, nBits - len(bitStr):nBits] = numpy.fromstring(bitStr, dtype = numpy.uint8) - ord("0")
+    packed = numpy.packbits(bits, axis = 1).view(numpy.uint64)
+    return packed.reshape((len(bitStrings), nWords)), nBits
+
+
+class FingerprintStore(object):
+    """Stores binary fingerprints packed in uint64 words for fast Tanimoto searches.
+       The Tanimoto similarity is defined as in evalUtilities.tanimotoSimilarity:
+             ts = c/(a+b-c)
+       and is 0.0 when both fingerprints have no ON bits.
+    """
+    def __init__(self, fingerprints = None, nBits = None):
+        self.nBits = nBits
+        self.fps = None
+        self.nOnBits = None
+        if fingerprints is not None:
+            self.fps, self.nBits = packFingerprints(fingerprints, nBits)
+            self.nOnBits = popcount(self.fps)
+
+    def __len__(self):
+        if self.fps is None:
+            return 0
+        return len(self.fps)
+
+    def add(self, fingerprints):
+        """Appends the fingerprints to the store"""
+        packed, nBits = packFingerprints(fingerprints, self.nBits)
+        if self.fps is None:
+            self.fps, self.nBits = packed, nBits
+            self.nOnBits = popcount(packed)
+        else:
+            self.fps = numpy.concatenate((self.fps, packed))
+            self.nOnBits = numpy.concatenate((self.nOnBits, popcount(packed)))
+
+    def _packQueries(self, queries):
+        """Packs the queries with the same number of bits as the stored fingerprints"""
+        if isinstance(queries, numpy.ndarray) and queries.dtype == numpy.uint64:
+            return queries.reshape((-1, self.fps.shape[1]))
+        return packFingerprints(queries, self.nBits)[0]
+
+    def tanimoto(self, query):
+        """Returns a numpy array with the Tanimoto similarity of query to each of the stored fingerprints"""
+        if not len(self):
+            return numpy.zeros(0)
+        q = self._packQueries([query])
+        nCommon = popcount(self.fps & q)
+        nUnion = popcount(q)[0] + self.nOnBits - nCommon
+        return numpy.where(nUnion > 0, nCommon / numpy.maximum(nUnion, 1).astype(float), 0.0)
+
+    def tanimotoMatrix(self, queries, chunkSize = None):
+        """Returns a 2D numpy array with the Tanimoto similarity of each query (rows) to each
+           of the stored fingerprints (columns).
+           The queries are processed in chunks of chunkSize queries to bound the memory used.
+        """
+        q = self._packQueries(queries)
+        res = numpy.zeros((len(q), len(self)))
+        if not len(self) or not len(q):
+            return res
+        if not chunkSize:
+            chunkSize = max(1, MAXCHUNKWORDS / self.fps.size)
+        nOnQ = popcount(q)
+        for start in range(0, len(q), chunkSize):
+            end = min(start + chunkSize, len(q))
+            nCommon = popcount(q[start:end, numpy.newaxis, :] & self.fps[numpy.newaxis, :, :])
+            nUnion = nOnQ[start:end, numpy.newaxis] + self.nOnBits[numpy.newaxis, :] - nCommon
+            res[start:end] = numpy.where(nUnion > 0, nCommon / numpy.maximum(nUnion, 1).astype(float), 0.0)
+        return res
+
+    def nearest(self, query, k, minSimilarity = 0.0):
+        """Returns a list with the k most similar fingerprints as (idx, similarity) tuples, most similar first.
+           Only fingerprints with a similarity of at least minSimilarity are returned.
+           Ties are returned by order in the store.
+        """
+        return self._topK(self.tanimoto(query), k, minSimilarity)
+
+    def nearestMatrix(self, queries, k, minSimilarity = 0.0, chunkSize = None):
+        """Same as nearest but for a list of queries. Returns one list for each query"""
+        return [self._topK(sims, k, minSimilarity) for sims in self.tanimotoMatrix(queries, chunkSize)]
+
+    def _topK(self, sims, k, minSimilarity):
+        if not len(sims) or k <= 0:
+            return []
+        k = min(k, len(sims))
+        if k < len(sims) and hasattr(numpy, "partition"):
+            # Keep all the ties with the k-th best similarity so that the order by index is kept
+            kth = -numpy.partition(-sims, k - 1)[k - 1]
+            candidates = numpy.nonzero(sims >= kth)[0]
+        else:
+            candidates = numpy.arange(len(sims))
+        order = numpy.lexsort((candidates, -sims[candidates]))[:k]
+        return [(int(candidates[i]), float(sims[candidates[i]])) for i in order if sims[candidates[i]] >= minSimilarity]
+
+    def save(self, path):
+        """Saves the packed fingerprints in numpy .npz format"""
+        numpy.savez(path, fps = self.fps, nOnBits = self.nOnBits, nBits = numpy.array([self.nBits]))
+
+    @staticmethod
+    def load(path):
+        """Loads a store saved with save"""
+        data = numpy.load(path)
+        store = FingerprintStore()
+        store.fps = data["fps"]
+        store.nOnBits = data["nOnBits"]
+        store.nBits = int(data["nBits"][0])
+        return store
+
+    @staticmethod
+    def fromFile(path, nBits = None):
+        """Creates the store from a text file with one fingerprint bit string per line.
+           If the lines have tab separated fields, the last field is used as the fingerprint.
+        """
+        file = open(path, "r")
+        fingerprints = [line.strip().split("\t")[-1] for line in file if line.strip()]
+        file.close()
+        return FingerprintStore(fingerprints, nBits)
@@ -104,6 +104,8 @@ class MahalanobisDistanceCalculator:
         self.norm = None
         self.centre = None
         self.NoSqrt = False
+        self.trainNormSq = None     # Squared norms of the training rows, used by calculateBatchDistances
+        self.trainTransformed = None
 
         if (invCovMatFile is not None and not os.path.isfile(invCovMatFile)):
             raise Exception("Cannot locate the Inv. Cov. Matrix file: "+str(invCovMatFile))
@@ -172,6 +174,94 @@ class MahalanobisDistanceCalculator:
             raise
             
     
+    def _batch_init(self):
+        """Transforms the training set once for the matrix computation of the distances"""
+        if self.norm is None:
+            self._lazy_init()
+        train = numpy.asarray(self.training_set.data_table, numpy.float)
+        if self.NoSqrt:
+            # (v-t)' ICM (v-t) = v' ICM v + t' ICM t - 2 v' ICM t
+            self.trainTransformed = numpy.dot(train, self.norm)
+            self.trainNormSq = numpy.sum(self.trainTransformed * train, 1)
+        else:
+            # The data table is already Mahalanobis transformed
+            self.trainTransformed = train
+            self.trainNormSq = numpy.sum(train * train, 1)
+
+    def calculateBatchDistances(self, descriptor_matrix, count, chunkSize = None):
+        """ Same as calculateDistances for each row of descriptor_matrix.
+            All the distances of a chunk of rows to the training set are computed with a single matrix 
+            product and only the count nearest are sorted.
+            Returns a list with the dict of distances of each row
+        """
+        if self.trainTransformed is None:
+            self._batch_init()
+        V = numpy.asarray(descriptor_matrix, numpy.float)
+        if V.ndim == 1:
+            V = V.reshape(1, -1)
+        nTrain = len(self.trainTransformed)
+        train = numpy.asarray(self.training_set.data_table, numpy.float)
+        if not chunkSize:
+            # Keep the distance matrix of each chunk around 10M elements
+            chunkSize = max(1, 10000000 / max(nTrain, 1))
+        k = min(count, nTrain)
+        scale = (15.0 / V.shape[1]) ** 0.5
+        MDlist = []
+        for start in range(0, len(V), chunkSize):
+            chunk = V[start:start + chunkSize]
+            # Distance to the center
+            centered = chunk - self.center
+            if self.NoSqrt:
+                MD = numpy.sum(numpy.dot(centered, self.norm) * centered, 1) ** 0.5
+                chunkNormSq = numpy.sum(numpy.dot(chunk, self.norm) * chunk, 1)
+            else:
+                chunk = numpy.dot(centered, self.norm.T)   # transform input descriptor vectors
+                MD = numpy.sum(chunk * chunk, 1) ** 0.5
+                chunkNormSq = numpy.sum(chunk * chunk, 1)
+            sqDist = chunkNormSq[:,numpy.newaxis] + self.trainNormSq[numpy.newaxis,:] - 2 * numpy.dot(chunk, self.trainTransformed.T)
+            # Select the k nearest without sorting all the distances
+            if k < nTrain and hasattr(numpy, "argpartition"):
+                nearestIdx = numpy.argpartition(sqDist, k-1, axis=1)[:, :k]
+            else:
+                nearestIdx = numpy.argsort(sqDist, axis=1)[:, :k]
+            # Recompute the k nearest distances exactly, avoiding the cancellation errors of the expansion
+            diff = train[nearestIdx] - chunk[:,numpy.newaxis,:]
+            if self.NoSqrt:
+                nearestDist = numpy.sum(numpy.dot(diff, self.norm) * diff, 2) ** 0.5
+            else:
+                nearestDist = numpy.sum(diff * diff, 2) ** 0.5
+            for row in range(len(chunk)):
+                nearest = sorted(zip(nearestDist[row], nearestIdx[row]))
+                MDlist.append(self._nearest_distances(MD[row], nearest, count, scale))
+        return MDlist
+
+    def _nearest_distances(self, MD, nearest, count, scale):
+        """ Builds the dict of distances from the distance to the center MD and the sorted list 
+            nearest with the (distance, index) of the nearest training set members"""
+        d = {"_MD": MD}
+        measured_list = self.training_set.measured_list
+        # get out information about nearest n. Count is usually 3.
+        for i in range(min(count, len(nearest))):
+            #if i == 0:
+                #name_suffix = "" # no suffix for first nearest.
+            #else:
+            name_suffix = str(i + 1)
+            dist, index = nearest[i]
+            # Get the closest term, (shortest distance), appropriately scaled
+            d["%s" % TRAIN  + NEAREST_DIST + name_suffix] = dist * scale
+            # get the ID of the nearest member of the training set
+            d["%s" % TRAIN  + NEAREST_ID + name_suffix] = self.training_set.id_list[index]
+            d["%s" % TRAIN + NEAREST_SMI + name_suffix] = self.training_set.smiles_list[index]
+       
+            # add the measured value of the nearest member of the training set
+            if measured_list is not None and measured_list[index] is not None:
+                d["%s" % TRAIN + NEAREST_MEASURED  + name_suffix] = measured_list[index]
+ 
+        # Get the average of the N nearest terms, appropriately scaled
+        avgdist = mean( [x[0] for x in nearest[:count]] )
+        d[_nearest_name(count)] = avgdist * scale
+        return d
+
     def _descriptor_distances(self, v, count):
         """ v is descriptor values for compound. count is number of neighbors we're interested in."""
         # Figure Pierre's scaling factor
@@ -41,7 +41,9 @@ inF.close()
 
 # All Learner's parameters from config file
 parameters = %(paramsConfigFile)s.%(learnerType)s
-dataSet=dataUtilities.DataTable("%(dataset)s")
+# When running inside the persistent evaluator (AZEvalServer.py) the dataSet is already loaded
+if "dataSet" not in globals():
+    dataSet=dataUtilities.DataTable("%(dataset)s")
 N_ATTR = len(dataSet.domain.attributes)
 N_EX = len(dataSet) - floor(len(dataSet)/%(nFolds)s)
 
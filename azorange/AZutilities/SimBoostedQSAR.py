@@ -24,6 +24,60 @@ methods = { "RDKit Topological"               :'rdk_topo_fps',
             #"AZO-pharmacophore fps"    :'azo_pharmacophore_fps'
 } 
 
+# Fingerprint function and similarity metric used by each of the fingerprint methods
+fingerprintTypes = {
+            'rdk_topo_fps'              :(lambda mol: FingerprintMols.FingerprintMol(mol), "Tanimoto"),
+            'rdk_MACCS_keys'            :(lambda mol: rdk.Chem.MACCSkeys.GenMACCSKeys(mol), "Tanimoto"),
+            'rdk_morgan_fps'            :(lambda mol: rdk.AllChem.GetMorganFingerprint(mol,2), "Dice"),
+            'rdk_morgan_features_fps'   :(lambda mol: rdk.AllChem.GetMorganFingerprint(mol,2,useFeatures=True), "Dice"),
+            'rdk_atompair_fps'          :(lambda mol: Pairs.GetAtomPairFingerprint(mol), "Dice")
+}
+
+
+class FingerprintCache(object):
+        """ Cache of the parsed molecules and of their fingerprints to be used in one run of getSimDescriptors
+                The molecules are kept by SMILES and the fingerprints by canonical SMILES and fingerprint method,
+                so each molecule is parsed and fingerprinted only once for each method.
+        """
+        def __init__(self):
+                self.mols = {}
+                self.canonicalSmiles = {}
+                self.fps = {}
+
+        def getMol(self, SMILES):
+                """ Returns the Chem-Mol of the SMILES (None if it cannot be parsed) """
+                if SMILES not in self.mols:
+                        mol = getMolFromSmiles(SMILES)
+                        self.mols[SMILES] = mol
+                        if mol:
+                                self.canonicalSmiles[SMILES] = rdk.Chem.MolToSmiles(mol, True)
+                return self.mols[SMILES]
+
+        def getFingerprint(self, SMILES, method):
+                """ Returns the fingerprint of type method (one of fingerprintTypes) of the SMILES
+                        or None if the SMILES cannot be parsed
+                """
+                mol = self.getMol(SMILES)
+                if not mol: return None
+                key = (self.canonicalSmiles[SMILES], method)
+                if key not in self.fps:
+                        self.fps[key] = fingerprintTypes[method][0](mol)
+                return self.fps[key]
+
+        def bulkSimilarity(self, fp, fps, method):
+                """ Returns the list of similarities of fp to each one of the fingerprints in fps using the 
+                        similarity metric of the method. The similarity with a missing (None) fingerprint is None.
+                """
+                if fp is None: return [None] * len(fps)
+                bulkSim = getattr(DataStructs, "Bulk" + fingerprintTypes[method][1] + "Similarity")
+                validIdx = [idx for idx, x in enumerate(fps) if x is not None]
+                sims = [None] * len(fps)
+                if validIdx:
+                        for idx, sim in zip(validIdx, bulkSim(fp, [fps[idx] for idx in validIdx])):
+                                sims[idx] = sim
+                return sims
+
+
 def getSimDescriptors(InActives, InData, methods, active_ids = None, pharmacophore_file = None, callBack = None):
         """ calculates similarity descriptors for a training set (orange object) using the 
                 given similarity methods against the given actives
@@ -88,74 +142,23 @@ def getSimDescriptors(InActives, InData, methods, active_ids = None, pharmacopho
         stepsDone   = 0  
         
         # fill up the data        
+        # Each molecule is parsed and fingerprinted only once for each method
+        fpCache = FingerprintCache()
+        smilesName = getSMILESAttr(newdata)
+        if not smilesName:
+            return None
         for m in methods:
-                if m == 'rdk_topo_fps':
-                        count = 1
-                        for a in actives:
-                                attname = m + '(active_'+ str(count)+ ')'
-                                for j in range(len(newdata)):
-                                        instance = newdata[j]
-                                        tmp = orange.Value(atts[att_idx], orng_sim_rdk_topo_fps(a, instance))
-                                        instance[atts[att_idx]] = tmp
-                                        if callBack: 
-                                            stepsDone += 1
-                                            if not callBack((100*stepsDone)/nTotalSteps): return None
-                                att_idx += 1        
-                                
-                elif m == 'rdk_MACCS_keys':
-                        count = 1
+                if m in fingerprintTypes:
+                        trainFPs = [fpCache.getFingerprint(str(instance[smilesName].value), m) for instance in newdata]
                         for a in actives:
-                                attname = m + '(active_'+ str(count)+ ')'
+                                sims = fpCache.bulkSimilarity(fpCache.getFingerprint(a, m), trainFPs, m)
                                 for j in range(len(newdata)):
                                         instance = newdata[j]
-                                        tmp = orange.Value(atts[att_idx], orng_sim_rdk_MACCS_keys(a, instance))
+                                        tmp = orange.Value(atts[att_idx], sims[j])
                                         instance[atts[att_idx]] = tmp
-                                        if callBack: 
-                                            stepsDone += 1
-                                            if not callBack((100*stepsDone)/nTotalSteps): return None
-
-                                att_idx += 1                
-
-                elif m == 'rdk_morgan_fps':
-                        count = 1
-                        for a in actives:
-                                attname = m + '(active_'+ str(count)+ ')'
-                                for j in range(len(newdata)):
-                                        instance = newdata[j]
-                                        tmp = orange.Value(atts[att_idx], orng_sim_rdk_morgan_fps(a, instance))
-                                        instance[atts[att_idx]] = tmp
-                                        if callBack: 
-                                            stepsDone += 1
-                                            if not callBack((100*stepsDone)/nTotalSteps): return None
-        
-                                att_idx += 1        
-                                
-                elif m == 'rdk_morgan_features_fps':
-                        count = 1
-                        for a in actives:
-                                attname = m + '(active_'+ str(count)+ ')'
-                                for j in range(len(newdata)):
-                                        instance = newdata[j]
-                                        tmp = orange.Value(atts[att_idx], orng_sim_rdk_morgan_features_fps(a, instance))
-                                        instance[atts[att_idx]] = tmp
-                                        if callBack: 
-                                            stepsDone += 1
-                                            if not callBack((100*stepsDone)/nTotalSteps): return None
-
-                                att_idx += 1        
-                                        
-                elif m == 'rdk_atompair_fps':
-                        count = 1
-                        for a in actives:
-                                attname = m + '(active_'+ str(count)+ ')'
-                                for j in range(len(newdata)):
-                                        instance = newdata[j]
-                                        tmp = orange.Value(atts[att_idx], orng_sim_rdk_atompair_fps(a, instance))
-                                        instance[atts[att_idx]] = tmp                
-                                        if callBack: 
-                                            stepsDone += 1
-                                            if not callBack((100*stepsDone)/nTotalSteps): return None
-
+                                if callBack: 
+                                    stepsDone += len(newdata)
+                                    if not callBack((100*stepsDone)/nTotalSteps): return None
                                 att_idx += 1        
         
                 elif m == 'azo_pharmacophore_fps':
@@ -1,4 +1,5 @@
 import commands, os,time,pickle,statc, sys,copy
+import multiprocessing, traceback
 import AZOrangeConfig as AZOC
 import AZLearnersParamsConfig as OPTconf
 import orange,orngTest
@@ -19,6 +20,10 @@ for ML in AZOC.MLMETHODS:
 
 #print "Available MLMETHODS:",[ml for ml in MLMETHODS]
 
+# Arguments of the fold jobs run in the local process pool of getStatistics.
+# Set before the pool is created so that the workers inherit them when forked
+_foldJobArgs = None
+
 def log(logFile, text):
         """Adds a new line (what's in text) to the logFile"""
         textOut = str(time.asctime()) + ": " +text
@@ -200,6 +205,9 @@ def buildModel(trainData, MLMethod, queueType = "NoSGE", verbose = 0, logFile =
         if smilesAttr:
             trainData = dataUtilities.attributeDeselectionData(trainData, [smilesAttr])
 
+        # The local process pool is only used for the folds of getStatistics
+        if queueType == "Local":
+            queueType = "NoSGE"
         # optimize all MLMethods
         for ML in MLMethods:
             log(logFile, "  Optimizing MLmethod: "+ML)
@@ -262,6 +270,7 @@ def getModel(trainData, mlList=[ml for ml in MLMETHODS if AZOC.MLMETHODS[ml]["us
             queueType              'NoSGE'   (without access to the distributed environment) - default
                                    'batch.q'
                                    'quick.q' (jobs start immediatly but are terminated after 30 min)
+                                   'Local'   (same as NoSGE here. Only getStatistics runs its folds in a local process pool)
             verbose             Define a verbose level (default = 0)
  
         """
@@ -395,6 +404,11 @@ def getStatistics(dataset, runningDir, resultsFile, mlList=[ml for ml in MLMETHO
                
             The running will be monitorized by this method.
             Whenever a MLMethod fails the respective fold job is restarted 
+
+            queueType   'NoSGE'     Run the fold jobs serially
+                        'Local'     Run the fold jobs in a pool of AZOC.QSARNLOCALWORKERS local processes
+                        'batch.q'   Submit the fold jobs to the SGE queue
+                        'quick.q'
         """
         if dataset.domain.classVar.varType == orange.VarTypes.Discrete: 
             responseType = "Classification"
@@ -430,6 +444,8 @@ def getStatistics(dataset, runningDir, resultsFile, mlList=[ml for ml in MLMETHO
             
             os.system("rm -rf "+jobs[job]["path"])
             os.system("mkdir -p "+jobs[job]["path"])
+            if queueType == "Local":    # Run latter in the local process pool
+                continue
             trainData.save(os.path.join(jobs[job]["path"],"trainData.tab"))
             file_h = open(os.path.join(jobs[job]["path"],"run.sh"),"w")
             file_h.write("#!/bin/tcsh\n")
@@ -505,7 +521,11 @@ def getStatistics(dataset, runningDir, resultsFile, mlList=[ml for ml in MLMETHO
         os.chdir(thisDir)
 
         finished = []
-        if queueType == "NoSGE":  
+        if queueType == "Local":
+            if not runLocalJobs(jobs, dataset, DataIdxs, mlList, getAllModels, runningDir, callBack = callBack):
+                return None
+            os.chdir(thisDir)
+        if queueType in ("NoSGE", "Local"):  
             failed = []
             #Report failed Jobs
             for job in jobs:
@@ -577,10 +597,12 @@ def getStatistics(dataset, runningDir, resultsFile, mlList=[ml for ml in MLMETHO
                         if getAllModels: print "MLMethod "+ml+" not available in fold "+job
                         continue
 
-                    resFile = os.path.join(jobs[job]["path"], "results.pkl")
-                    statFile_h = open(resFile)
-                    foldStat = pickle.load(statFile_h)
-                    statFile_h.close()
+                    foldStat = jobs[job].get("foldStat")
+                    if not foldStat:
+                        resFile = os.path.join(jobs[job]["path"], "results.pkl")
+                        statFile_h = open(resFile)
+                        foldStat = pickle.load(statFile_h)
+                        statFile_h.close()
 
                     #load model
                     model = AZBaseClasses.modelRead(modelPath)
@@ -626,6 +648,101 @@ def getStatistics(dataset, runningDir, resultsFile, mlList=[ml for ml in MLMETHO
         os.system(' echo "finished" > '+os.path.join(runningDir,"status"))
         return statistics
 
+def _runFoldJob(job):
+        """ Runs one fold job of getStatistics in a worker process of the local pool.
+            The models are saved in the job dir as done by the QsubScript.py of the SGE jobs and the 
+            job is returned with its status and the MLStatistics of the fold in "foldStat".
+        """
+        dataset, DataIdxs, mlList, getAllModels = miscUtilities.getLocalPoolArgs()
+        job["foldStat"] = None
+        try:
+            os.chdir(job["path"])
+            trainData = dataset.select(DataIdxs,int(job["job"]),negate=1)
+            resFile = os.path.join(job["path"],"results.pkl")
+            models = getModel(trainData, mlList=mlList, savePath = resFile, queueType = "NoSGE", getAllModels = getAllModels)
+            nModelsSaved = 0
+            for model in models:
+                if not models[model] is None:
+                    models[model].write(os.path.join(job["path"],"model_"+model))
+                    nModelsSaved += 1
+            if os.path.isfile(resFile):
+                statFile_h = open(resFile)
+                job["foldStat"] = pickle.load(statFile_h)
+                statFile_h.close()
+            if nModelsSaved == len([m for m in models if not models[m] is None]):
+                job["finished"] = True
+            else:
+                print "Job "+job["job"]+" failed to build all models"
+                job["failed"] = True
+        except:
+            print "ERROR on Job "+job["job"]
+            traceback.print_exc()
+            job["failed"] = True
+        return job
+
+
+def _failedLocalJob(job, error):
+        """ Returns the job of a local fold that raised an exception or whose worker process died """
+        print "ERROR on Job "+job["job"]+": "+error
+        job = copy.copy(job)
+        job["foldStat"] = None
+        job["finished"] = False
+        job["failed"] = True
+        return job
+
+
+def _isLocalJobFailed(job):
+        if job["finished"] and not isJobProgressingOK(job):
+            print "Job "+job["job"]+" failed to build one or more models in getMLStatistics"
+            job["failed"] = True 
+            job["finished"] = False 
+        return job["failed"]
+
+
+def _restartLocalJob(job, nRestart):
+        """ Backs up the outputs of a failed local fold job before running it again, as restartJob does for the SGE jobs """
+        print "\nJob "+job["job"]+ " is being reported as failing"
+        bkupDir = os.path.join(job["path"], "Bkup_"+str(nRestart))
+        print "  Backing up Job "+job["job"]+"..."
+        os.system("mkdir "+bkupDir)
+        for pattern in ("model_*", "results.*", "status"):
+            os.system("mv "+os.path.join(job["path"], pattern)+" "+bkupDir+" 2> /dev/null")
+        print "  Starting Job "+job["job"]+"..."
+        os.system('echo "Restarted at '+str(time.asctime())+'" >> '+os.path.join(job["path"],"restarts.log"))
+
+
+def runLocalJobs(jobs, dataset, DataIdxs, mlList, getAllModels = False, runningDir = None, nWorkers = AZOC.QSARNLOCALWORKERS, callBack = None):
+        """ Runs the fold jobs of getStatistics in a pool of nWorkers local processes (0 uses all the cores).
+            A job that fails, raises an exception or whose worker process dies is run again up to 
+            AZOC.QSARNLOCALRESTARTS times, like the SGE jobs are restarted by restartJob.
+            Each job is updated in jobs as soon as it is done.
+            Returns False if the callBack asked to stop the process, True otherwise.
+        """
+        jobNames = [job for job in jobs]
+        nWorkers = min(nWorkers or multiprocessing.cpu_count(), len(jobs))
+        print "Running "+str(len(jobs))+" fold jobs in "+str(nWorkers)+" local processes"
+
+        def onRestart(idx, job, nRestart):
+            _restartLocalJob(job, nRestart)
+
+        def onResult(idx, job, nDone):
+            jobs[job["job"]] = job
+            if job["failed"]:
+                print "Job "+job["job"]+" FAILED"    
+            else:
+                print time.asctime()+": Finished job "+job["job"]+" with success"
+            if runningDir:
+                os.system(' echo "'+str(nDone)+'/'+str(len(jobs))+'" > '+os.path.join(runningDir,"status"))
+            if callBack and not callBack((100*nDone)/len(jobs)):
+                return False
+            return True
+
+        results = miscUtilities.runInLocalPool(_runFoldJob, [jobs[job] for job in jobNames], nWorkers, \
+                    args = (dataset, DataIdxs, mlList, getAllModels), onResult = onResult, onError = _failedLocalJob, \
+                    isFailed = _isLocalJobFailed, maxRestarts = AZOC.QSARNLOCALRESTARTS, onRestart = onRestart)
+        return results is not None
+
+
 def writeResults(statObj, resultsFile):
         if resultsFile and os.path.isdir(os.path.split(resultsFile)[0]):
             file = open(resultsFile, "w")
@@ -731,10 +848,14 @@ def restartJob(jobObj, force = False):
 def isJobProgressingOK(job):
         runningJobDir = job["path"] 
         resFile = os.path.join(runningJobDir, "results.pkl")
-        if not os.path.isfile(resFile):
+        # The jobs run in the local pool already have the statistics in memory
+        statistics = job.get("foldStat")
+        if statistics:
+            n = 0
+        elif not os.path.isfile(resFile):
             return True
-        n = 50
-        statistics = None
+        else:
+            n = 50
         while n > 0:
             try:
                 statFile_h = open(resFile )
@@ -7,6 +7,9 @@ import os
 import time
 import commands
 import random
+import json
+import numpy
+from collections import OrderedDict
 from cinfony import rdk
 from opencv import ml
 from opencv import cv
@@ -104,7 +107,7 @@ def makeTempSDF(data, smilesAsName=None):
         return sdf_molsName
 
 
-def SeedDataSampler(data, nFolds):
+def SeedDataSampler(data, nFolds, version = 1):
     """ Samples the data for being used in Folds: Pseudo-Random Selected based on a Seed
         It assures that the sampling is constant for the same dataset using the same number of folds
         Outputs the respective fold indices, not the actual data.
@@ -117,6 +120,9 @@ def SeedDataSampler(data, nFolds):
         It is assured that examples are used as test exampels in only one testSet.
         In the case when nEx is not divisible by nFolds, the remaining examples will never 
           be part of a testSet, although they will always be included in the trainSets. 
+        version selects the sampling algorithm:
+            1 - The original sampling, in O(nEx*log(nEx)). Uses and changes the state of the random module.
+            2 - A seeded permutation of the examples, in O(nEx). The folds are not the same as in version 1.
         Usage sample:
             DataIdxs = dataUtilities.SeedDataSampler(self.data, self.nExtFolds)
             for foldN in range(self.nExtFolds):
@@ -129,17 +135,41 @@ def SeedDataSampler(data, nFolds):
     nTestEx = int(nEx/nFolds)
     if not nTestEx:
         return None
-    usedReg = [0] * nEx
     foldsIdxs = [0] * nEx
-
-    random.seed(nEx + nFolds + len(data.domain.attributes))
+    seed = nEx + nFolds + len(data.domain.attributes)
+
+    if version == 2:
+        perm = range(nEx)
+        random.Random(seed).shuffle(perm)
+        for pos, realIdx in enumerate(perm[:nFolds*nTestEx]):
+            foldsIdxs[realIdx] = pos / nTestEx + 1
+        return foldsIdxs
+
+    # Binary indexed tree (1-based) with the number of examples not yet used in a test fold, 
+    #   so that the Zidx'th unused example is found without scanning all the examples
+    tree = [0] + [idx & -idx for idx in range(1, nEx + 1)]
+    topBit = 1 << (nEx.bit_length() - 1)
+    nUnused = nEx
+    random.seed(seed)
     for idx in range(nFolds):
         for x in range(nTestEx):
-            Zidx = int(random.random() * (usedReg.count(0) - 1))
+            Zidx = int(random.random() * (nUnused - 1))
             #Find the index of the Zidx'th Zero  
-            realIdx = [idxReg[0] for idxReg in enumerate(usedReg) if idxReg[1]==0][Zidx]
-            usedReg[realIdx] = 1
+            realIdx = 0
+            rank = Zidx + 1
+            bit = topBit
+            while bit:
+                if realIdx + bit <= nEx and tree[realIdx + bit] < rank:
+                    realIdx += bit
+                    rank -= tree[realIdx]
+                bit >>= 1
             foldsIdxs[realIdx] = idx + 1
+            nUnused -= 1
+            # Mark it as used
+            pos = realIdx + 1
+            while pos <= nEx:
+                tree[pos] -= 1
+                pos += pos & -pos
 
     return foldsIdxs
 
@@ -201,6 +231,238 @@ def loadTXT(dataPath):
 
 
 
+def countLines(dataPath, blockSize = 1 << 20):
+    """Returns the number of lines in the file dataPath, as counted by 'wc -l', reading it in blocks of blockSize bytes"""
+    NLines = 0
+    fileh = open(dataPath, "rb")
+    block = fileh.read(blockSize)
+    while block:
+        NLines += block.count("\n")
+        block = fileh.read(blockSize)
+    fileh.close()
+    return NLines
+
+
+def readHeaderLines(dataPath, nLines):
+    """Returns a list with the first nLines lines of the file dataPath without the end of line characters"""
+    lines = []
+    fileh = open(dataPath)
+    for line in fileh:
+        lines.append(line.rstrip("\r\n"))
+        if len(lines) >= nLines:
+            break
+    fileh.close()
+    return lines
+
+
+class DataChunkReader(object):
+    """Reads a tab, txt or smi file in chunks of at most chunkSize examples, keeping in memory only one chunk at a time:
+            reader = DataChunkReader(dataPath, 10000)
+            print reader.nEx, reader.memReq
+            for chunk in reader:
+                predictions = model.predictBatch(chunk)
+       All the chunks are DataTables with the same domain, reader.domain, created from the header of the file:
+            tab - The variables types and flags of the 3 header lines. Columns without a type are typed as in txt
+            txt - The first line has the names of the variables and the last column is the class unless classLess 
+                  is True. Numeric columns of the first chunk are continuous. The other columns are strings if they
+                  have more than 20 different values in the first chunk or are named as SMILES, and discrete otherwise.
+            smi - The SMILES and MOLNAME string attributes as in loadSMI, with the PREDICTION class if hasPred is True
+       The names of the variables are fixed as in DataTable (see reader.unnamedFixedVars and
+       reader.duplicatedFixedVars). New values of discrete variables are added to the variable. Values that cannot be read as the type of their
+       variable are set as missing.
+       reader.nEx and reader.memReq (in MB, see approxMemReq) are estimated by counting the lines of the file, 
+       without loading it.
+    """
+    def __init__(self, dataPath, chunkSize = 10000, classLess = False, hasPred = False):
+        self.dataPath = dataPath
+        self.chunkSize = max(int(chunkSize), 1)
+        self.classLess = classLess
+        self.hasPred = hasPred
+        self.domain = None
+        self.unnamedFixedVars = []
+        self.duplicatedFixedVars = {}
+        ext = os.path.splitext(dataPath)[1].lower()
+        if ext == ".smi":
+            self.format = "smi"
+            self.nHeaderLines = 0
+        elif ext == ".tab":
+            self.format = "tab"
+            self.nHeaderLines = 3
+        else:
+            self.format = "txt"
+            self.nHeaderLines = 1
+        if not os.path.isfile(dataPath):
+            print "ERROR: Could not open file for reading: ", dataPath
+            self.nEx = 0
+            self.memReq = approxMemReq(0, 0)
+            return
+        self.nEx = max(countLines(dataPath) - self.nHeaderLines, 0)
+        # (column index, variable, meta id or None) for each column read
+        self._columns = []
+        self._createDomain()
+        self.memReq = approxMemReq(self.nEx, len(self.domain.attributes))
+
+    def _createDomain(self):
+        if self.format == "smi":
+            attributes = [orange.StringVariable("SMILES"), orange.StringVariable("MOLNAME")]
+            self._columns = [(0, attributes[0], None), (1, attributes[1], None)]
+            if self.hasPred:
+                classVar = orange.StringVariable("PREDICTION")
+                self._columns.append((2, classVar, None))
+                self.domain = orange.Domain(attributes, classVar)
+            else:
+                self.domain = orange.Domain(attributes, 0)
+            return
+
+        header = [[field.strip() for field in line.split("\t")] for line in readHeaderLines(self.dataPath, self.nHeaderLines)]
+        names = header[0]
+        if self.format == "tab":
+            types = header[1] + [""] * (len(names) - len(header[1]))
+            flags = header[2] + [""] * (len(names) - len(header[2]))
+        else:
+            types = [""] * len(names)
+            flags = [""] * len(names)
+            if not self.classLess:
+                flags[-1] = "class"
+        sample = self._guessSample([idx for idx,varType in enumerate(types) if not varType])
+
+        attributes = []
+        classVar = None
+        metas = []
+        for idx, name in enumerate(names):
+            flag = flags[idx].lower().replace("-dc","").strip()
+            if flag in ("i", "ignore"):
+                continue
+            var = self._createVar(name, types[idx], sample.get(idx, []))
+            if var is None:
+                continue
+            if flag in ("c", "class"):
+                classVar = var
+                self._columns.append((idx, var, None))
+            elif flag in ("m", "meta"):
+                metaId = orange.newmetaid()
+                metas.append((metaId, var))
+                self._columns.append((idx, var, metaId))
+            else:
+                attributes.append(var)
+                self._columns.append((idx, var, None))
+        if classVar is None:
+            self.domain = orange.Domain(attributes, 0)
+        else:
+            self.domain = orange.Domain(attributes, classVar)
+        for metaId, var in metas:
+            self.domain.addmeta(metaId, var)
+        # Fix the names as done by DataTable when loading the whole file
+        for attr in self.domain:
+            for sym in AZOC.CVT_SYM:
+                attr.name = attr.name.replace(sym,AZOC.CVT_SYM[sym])
+        self.unnamedFixedVars = fixUnnamedNames(self.domain)
+        self.duplicatedFixedVars = fixDuplicatedNames(self.domain)
+
+    def _guessSample(self, colIdxs):
+        """Returns a dict with the non missing values of the first chunk of data for each column in colIdxs"""
+        sample = dict([(idx, []) for idx in colIdxs])
+        if not colIdxs:
+            return sample
+        for nLine, fields in enumerate(self._iterFields()):
+            if nLine >= self.chunkSize:
+                break
+            for idx in colIdxs:
+                if idx < len(fields) and self._missing(fields[idx]) is None:
+                    sample[idx].append(fields[idx])
+        return sample
+
+    def _createVar(self, name, varType, sample):
+        """Creates the variable of a column from its type in the tab header, or from a sample of its values"""
+        lowerType = varType.lower()
+        if lowerType in ("c", "continuous", "float"):
+            return orange.FloatVariable(name)
+        elif lowerType in ("s", "string"):
+            return orange.StringVariable(name)
+        elif lowerType in ("d", "discrete"):
+            return orange.EnumVariable(name)
+        elif lowerType:
+            if lowerType == "basket":
+                return None
+            # List of values of a discrete variable
+            return orange.EnumVariable(name, values = varType.split())
+        try:
+            [float(value) for value in sample]
+            return orange.FloatVariable(name)
+        except ValueError:
+            pass
+        if name.lower() in [smi.lower() for smi in AZOC.SMILESNAMES] or len(set(sample)) > 20:
+            return orange.StringVariable(name)
+        return orange.EnumVariable(name, values = sorted(set(sample)))
+
+    def _iterFields(self):
+        """Yields the list of fields of each data line of the file"""
+        fileh = open(self.dataPath)
+        try:
+            for nLine, line in enumerate(fileh):
+                if nLine < self.nHeaderLines:
+                    continue
+                line = line.rstrip("\r\n")
+                if self.format == "smi":
+                    fields = line.split()
+                else:
+                    fields = line.split("\t")
+                if [field for field in fields if field.strip()]:
+                    yield fields
+        finally:
+            fileh.close()
+
+    def _missing(self, value):
+        """Returns the orange missing value symbol of value, or None if it is not a missing value"""
+        value = value.strip().upper()
+        if value in DClist:
+            return DC
+        if value in DKlist:
+            return DK
+        return None
+
+    def _value(self, var, field):
+        """Converts the field read from the file to a value of var"""
+        missing = self._missing(field)
+        if missing:
+            return missing
+        field = field.strip()
+        if var.varType == orange.VarTypes.Continuous:
+            try:
+                return float(field)
+            except ValueError:
+                if verbose > 0: print "WARNING: Invalid value "+field+" of "+var.name+" set as missing"
+                return DC
+        elif var.varType == orange.VarTypes.Discrete and field not in var.values:
+            var.addValue(field)
+        return field
+
+    def _example(self, fields):
+        ex = orange.Example(self.domain)
+        for idx, var, metaId in self._columns:
+            if idx >= len(fields):
+                continue
+            value = self._value(var, fields[idx])
+            if metaId is None:
+                ex[var] = value
+            else:
+                ex[metaId] = value
+        return ex
+
+    def __iter__(self):
+        """Yields DataTables with the domain self.domain and at most self.chunkSize examples"""
+        if self.domain is None:
+            return
+        chunk = DataTable(self.domain)
+        for fields in self._iterFields():
+            chunk.append(self._example(fields))
+            if len(chunk) >= self.chunkSize:
+                yield chunk
+                chunk = DataTable(self.domain)
+        if len(chunk):
+            yield chunk
+
+
 class DataTable(orange.ExampleTable):
     """DataTable(filename[, classLess=False, noMeta=True, removeDuplicatedVars=False] | domain[, examples] | examples)"""
     def __new__(cls, *argTuple, **kwds):
@@ -231,7 +493,10 @@ class DataTable(orange.ExampleTable):
         # Load the data with the default ExampleTable object
         attributeLoadStatus = None
         metaAttributeLoadStatus = None
-        data = orange.ExampleTable(*argTuple,**kwds)
+        if argTuple and type(argTuple[0]) == str and isColumnar(argTuple[0]):
+            data = _loadColumnarTable(argTuple[0])
+        else:
+            data = orange.ExampleTable(*argTuple,**kwds)
         #Convert any symbold that are not allowed in the unicode format
         for attr in data.domain:
             for sym in AZOC.CVT_SYM:
@@ -297,6 +562,223 @@ def fixUnnamedNames(domain):
             UnnAttrs.append(col)
     return UnnAttrs
 
+# Columnar binary format of datasets: a directory with
+#    header.json    - The domain and the number of examples
+#    attributes.npy - float64 matrix (column-major) of the continuous and discrete attributes
+#    class.npy      - float64 vector of the class if it is continuous or discrete
+#    metas.npy      - float64 matrix (column-major) of the continuous and discrete meta attributes
+#    strings.json   - The values of the string attributes, class and meta attributes
+# Discrete values are stored as the index of the value and missing values as nan (None for strings).
+# The numeric blocks can be memory-mapped, so that processes share one dataset without parsing it.
+COLUMNARVERSION = 1
+
+def _varHeader(var):
+    """Returns the dict describing var in the header of the columnar format"""
+    if var.varType == orange.VarTypes.Continuous:
+        return {"name": var.name, "type": "continuous", "numberOfDecimals": var.numberOfDecimals}
+    elif var.varType == orange.VarTypes.Discrete:
+        return {"name": var.name, "type": "discrete", "values": list(var.values)}
+    else:
+        return {"name": var.name, "type": "string"}
+
+def _headerVar(varHeader):
+    """Creates a new variable from its description in the header of the columnar format"""
+    name = varHeader["name"].encode("utf-8")
+    if varHeader["type"] == "continuous":
+        var = orange.FloatVariable(name)
+        var.numberOfDecimals = varHeader["numberOfDecimals"]
+    elif varHeader["type"] == "discrete":
+        var = orange.EnumVariable(name, values = [val.encode("utf-8") for val in varHeader["values"]])
+    else:
+        var = orange.StringVariable(name)
+    return var
+
+def _numericColumn(data, var):
+    """Returns the float64 array of the values of the continuous or discrete var in data, nan for the missing values"""
+    return numpy.array([ex[var].isSpecial() and numpy.nan or float(ex[var]) for ex in data], dtype = numpy.float64)
+
+def _stringColumn(data, var):
+    """Returns the list of the values of the string var in data, None for the missing values"""
+    return [None if ex[var].isSpecial() else str(ex[var].value) for ex in data]
+
+def isColumnar(path):
+    """Returns True if path is a dataset saved in the columnar format (see saveColumnar)"""
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, "header.json"))
+
+def saveColumnar(data, path):
+    """Saves the ExampleTable data in the directory path in the columnar binary format.
+       It can be loaded with loadColumnar or DataTable(path), and its numeric matrix with loadColumnarArrays.
+       Returns path or None if the data could not be saved.
+    """
+    if data is None:
+        return None
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        domain = data.domain
+        header = {"format": "AZOrangeColumnar", "version": COLUMNARVERSION, "nEx": len(data),
+                  "attributes": [], "classVar": None, "metas": []}
+        strings = {"attributes": {}, "class": None, "metas": {}}
+
+        numAttrs = [attr for attr in domain.attributes if attr.varType != orange.VarTypes.String]
+        for attr in domain.attributes:
+            header["attributes"].append(_varHeader(attr))
+            if attr.varType == orange.VarTypes.String:
+                strings["attributes"][attr.name] = _stringColumn(data, attr)
+        if len(numAttrs) == len(domain.attributes) and len(data):
+            # Bulk conversion when there are no string attributes
+            matrix = numpy.ma.filled(data.toNumpyMA("a")[0].astype(numpy.float64), numpy.nan)
+        else:
+            matrix = numpy.empty((len(data), len(numAttrs)), dtype = numpy.float64)
+            for col, attr in enumerate(numAttrs):
+                matrix[:, col] = _numericColumn(data, attr)
+        numpy.save(os.path.join(path, "attributes.npy"), numpy.asfortranarray(matrix))
+
+        if domain.classVar:
+            header["classVar"] = _varHeader(domain.classVar)
+            if domain.classVar.varType == orange.VarTypes.String:
+                strings["class"] = _stringColumn(data, domain.classVar)
+            else:
+                numpy.save(os.path.join(path, "class.npy"), _numericColumn(data, domain.classVar))
+
+        numMetas = []
+        for metaId, meta in sorted(domain.getmetas().items(), reverse = True):
+            metaHeader = _varHeader(meta)
+            metaHeader["id"] = metaId
+            header["metas"].append(metaHeader)
+            if meta.varType == orange.VarTypes.String:
+                strings["metas"][str(metaId)] = _stringColumn(data, metaId)
+            else:
+                numMetas.append(metaId)
+        metasMatrix = numpy.empty((len(data), len(numMetas)), dtype = numpy.float64)
+        for col, metaId in enumerate(numMetas):
+            metasMatrix[:, col] = _numericColumn(data, metaId)
+        numpy.save(os.path.join(path, "metas.npy"), numpy.asfortranarray(metasMatrix))
+
+        fileh = open(os.path.join(path, "strings.json"), "w")
+        json.dump(strings, fileh)
+        fileh.close()
+        # The header is written last, so that an incomplete dataset is not taken as columnar
+        fileh = open(os.path.join(path, "header.json"), "w")
+        json.dump(header, fileh, indent = 1)
+        fileh.close()
+    except Exception, e:
+        print "ERROR: Could not save the data in "+str(path)+": "+str(e)
+        return None
+    return path
+
+def loadColumnarArrays(path, mmap = True):
+    """Loads the dataset saved by saveColumnar in path without creating the ExampleTable.
+       Returns a dict with:
+           "domain"     - The orange Domain of the data, with its meta attributes
+           "attributes" - The numeric matrix of the continuous and discrete attributes (see saveColumnar)
+           "varNames"   - The names of the columns of "attributes"
+           "class"      - The numeric vector of the class, or None if there is no class or it is a string
+           "metas"      - The numeric matrix of the continuous and discrete meta attributes
+           "metaIds"    - The ids of the columns of "metas"
+           "strings"    - The values of the string variables as saved in strings.json
+       If mmap is True the numeric blocks are memory-mapped read-only instead of read into memory.
+       Returns None if path is not a dataset in the columnar format.
+    """
+    if not isColumnar(path):
+        print "ERROR: "+str(path)+" is not a dataset in the columnar format"
+        return None
+    fileh = open(os.path.join(path, "header.json"))
+    header = json.load(fileh)
+    fileh.close()
+    if header.get("format") != "AZOrangeColumnar" or header.get("version") > COLUMNARVERSION:
+        print "ERROR: Unsupported columnar format in "+str(path)
+        return None
+    fileh = open(os.path.join(path, "strings.json"))
+    strings = json.load(fileh)
+    fileh.close()
+    mmapMode = mmap and "r" or None
+
+    attributes = [_headerVar(varHeader) for varHeader in header["attributes"]]
+    if header["classVar"]:
+        classVar = _headerVar(header["classVar"])
+        domain = orange.Domain(attributes, classVar)
+    else:
+        classVar = None
+        domain = orange.Domain(attributes, 0)
+    metaIds = []
+    for metaHeader in header["metas"]:
+        domain.addmeta(metaHeader["id"], _headerVar(metaHeader))
+        if metaHeader["type"] != "string":
+            metaIds.append(metaHeader["id"])
+    if classVar and header["classVar"]["type"] != "string":
+        classValues = numpy.load(os.path.join(path, "class.npy"), mmap_mode = mmapMode)
+    else:
+        classValues = None
+    return {"domain"    : domain,
+            "attributes": numpy.load(os.path.join(path, "attributes.npy"), mmap_mode = mmapMode),
+            "varNames"  : [attr.name for attr in attributes if attr.varType != orange.VarTypes.String],
+            "class"     : classValues,
+            "metas"     : numpy.load(os.path.join(path, "metas.npy"), mmap_mode = mmapMode),
+            "metaIds"   : metaIds,
+            "strings"   : strings,
+            "nEx"       : header["nEx"]}
+
+def _loadColumnarTable(path):
+    """Creates the orange ExampleTable of the dataset saved by saveColumnar in path"""
+    arrays = loadColumnarArrays(path)
+    if arrays is None:
+        raise Exception("Could not load the columnar dataset "+str(path))
+    domain = arrays["domain"]
+
+    def column(values, var):
+        # Converts the stored values of var to the values used to create the orange examples
+        if var.varType == orange.VarTypes.String:
+            return [val is None and "?" or val.encode("utf-8") for val in values]
+        elif var.varType == orange.VarTypes.Discrete:
+            return [numpy.isnan(val) and "?" or int(val) for val in values]
+        else:
+            return [numpy.isnan(val) and "?" or float(val) for val in values]
+
+    # The numeric attributes and class are given to orange at once as a masked matrix (discrete values are value 
+    #   indexes). orange only creates tables from matrices for numeric variables, so with string variables the
+    #   table is created in the domain of the numeric ones, converted to domain and the strings set afterwards
+    numVars = [var for var in domain.variables if var.varType != orange.VarTypes.String]
+    matrix = arrays["attributes"]
+    if arrays["class"] is not None:
+        matrix = numpy.column_stack((matrix, arrays["class"]))
+    if len(numVars) == len(domain.variables):
+        numDomain = domain
+    elif arrays["class"] is not None:
+        numDomain = orange.Domain(numVars, 1)
+    else:
+        numDomain = orange.Domain(numVars, 0)
+    if arrays["nEx"] and numVars:
+        data = orange.ExampleTable(numDomain, numpy.ma.array(matrix, mask = numpy.isnan(matrix)))
+        if numDomain is not domain:
+            data = orange.ExampleTable(domain, data)
+    else:
+        data = orange.ExampleTable(domain)
+        for n in range(arrays["nEx"]):
+            data.append(orange.Example(domain))
+    for idx, var in enumerate(domain.variables):
+        if var.varType != orange.VarTypes.String:
+            continue
+        if idx == len(domain.attributes):
+            values = column(arrays["strings"]["class"], var)
+        else:
+            values = column(arrays["strings"]["attributes"][var.name], var)
+        for ex, val in zip(data, values):
+            ex[idx] = val
+
+    for metaId, meta in domain.getmetas().items():
+        if meta.varType == orange.VarTypes.String:
+            values = column(arrays["strings"]["metas"][str(metaId)], meta)
+        else:
+            values = column(arrays["metas"][:, arrays["metaIds"].index(metaId)], meta)
+        for ex, val in zip(data, values):
+            ex[metaId] = val
+    return data
+
+def loadColumnar(path):
+    """Loads the dataset saved by saveColumnar in path as a DataTable. Same as DataTable(path)"""
+    return DataTable(path)
+
 def CvMat2List(cvMatrix):
     listMatrix = []
     for row in range(cvMatrix.rows):
@@ -361,6 +843,48 @@ def Example2CvMat(ex,varNames,thisVer = True,getMissingMask = False):
                 cv.cvSetReal1D(mat,idx, 0)
         return mat
 
+def _numpyDtype4CvMat(cvMatrix):
+    """Returns the numpy dtype matching the element type of the CvMat object"""
+    cvType = cv.cvGetElemType(cvMatrix)
+    if cvType == cv.CV_8UC1:
+        return numpy.uint8
+    elif cvType == cv.CV_32SC1:
+        return numpy.int32
+    elif cvType == cv.CV_64FC1:
+        return numpy.float64
+    else:
+        return numpy.float32
+
+
+def Array2CvMat(array, cvMatrix):
+    """ Copies the values of the 2D numpy array 'array' into the already created CvMat 'cvMatrix'
+        The array must have the same shape as cvMatrix. It is converted to a C-contiguous array of the
+        element type of cvMatrix and copied in one single memory copy when the opencv bindings 
+        allow to set the matrix data directly, else it will fall back to setting element by element.
+    """
+    array = numpy.ascontiguousarray(array, dtype = _numpyDtype4CvMat(cvMatrix))
+    if array.shape != (cvMatrix.rows, cvMatrix.cols):
+        array = array.reshape(cvMatrix.rows, cvMatrix.cols)
+    if hasattr(cvMatrix, "imageData_set"):
+        cvMatrix.imageData_set(array.tostring())
+    else:
+        for idxRow in xrange(array.shape[0]):
+            for idxCol in xrange(array.shape[1]):
+                cv.cvSetReal2D(cvMatrix, idxRow, idxCol, float(array[idxRow, idxCol]))
+    return cvMatrix
+
+
+def CvMat2Array(cvMatrix):
+    """ Returns a 2D numpy array (rows x cols) with a copy of the values in the CvMat 'cvMatrix'
+        The numpy array will have the element type of cvMatrix.
+    """
+    dtype = _numpyDtype4CvMat(cvMatrix)
+    if hasattr(cvMatrix, "imageData_get"):
+        return numpy.fromstring(cvMatrix.imageData_get(), dtype = dtype).reshape(cvMatrix.rows, cvMatrix.cols).copy()
+    else:
+        return numpy.array(CvMat2List(cvMatrix), dtype = dtype).reshape(cvMatrix.rows, cvMatrix.cols)
+
+
 def ExampleTable2CvMat(data,unfoldDescreteClasses=False):
     """ Converts an orange ExampleTable to an opencv CvMat
         if unfoldDescreteClasses is True, the responses will be a float and unfolded into as many columns as class values 
@@ -370,6 +894,10 @@ def ExampleTable2CvMat(data,unfoldDescreteClasses=False):
             returned["varTypes"]       the variable types in the CvMat object including the response var if exist
             returned["varNames"]       Ordered variable names used in the CvMat object
             returned["responseName"]   Ordered variable names used in the CvMat object
+            returned["missing_data_mask"]  Mask (CV_8UC1) of the missing attribute values or None if data has no missing values
+            returned["missing_res_mask"]   Mask (CV_8UC1) of the missing responses or None if data has no missing values
+        The data is converted once to contiguous numpy arrays which are then copied in bulk to the CvMat objects.
+        Missing values are set to 0 in the matrix and the responses, and flagged in the respective masks.
     """
     CvMatices = {}
     # Create the vars with attribute names in proper order
@@ -378,103 +906,70 @@ def ExampleTable2CvMat(data,unfoldDescreteClasses=False):
         CvMatices["responseName"] = [data.domain.classVar.name]
     else:
         CvMatices["responseName"] = []
+    nEx = len(data)
+    nAttrs = len(data.domain.attributes)
 
     # Creates a matrix for the attributes
-    CvMatices["matrix"] = cv.cvCreateMat(len(data),len(data.domain.attributes),cv.CV_32FC1)   #rows, cols, type
+    CvMatices["matrix"] = cv.cvCreateMat(nEx,nAttrs,cv.CV_32FC1)   #rows, cols, type
     CvMatices["varTypes"] = cv.cvCreateMat(1,len(data.domain),cv.CV_8UC1) # define all var types + the output var type
 
-    # Fill the cvMat with data from exampleTable
-    # This iterations take almoast 100% of the time spent in this procedure... very slow!
-    # using cv.cvmSet makes it 2x faster, but this cannot be used in vectors of type CV_8SC1, there may be a bug
-        
-    discreteAttrs = []
     for idx,attr in enumerate(CvMatices["varNames"]):
         if data.domain[attr].varType == orange.VarTypes.Discrete:
-            discreteAttrs.append(True)
             #if data.domain.classVar.varType != orange.VarTypes.Discrete:  #DEBUGSEGFAULT
             #    cv.cvSet1D(CvMatices["varTypes"],idx, ml.CV_VAR_NUMERICAL)        #DEBUGSEGFAULT  In regression problems the RF segfaults when there are attributes defined as discrete
             #else:                                                         #DEBUGSEGFAULT
             cv.cvSet1D(CvMatices["varTypes"],idx, ml.CV_VAR_CATEGORICAL)
         else:
-            discreteAttrs.append(False)
             cv.cvSet1D(CvMatices["varTypes"],idx, ml.CV_VAR_NUMERICAL)
 
-        
-    #cv.cvSetZero(CvMatices["matrix"])
     # Convert to Numpy:
     #    numPyData[0]        - All examples and attributes
     #    numPyData[0][i]     - example i
     #    numPyData[0][i][j]  - attribute j of example i
     #    numPyData[1]        - Class variable
     #    numPyData[1][i]     - Class value of example i
-
-    matrix = CvMatices["matrix"]
-    if data.hasMissingValues():
-        numPyData = data.toNumpyMA()
-        missing_data_mask = numPyData[0].mask
+    # Filling the CvMat cell by cell used to take almost 100% of the time spent in this procedure, so 
+    #   the masked arrays are now filled and copied in bulk to the CvMat objects
+    hasMissingValues = data.hasMissingValues()
+    numPyData = data.toNumpyMA() 
+    orngMatrix = numPyData[0] # this will convert discrete attributes to number being each int the order of the respecive value
+    Array2CvMat(numpy.ma.filled(orngMatrix, 0), CvMatices["matrix"])
+    if hasMissingValues:
         #Create the CvMat objects for the masks
-        CvMatices["missing_data_mask"] = cv.cvCreateMat(len(data),len(data.domain.attributes),cv.CV_8UC1)   #rows, cols, type
-        cv.cvSetZero(CvMatices["missing_data_mask"])
-        orngMatrix = numPyData[0] # this will convert discrete attributes to number being each int the order of the respecive value
-        lenVars = range(len(CvMatices["varNames"]))
-        for idxEx,ex in enumerate(orngMatrix):
-            for idx in lenVars:
-                if missing_data_mask[idxEx][idx]:
-                    #it will not set this particular value since it is undefined. It's however marked in the missing_data_mask
-                    cv.cvSet2D(CvMatices["missing_data_mask"],idxEx,idx,1)
-                else:
-                    cv.cvmSet(matrix,idxEx,idx,ex[idx])
+        CvMatices["missing_data_mask"] = cv.cvCreateMat(nEx,nAttrs,cv.CV_8UC1)   #rows, cols, type
+        Array2CvMat(numpy.ma.getmaskarray(orngMatrix), CvMatices["missing_data_mask"])
     else:
-        numPyData = data.toNumpyMA() 
         CvMatices["missing_data_mask"] = None    
-        orngMatrix = numPyData[0] # this will convert discrete attributes to number being each int the order of the respecive value
-        lenVars = range(len(CvMatices["varNames"]))
-        for idxEx,ex in enumerate(orngMatrix):
-            for idx in lenVars:
-                cv.cvmSet(matrix,idxEx,idx,ex[idx])
 
-   #Fill the cvMat Response Var
+    #Fill the cvMat Response Var
     if data.domain.classVar:
+        orngClass = numPyData[1]  # this will convert discrete classes to number being each int the order of the respecive value
+        missing_res_mask = numpy.ma.getmaskarray(orngClass).reshape(nEx)
+        classValues = numpy.ma.filled(orngClass, 0).reshape(nEx)
         if data.domain.classVar.varType == orange.VarTypes.Discrete: 
             if  unfoldDescreteClasses:
-                CvMatices["responses"]  = cv.cvCreateMat(len(data),len(data.domain.classVar.values),cv.CV_32FC1) 
+                nValues = len(data.domain.classVar.values)
+                CvMatices["responses"]  = cv.cvCreateMat(nEx,nValues,cv.CV_32FC1) 
                 CvMatices["varTypes"][0,-1] = ml.CV_VAR_CATEGORICAL  
+                #Here classValues are the indices of the class value of the actual class
+                responses = numpy.zeros((nEx,nValues), numpy.float32)
+                knownIdxs = numpy.flatnonzero(~missing_res_mask)
+                responses[knownIdxs, classValues[knownIdxs].astype(numpy.int32)] = 1
             else:
-                CvMatices["responses"]  = cv.cvCreateMat(len(data),1,cv.CV_32SC1)  # In classification use CV_32SC1, while in regression use: CV_32FC1
+                CvMatices["responses"]  = cv.cvCreateMat(nEx,1,cv.CV_32SC1)  # In classification use CV_32SC1, while in regression use: CV_32FC1
                 CvMatices["varTypes"][0,-1] = ml.CV_VAR_CATEGORICAL   # The element corresponding to the Class
+                responses = classValues
         else:
-            CvMatices["responses"]  = cv.cvCreateMat(len(data),1,cv.CV_32FC1)  # In classification use CV_32SC1, while in regression use: CV_32FC1
+            CvMatices["responses"]  = cv.cvCreateMat(nEx,1,cv.CV_32FC1)  # In classification use CV_32SC1, while in regression use: CV_32FC1
             CvMatices["varTypes"][0,-1] = ml.CV_VAR_NUMERICAL   # The element corresponding to the Class
-        orngMatrix = numPyData[1]  # this will convert discrete classes to number being each int the order of the respecive value
-        if data.hasMissingValues():
-            missing_res_mask = numPyData[1].mask
+            responses = classValues
+        Array2CvMat(responses, CvMatices["responses"])
+        if hasMissingValues:
             CvMatices["missing_res_mask"] = cv.cvCreateMat(CvMatices["responses"].rows,CvMatices["responses"].cols,cv.CV_8UC1)   #rows, cols, type
-            cv.cvSetZero(CvMatices["missing_res_mask"])
-            if unfoldDescreteClasses and data.domain.classVar.varType == orange.VarTypes.Discrete:
-                cv.cvSet(CvMatices["responses"],0)
-                for idxEx,classV in enumerate(orngMatrix):
-                    if missing_res_mask[idxEx]:
-                        cv.cvSet(CvMatices["missing_res_mask"][idxEx],1)
-                    else:
-                        #Here classV is the index of the class value of the actual class
-                        cv.cvmSet(CvMatices["responses"],idxEx,int(classV),1)
-            else:
-                for idxEx,classV in enumerate(orngMatrix):
-                    if missing_res_mask[idxEx]:
-                        cv.cvSetReal1D(CvMatices["missing_res_mask"],idxEx, 1)
-                    else:
-                        cv.cvSetReal1D(CvMatices["responses"],idxEx, classV)   #This returns the index of the values within .values or the classs value when class is continuous
+            # When the class is unfolded, the whole row is flagged as missing
+            Array2CvMat(numpy.repeat(missing_res_mask.reshape(nEx,1), CvMatices["responses"].cols, 1), CvMatices["missing_res_mask"])
         else:
-             CvMatices["missing_res_mask"]  = None
-             if unfoldDescreteClasses and data.domain.classVar.varType == orange.VarTypes.Discrete:
-                 cv.cvSet(CvMatices["responses"],0)
-                 for idxEx,classV in enumerate(orngMatrix):
-                     #Here classV is the index of the class value of the actual class
-                     cv.cvmSet(CvMatices["responses"],idxEx,int(classV),1)
-             else:
-                 for idxEx,classV in enumerate(orngMatrix):
-                     cv.cvSetReal1D(CvMatices["responses"],idxEx, classV)   #This returns the index of the values within .values or the classs value when class is continuous
-
+            CvMatices["missing_res_mask"]  = None
     else:
         CvMatices["responses"] = None
 
@@ -518,8 +1013,8 @@ def getQuickDataSize(dataPath, getAttrNames = False):
     if not os.path.isfile(dataPath):
         return {"N_EX":NLines, "N_ATTR":NVars-NClass, "N_CLASS":NClass, "maybeOrangeTab":PossTab, "discreteClass":discreteClass}
     try:
-        NLines = int(commands.getstatusoutput("wc -l "+dataPath)[1].strip().split()[0])
-        headers = commands.getstatusoutput("head -n 3 "+dataPath)[1].split("\n")
+        NLines = countLines(dataPath)
+        headers = readHeaderLines(dataPath, 3)
         FirstLine = [x.strip() for x in headers[0].split("\t")]
         if getAttrNames: attrNames = FirstLine
         SecondLine = [x.strip() for x in headers[1].split("\t")]
@@ -690,6 +1185,11 @@ def concatenate(datasets,useFirstAsLeader=False,mergeDomains=True):
         if useD1Leader: merge=True
         attributesNamesD1 = [ x.name for x in D1.domain]
         attributesNamesD2 = [ x.name for x in D2.domain]
+        # Index of each attribute name in the domains, to look up the attributes in constant time
+        idxD1 = getNameIndex(D1.domain)
+        idxD2 = getNameIndex(D2.domain)
+        varsD1 = dict([(name, D1.domain[idx]) for name, idx in idxD1.iteritems()])
+        varsD2 = dict([(name, D2.domain[idx]) for name, idx in idxD2.iteritems()])
         commonAttr=[]           # Attributes with common names
         newAttrD1=[]            # Attributes not in the original D1 domain
         newAttrD2=[]            # Attributes not in the original D2 domain
@@ -702,38 +1202,38 @@ def concatenate(datasets,useFirstAsLeader=False,mergeDomains=True):
 
         # Place attribute names in respective lists        
         for attr in attributesNamesD2:
-            if attr not in attributesNamesD1:
+            if attr not in idxD1:
                 if merge: newAttrD2.append(attr)
             else:
                 commonAttr.append(attr)
         if merge:
             for attr in attributesNamesD1:
-                if attr not in attributesNamesD2:
+                if attr not in idxD2:
                     newAttrD1.append(attr)
         for attr in commonAttr:
             #print attr
-            if (D1.domain[attr].varType == D2.domain[attr].varType == orange.VarTypes.String) or (D1.domain[attr].varType == D2.domain[attr].varType == orange.VarTypes.Continuous) or (D1.domain[attr]==D2.domain[attr]):
+            if (varsD1[attr].varType == varsD2[attr].varType == orange.VarTypes.String) or (varsD1[attr].varType == varsD2[attr].varType == orange.VarTypes.Continuous) or (varsD1[attr]==varsD2[attr]):
                 equalAttr.append(attr)
             else:
-                if D1.domain[attr].varType==orange.VarTypes.Discrete and D2.domain[attr].varType==orange.VarTypes.Discrete:
+                if varsD1[attr].varType==orange.VarTypes.Discrete and varsD2[attr].varType==orange.VarTypes.Discrete:
                     conflictAttr.append(attr) 
                 else:
                     diffAttr.append(attr)
         #  Create a list of attributes for the new domain according to the repective created lists and passed flags
         NewDomainAttr=[]
         for attr in equalAttr:
-            NewDomainAttr.append(D1.domain[attr])
+            NewDomainAttr.append(varsD1[attr])
         for attr in newAttrD1:
-            NewDomainAttr.append(D1.domain[attr])
+            NewDomainAttr.append(varsD1[attr])
         if not useD1Leader:
             for attr in newAttrD2:
-                NewDomainAttr.append(D2.domain[attr])
+                NewDomainAttr.append(varsD2[attr])
 
         # Decide from the incompatible attributes what will be the Leader, if not defined already by useD1Leader
         for attr in diffAttr:
             if useD1Leader: # There is already a Leader!
                 diffAttrLeaderD1.append(attr)
-                NewDomainAttr.append(D1.domain[attr])
+                NewDomainAttr.append(varsD1[attr])
             else:           #Find the Leader among all datasets present in the concatenation
                 # create a list of indices of datasets where the attribute is present:
                 idxAttrList = [idx for idx,testData in enumerate(allDatasets) if (testData and hasattr(testData,"domain") and (attr in testData.domain))]
@@ -745,24 +1245,24 @@ def concatenate(datasets,useFirstAsLeader=False,mergeDomains=True):
                         OKCvtToCont += miscUtilities.isNumber(ex[attr].value) and True #his way assure only 1 is added at a time
                 #If >=50% can be securely converted to Continuous, use the continuous attribute
                 if OKCvtToCont >= (totalExamples/2):
-                    if D1.domain[attr].varType==orange.VarTypes.Continuous:
+                    if varsD1[attr].varType==orange.VarTypes.Continuous:
                         diffAttrLeaderD1.append(attr)
-                        NewDomainAttr.append(D1.domain[attr])
+                        NewDomainAttr.append(varsD1[attr])
                     else:
                         diffAttrLeaderD2.append(attr)
-                        NewDomainAttr.append(D2.domain[attr])
+                        NewDomainAttr.append(varsD2[attr])
                 else:
-                    if D1.domain[attr].varType==orange.VarTypes.Discrete:
+                    if varsD1[attr].varType==orange.VarTypes.Discrete:
                         diffAttrLeaderD1.append(attr)
-                        NewDomainAttr.append(D1.domain[attr])
+                        NewDomainAttr.append(varsD1[attr])
                     else:
                         diffAttrLeaderD2.append(attr)
-                        NewDomainAttr.append(D2.domain[attr])
+                        NewDomainAttr.append(varsD2[attr])
                 
         # For the Conflict Attributes only need to join the values from both domains for the specific attributes
         for attr in conflictAttr:
-            allValues = D1.domain[attr].values.native()
-            for value in D2.domain[attr].values.native():
+            allValues = varsD1[attr].values.native()
+            for value in varsD2[attr].values.native():
                 if value not in allValues:
                     allValues.append(value)
             NewDomainAttr.append(orange.EnumVariable(str(attr), values = allValues)) 
@@ -781,7 +1281,7 @@ def concatenate(datasets,useFirstAsLeader=False,mergeDomains=True):
             #Assure that if useD1Leader, then the Domain must be in same order as D1
             tmp=[None]*len(NewDomainAttr)
             for attr in NewDomainAttr:
-                tmp[D1.domain.index(attr.name)] = attr
+                tmp[idxD1[attr.name]] = attr
             NewDomainAttr = tmp 
             
         classVarAttr = [x for x in NewDomainAttr if x.name==classVar]
@@ -796,57 +1296,38 @@ def concatenate(datasets,useFirstAsLeader=False,mergeDomains=True):
                 
         # Create an empty table with new domain
         newTable = DataTable(newDomain)       
-        # Insert the examples from DataTable1
-        for ex in D1:
-            newEx=orange.Example(newDomain) # ->   [?, ?, ?, ?, ?, ... , ?]
-            for attr in newAttrD1:
-                newEx[attr]=ex[attr].value
-            for attr in equalAttr:
-                newEx[attr]=ex[attr].value
-            for attr in conflictAttr:
-                newEx[attr]=ex[attr].value
-            for attr in diffAttr:
-                if attr in diffAttrLeaderD1: # D1 is the Leader
-                    newEx[attr]=ex[attr].value
-                else:   # D2 is the Leder
-                    if D2.domain[attr].varType==orange.VarTypes.Discrete: # The Leader is Discrete
-                        if str(ex[attr].value) in D2.domain[attr].values:
-                            newEx[attr] = str(ex[attr].value)
+        newIdx = getNameIndex(newDomain)
+
+        def appendExamples(data, dataIdx, copiedAttrs, convertedAttrs, leaderVars):
+            # Appends the examples of data to newTable. The values of copiedAttrs are copied and the ones of 
+            #   convertedAttrs are converted to the type of the Leader attribute in leaderVars
+            copied = [(newIdx[attr], dataIdx[attr]) for attr in copiedAttrs]
+            converted = [(newIdx[attr], dataIdx[attr], leaderVars[attr]) for attr in convertedAttrs]
+            for ex in data:
+                newEx=orange.Example(newDomain) # ->   [?, ?, ?, ?, ?, ... , ?]
+                for newAttrIdx, attrIdx in copied:
+                    newEx[newAttrIdx]=ex[attrIdx].value
+                for newAttrIdx, attrIdx, leaderVar in converted:
+                    if leaderVar.varType==orange.VarTypes.Discrete: # The Leader is Discrete
+                        if str(ex[attrIdx].value) in leaderVar.values:
+                            newEx[newAttrIdx] = str(ex[attrIdx].value)
                         else:
-                            newEx[attr] = '?'
-                    else:                                                  # The Leader is Continuous
-                        if miscUtilities.isNumber(ex[attr].value):
-                           newEx[attr] = float(ex[attr].value)
+                            newEx[newAttrIdx] = '?'
+                    else:                                            # The Leader is Continuous
+                        if miscUtilities.isNumber(ex[attrIdx].value):
+                           newEx[newAttrIdx] = float(ex[attrIdx].value)
                         else:
-                            newEx[attr] = '?'
-            newTable.append(newEx)
+                            newEx[newAttrIdx] = '?'
+                newTable.append(newEx)
+
+        # Insert the examples from DataTable1
+        appendExamples(D1, idxD1, newAttrD1 + equalAttr + conflictAttr + diffAttrLeaderD1, diffAttrLeaderD2, varsD2)
         # Insert the examples from DataTable2
-        for ex in D2:
-            newEx=orange.Example(newDomain) # ->   [?, ?, ?, ?, ?, ... , ?]
-            if not useD1Leader:
-                for attr in newAttrD2:
-                    newEx[attr]=ex[attr].value
-            for attr in equalAttr:
-                newEx[attr]=ex[attr].value
-
-            for attr in conflictAttr:
-                newEx[attr]=ex[attr].value
-
-            for attr in diffAttr:
-                if attr in diffAttrLeaderD2: # D2 is the Leader
-                    newEx[attr]=ex[attr].value
-                else:   # D1 is the Leder
-                    if D1.domain[attr].varType==orange.VarTypes.Discrete: # The Leader is Discrete
-                        if str(ex[attr].value) in D1.domain[attr].values:
-                            newEx[attr] = str(ex[attr].value)
-                        else:
-                            newEx[attr] = '?'
-                    else:                                                 #The Leader is Continuous
-                        if miscUtilities.isNumber(ex[attr].value):
-                           newEx[attr] = float(ex[attr].value)
-                        else:
-                            newEx[attr] = '?'
-            newTable.append(newEx)
+        if useD1Leader:
+            newAttrD2Used = []
+        else:
+            newAttrD2Used = newAttrD2
+        appendExamples(D2, idxD2, newAttrD2Used + equalAttr + conflictAttr + diffAttrLeaderD2, diffAttrLeaderD1, varsD1)
         return (newTable, diffAttr)
 
     firstDataIdx = None
@@ -870,7 +1351,7 @@ def concatenate(datasets,useFirstAsLeader=False,mergeDomains=True):
             if verbose >0: print "WARNING: The dataset of index",idx+firstDataIdx+1,"is not valid and was ignored."
     diffList = {}
     for attr in allDiffAttr:
-        diffList[attr] = allDiffAttr.count(attr)
+        diffList[attr] = diffList.get(attr, 0) + 1
 
     return (newTable, diffList)
 
@@ -926,16 +1407,26 @@ def findDuplicatedNames(domain):
        duplicated names and the number of attributes for each.
        -You would probably want to use the function fixDuplicatedNames(domain) which will call this one!
     """
-    domainNames = [attr.name for attr in domain]
+    allIdxs = {}
+    for idx,attr in enumerate([attr.name for attr in domain]):
+        allIdxs.setdefault(attr, []).append(idx)
     dup = {}
-    for idx,attr in enumerate(domainNames):
-        if domainNames.count(attr) > 1:
-            if attr in dup:
-                dup[attr].append(idx)
-            else:
-                dup[attr] = [idx]
+    for attr in allIdxs:
+        if len(allIdxs[attr]) > 1:
+            dup[attr] = allIdxs[attr]
     return dup
 
+
+def getNameIndex(domain):
+    """Returns a dict with the index in domain of the first variable with each name.
+       Used instead of looking up the variables by name, which searches the whole domain in each lookup.
+    """
+    nameIndex = {}
+    for idx,attr in enumerate(domain):
+        if attr.name not in nameIndex:
+            nameIndex[attr.name] = idx
+    return nameIndex
+
 def fixDuplicatedNames(domain,reverse = False):
     """ fix the names of domain specified in the dupVectro (returned by findDuplicatedNames) by adding a sequencial 
         numbered suffix to the attributes with same name ex: Activity_1
@@ -1039,6 +1530,12 @@ def ConvertEx2Domain(domain,example,examplesFixedLog=None,fixClass = False):
     return None
 
 
+# Domain maps compiled by ExFix.compileDomainMap, keyed by the ids of the source and target domains.
+#   The domains are kept in the cache so that their ids are not reused while cached.
+DOMAINMAPCACHESIZE = 32
+_domainMapCache = OrderedDict()
+
+
 class ExFix(object):
     """
     Class for fixing the examples to a particular domain
@@ -1142,32 +1639,35 @@ class ExFix(object):
                 return None
             
     def __composeVarLog(self, attr, isUnknown=False):
+            self.__composeVarNameLog(attr.variable.name, self.exDomain, isUnknown)
+
+    def __composeVarNameLog(self, name, exDomain, isUnknown=False):
             # Only compose the log if a handler was provided in self.examplesFixedLog
             if (self.examplesFixedLog!=None) and (type(self.examplesFixedLog) == types.DictType):
-                varBefore = str(self.exDomain[attr.variable.name]).replace("'" + str(attr.variable.name)  + "'" , "").strip()
-                varAfter = str(self.domain[attr.variable.name]).replace("'" + str(attr.variable.name)  + "'","").strip()
-                if varBefore==varAfter and self.domain[attr.variable.name].varType == orange.VarTypes.Discrete:
+                varBefore = str(exDomain[name]).replace("'" + str(name)  + "'" , "").strip()
+                varAfter = str(self.domain[name]).replace("'" + str(name)  + "'","").strip()
+                if varBefore==varAfter and self.domain[name].varType == orange.VarTypes.Discrete:
                     changeTxt = "EnumVar - Attribute Values were different"
                 else:
                     changeTxt = varBefore +" to " + varAfter
                 if ("Vars needing type fix" in self.examplesFixedLog):
-                    if attr.variable.name not in self.examplesFixedLog["Vars needing type fix"]:
-                        self.examplesFixedLog["Vars needing type fix"][attr.variable.name] = changeTxt
+                    if name not in self.examplesFixedLog["Vars needing type fix"]:
+                        self.examplesFixedLog["Vars needing type fix"][name] = changeTxt
                 else:
-                        self.examplesFixedLog["Vars needing type fix"] = {attr.variable.name : changeTxt}
+                        self.examplesFixedLog["Vars needing type fix"] = {name : changeTxt}
                 if isUnknown and \
-                "(some impossible conversions" not in self.examplesFixedLog["Vars needing type fix"][attr.variable.name]:
-                    self.examplesFixedLog["Vars needing type fix"][attr.variable.name] += " (some impossible conversions. It was set to '?' for some examples.)"
-                    if verbose >0: print "The attr '"+attr.variable.name+"' ["+str(self.exDomain.index(attr.variable.name))+"] of the following example was set to '?'.\n   "
+                "(some impossible conversions" not in self.examplesFixedLog["Vars needing type fix"][name]:
+                    self.examplesFixedLog["Vars needing type fix"][name] += " (some impossible conversions. It was set to '?' for some examples.)"
+                    if verbose >0: print "The attr '"+name+"' ["+str(exDomain.index(name))+"] of the following example was set to '?'.\n   "
 
-    def __composeNExFixedLog(self):
+    def __composeNExFixedLog(self, nExamples = 1):
             if (self.examplesFixedLog!=None) and (type(self.examplesFixedLog) == types.DictType):
                 #Compose the log that will be used for warning messages
                 if self.fixTypes:
                     if "Fixed Types of variables" in self.examplesFixedLog:
-                        self.examplesFixedLog["Fixed Types of variables"]+=1
+                        self.examplesFixedLog["Fixed Types of variables"]+=nExamples
                     else:
-                        self.examplesFixedLog["Fixed Types of variables"]=1
+                        self.examplesFixedLog["Fixed Types of variables"]=nExamples
                         if verbose >0: print "WARNING: Fixed Types of variables"
                 # For Now just using the fixType
                 #if self.fixCount:
@@ -1195,16 +1695,7 @@ class ExFix(object):
                     self.fixFuns[attr.name] = lambda x:'?' # self.__cvt2Ukn   
                     continue  # In this case the classVar will be set to '?' by default
                 elif attr.name not in self.exDomain:   # When there is at least one attribute missing, they are imcompatible!
-                    if self.examplesFixedLog != None:
-                        if "Missing Attributes" in self.examplesFixedLog:
-                            if attr.name in self.examplesFixedLog["Missing Attributes"]:
-                                self.examplesFixedLog["Missing Attributes"][attr.name] += 1
-                            else:
-                                self.examplesFixedLog["Missing Attributes"][attr.name] = 1
-                                if verbose >0: print "WARNING: The attribute " + attr.name +" is missing in the example"
-                        else:
-                            self.examplesFixedLog["Missing Attributes"] = {attr.name:1}
-                            if verbose >0: print "WARNING: The attribute " + attr.name +" is missing in the example"
+                    self.__composeMissingAttrLog(attr.name)
                     return False #if there was already one attribuite missing, don't bother fixing anythin!
                 else: 
                     if attr is self.exDomain[attr.name]:
@@ -1224,6 +1715,161 @@ class ExFix(object):
                         ## it depends on var value   using  __cvt2Cont()
                         self.fixFuns[attr.name] = self.__cvt2Cont
             return True
+
+    def __composeMissingAttrLog(self, name):
+            if self.examplesFixedLog != None:
+                if "Missing Attributes" in self.examplesFixedLog:
+                    if name in self.examplesFixedLog["Missing Attributes"]:
+                        self.examplesFixedLog["Missing Attributes"][name] += 1
+                    else:
+                        self.examplesFixedLog["Missing Attributes"][name] = 1
+                        if verbose >0: print "WARNING: The attribute " + name +" is missing in the example"
+                else:
+                    self.examplesFixedLog["Missing Attributes"] = {name:1}
+                    if verbose >0: print "WARNING: The attribute " + name +" is missing in the example"
+
+    def compileDomainMap(self, srcDomain):
+            """
+            Compiles the mapping of the variables of srcDomain to self.domain into a list with one (kind, srcIdx, table)
+            for each variable of self.domain:
+                "copy"     - The value is copied from the column srcIdx
+                "unknown"  - The value is set to '?' (the classVar when not fixing the class)
+                "disc"     - The discrete value index is translated with the array table (nan for values not in self.domain)
+                "discCont" - The discrete value is converted to continuous with the array table (nan for non numeric values)
+                "example"  - The conversion can only be done example by example (to discrete from continuous, or strings)
+            returns None if some variable of self.domain is missing in srcDomain, logging the first missing one in
+                    examplesFixedLog as fill_fixFuns does
+            The compiled maps are cached for each pair of domains. The discrete variables can get new values after
+            the map was compiled (e.g. var.addValue in DataChunkReader), so the cached map is only used while the
+            numbers of values of the discrete variables are the same.
+            """
+            key = (id(srcDomain), id(self.domain), self.fixClass)
+            nValues = tuple([len(attr.values) for attr in list(srcDomain) + list(self.domain) \
+                             if attr.varType == orange.VarTypes.Discrete])
+            if key in _domainMapCache:
+                cached = _domainMapCache.pop(key)
+                if cached[3] == nValues:
+                    _domainMapCache[key] = cached
+                    return cached[2]
+            nameIdx = getNameIndex(srcDomain)
+            columns = []
+            for attr in self.domain:
+                if not self.fixClass and self.domain.classVar and (attr == self.domain.classVar):
+                    columns.append(("unknown", None, None))
+                    continue
+                if attr.name not in nameIdx:
+                    self.__composeMissingAttrLog(attr.name)
+                    return None
+                idx = nameIdx[attr.name]
+                srcAttr = srcDomain[idx]
+                if attr.varType == orange.VarTypes.String or srcAttr.varType == orange.VarTypes.String:
+                    columns.append(("example", idx, None))
+                elif attr is srcAttr or (attr.varType == srcAttr.varType and attr.varType != orange.VarTypes.Discrete):
+                    columns.append(("copy", idx, None))
+                elif attr.varType == srcAttr.varType:
+                    valueIdx = dict([(value, float(n)) for n, value in enumerate(attr.values)])
+                    columns.append(("disc", idx, numpy.array([valueIdx.get(value, numpy.nan) for value in srcAttr.values])))
+                elif attr.varType == orange.VarTypes.Continuous:
+                    columns.append(("discCont", idx, numpy.array([float(value) if miscUtilities.isNumber(value) else numpy.nan \
+                                   for value in srcAttr.values])))
+                else:
+                    columns.append(("example", idx, None))
+            _domainMapCache[key] = (srcDomain, self.domain, columns, nValues)
+            while len(_domainMapCache) > DOMAINMAPCACHESIZE:
+                _domainMapCache.popitem(last = False)
+            return columns
+
+    def __isVectorizable(self, srcDomain, columns):
+            """Returns True if the compiled columns can be applied to a numpy matrix of srcDomain"""
+            if [kind for kind, idx, table in columns if kind == "example"]:
+                return False
+            for attr in list(srcDomain) + list(self.domain):
+                if attr.varType == orange.VarTypes.String:
+                    return False
+            return True
+
+    def fixMatrix(self, matrix, srcDomain):
+            """
+            Fixes a whole numpy (masked) matrix with the columns of srcDomain to self.domain using the compiled domain map.
+            The columns of matrix are the attributes of srcDomain, optionally followed by its classVar, as returned
+            by toNumpyMA. Discrete values are value indexes.
+            returns a numpy masked array with one column for each variable of self.domain (the classVar last), 
+                    or None if the domains are not compatible or some conversions can only be done example by example
+            """
+            if not self.domain or matrix is None:
+                return None
+            columns = self.compileDomainMap(srcDomain)
+            if columns is None or not self.__isVectorizable(srcDomain, columns):
+                return None
+            srcValues = numpy.ma.getdata(matrix).astype(float)
+            srcMask = numpy.ma.getmaskarray(matrix)
+            if len(srcValues.shape) != 2:
+                return None
+            nEx = srcValues.shape[0]
+            values = numpy.zeros((nEx, len(columns)))
+            mask = numpy.ones((nEx, len(columns)), bool)
+            fixedEx = numpy.zeros(nEx, bool)
+            for col, (kind, idx, table) in enumerate(columns):
+                if kind == "unknown" or idx >= srcValues.shape[1]:
+                    continue
+                if kind == "copy":
+                    values[:, col] = srcValues[:, idx]
+                    mask[:, col] = srcMask[:, idx]
+                    continue
+                known = ~srcMask[:, idx]
+                converted = numpy.empty(nEx)
+                converted.fill(numpy.nan)
+                converted[known] = table[srcValues[known, idx].astype(int)]
+                values[:, col] = converted
+                mask[:, col] = numpy.isnan(converted)
+                # Same logs as __cvtDiffDisc and __cvt2Cont
+                if mask[:, col].any():
+                    self.__composeVarNameLog(self.domain[col].name, srcDomain, isUnknown=True)
+                elif kind == "discCont":
+                    self.__composeVarNameLog(self.domain[col].name, srcDomain)
+                if kind == "disc":
+                    fixedEx |= mask[:, col]
+                else:
+                    fixedEx[:] = True
+            nFixed = int(fixedEx.sum())
+            if nFixed:
+                self.fixTypes = True
+                self.__composeNExFixedLog(nFixed)
+            return numpy.ma.array(values, mask = mask)
+
+    def fixTable(self, data):
+            """
+            Fixes all the examples of the ExampleTable data to self.domain at once.
+            The domain map is compiled only once for the domain of data and applied to the whole table as a numpy matrix.
+            When some conversion can only be done example by example, fixExample is used for each example.
+            returns an ExampleTable with the domain self.domain, or None if data is not compatible with self.domain
+            """
+            if not self.domain or data is None:
+                return None
+            if data.domain is self.domain:
+                return data
+            if len(data) == 0:
+                if self.compileDomainMap(data.domain) is None:
+                    return None
+                return DataTable(self.domain)
+            matrix = None
+            columns = self.compileDomainMap(data.domain)
+            if columns is not None and self.__isVectorizable(data.domain, columns):
+                numpyData = data.toNumpyMA()
+                if data.domain.classVar:
+                    matrix = numpy.ma.column_stack((numpyData[0], numpyData[1]))
+                else:
+                    matrix = numpyData[0]
+                matrix = self.fixMatrix(matrix, data.domain)
+            if matrix is not None:
+                return DataTable(self.domain, matrix)
+            fixedData = DataTable(self.domain)
+            for ex in data:
+                fixedEx = self.fixExample(ex)
+                if not fixedEx:
+                    return None
+                fixedData.append(fixedEx)
+            return fixedData
         ##ecPA
 
 def rmAllMeta(data):
@@ -2048,6 +2694,23 @@ class scalizer(object):
        # print ex.getclass()," -> ",scaledEx.getclass()
         return scaledEx
  
+    def scaleArray(self, matrix):
+        """ Scales the attributes in a numpy matrix with one example per row and returns a new float matrix.
+            The columns must be ordered as the attributes of the analyzed data (the class must not be included) 
+            and discrete attributes must hold the index of the value, as returned by ExampleTable.toNumpy.
+            Like the fastscaleEx, it assumes data was already analysed and examples were fixed to the data domain.
+        """
+        matrix = numpy.asarray(matrix, dtype = numpy.float64)
+        nAttrs = matrix.shape[1]
+        minimums = numpy.array(self.minimums[:nAttrs], dtype = numpy.float64)
+        ranges = numpy.array(self.maximums[:nAttrs], dtype = numpy.float64) - minimums
+        #in case of single-valued attributes
+        singleValued = ranges == 0
+        ranges[singleValued] = 1.0
+        scaled = self.nMin+(self.nMax-self.nMin)*(matrix-minimums)/ranges
+        scaled[:,singleValued] = (self.nMax + self.nMin)/2
+        return scaled
+ 
     def __setattr__(self,name,value):
         try:
             if name in ("nClassMin","nClassMax"):
@@ -2273,6 +2936,10 @@ def getApproxMemReq(filePath):
         nEx = len(filePath)
         nAttr = len(filePath.domain.attributes)
 
+    return approxMemReq(nEx, nAttr)
+
+def approxMemReq(nEx, nAttr):
+    """Estimate in MB of the memory required for a data matrix of nEx examples and nAttr attributes (see getApproxMemReq)"""
     memReq = int(nEx*nAttr*8*2*5*0.000001)
     if memReq < 150:
         memReq = 150
@@ -0,0 +1,126 @@
+"""
+Persistent cache of calculated molecular descriptors.
+
+The results are kept in a SQLite database (AZOrangeConfig.DESCCACHEPATH) keyed by:
+    - canonical SMILES of the molecule
+    - toolkit used to calculate the descriptors (rdk, obabel, webel, cdk, ...)
+    - version of the toolkit and of the descriptors calculation (DESCCACHEVERSION)
+    - the set of descriptors requested and any parameters used
+
+so that descriptors are only calculated for the molecules not seen before with the same settings.
+The cache is only used when AZOrangeConfig.DESCCACHEPATH is set (None by default).
+"""
+import os
+import hashlib
+import cPickle
+import sqlite3
+
+import AZOrangeConfig as AZOC
+try:
+    from rdkit import Chem
+except:
+    Chem = None
+
+# Increase when the way descriptors are calculated changes, so that older results are not used
+DESCCACHEVERSION = 1
+
+
+def canonicalSmiles(smiles):
+    """Returns the canonical SMILES of smiles, or smiles itself if it cannot be canonicalized"""
+    if Chem is None:
+        return smiles
+    try:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol:
+            return Chem.MolToSmiles(mol, True)
+    except:
+        pass
+    return smiles
+
+
+class DescCache(object):
+    """Descriptors results stored in a SQLite database file"""
+    def __init__(self, path = None):
+        self.path = path or AZOC.DESCCACHEPATH
+        self.db = None
+        self.pid = None
+        self._connect()
+
+    def _connect(self):
+        """Opens the connection to the database. A SQLite connection cannot be used by a forked process
+           (e.g. the workers of the local pools), so a new one is opened when used from another process.
+        """
+        self.db = None
+        self.pid = os.getpid()
+        if not self.path:
+            return
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self.db = sqlite3.connect(self.path, timeout = 60)
+            self.db.execute("CREATE TABLE IF NOT EXISTS descs (smiles TEXT, toolkit TEXT, version TEXT, descSet TEXT, result BLOB, PRIMARY KEY (smiles, toolkit, version, descSet))")
+            self.db.commit()
+        except Exception, e:
+            print "WARNING: Could not use the descriptors cache "+str(self.path)+": "+str(e)
+            self.db = None
+
+    def getDescs(self, smilesList, toolkit, version, descList, calcFunc, params = ""):
+        """Returns a dict {smiles: result} with the result of calcFunc(smiles) for each of the smiles in smilesList.
+               toolkit, version, descList and params identify the calculation done by calcFunc
+           Only the results of the smiles not in the cache are calculated, and then stored in the cache.
+           calcFunc can return None when it fails to calculate the descriptors. Those results are not cached.
+        """
+        results = {}
+        uniqueSmiles = []
+        for smi in smilesList:
+            if smi not in results:
+                results[smi] = None
+                uniqueSmiles.append(smi)
+        smilesList = uniqueSmiles
+        if self.pid != os.getpid():
+            self._connect()
+        if self.db is None:
+            for smi in smilesList:
+                results[smi] = calcFunc(smi)
+            return results
+
+        version = str(DESCCACHEVERSION) + "_" + str(version)
+        descSet = hashlib.md5(str(sorted(descList)) + str(params)).hexdigest()
+        canonical = dict([(smi, canonicalSmiles(smi)) for smi in smilesList])
+        canonicalList = list(set(canonical.values()))
+        cached = {}
+        try:
+            # Query in chunks to keep below the SQLite limit of variables in a statement
+            for start in range(0, len(canonicalList), 500):
+                chunk = canonicalList[start:start+500]
+                query = "SELECT smiles, result FROM descs WHERE toolkit = ? AND version = ? AND descSet = ? AND smiles IN (" + ",".join(["?"]*len(chunk)) + ")"
+                for row in self.db.execute(query, [toolkit, version, descSet] + chunk):
+                    cached[row[0]] = row[1]
+        except Exception, e:
+            print "WARNING: Could not read the descriptors cache: "+str(e)
+
+        newResults = {}
+        for smi in smilesList:
+            if canonical[smi] in cached:
+                results[smi] = cPickle.loads(str(cached[canonical[smi]]))
+            else:
+                results[smi] = calcFunc(smi)
+                if results[smi] is not None:
+                    # Other SMILES of the same molecule in smilesList will use this result
+                    cached[canonical[smi]] = cPickle.dumps(results[smi], 2)
+                    newResults[canonical[smi]] = (canonical[smi], toolkit, version, descSet, sqlite3.Binary(cached[canonical[smi]]))
+        if newResults:
+            try:
+                self.db.executemany("INSERT OR REPLACE INTO descs VALUES (?, ?, ?, ?, ?)", newResults.values())
+                self.db.commit()
+            except Exception, e:
+                print "WARNING: Could not save the descriptors in the cache: "+str(e)
+        return results
+
+    def clear(self):
+        """Removes all the results from the cache"""
+        if self.pid != os.getpid():
+            self._connect()
+        if self.db is not None:
+            self.db.execute("DELETE FROM descs")
+            self.db.commit()
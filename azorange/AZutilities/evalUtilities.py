@@ -51,6 +51,42 @@ def fastTanimotoSimilarity(A,nA,B):
 
 
 
+# Fingerprint stores already loaded by getFingerprintStore, by (FPPath, NNDataPath)
+_fpStores = {}
+
+def getFingerprintStore(FPPath, NNDataPath):
+    """Returns the FingerprintStore with the fingerprints in FPPath and the list of the respective data rows 
+       of NNDataPath (each one a list with the tab separated fields).
+       FPPath must be a text file with one fingerprint per line, written as a string of '0' and '1' 
+       (optionally as the last tab separated field of the line). The fingerprint in line i is the one of the 
+       data row i of NNDataPath, after its header line. See tests/source/data/NN_Fingerprints.txt and NN_Data.txt
+       Returns (None, None) if FPPath is not in that format or does not have one fingerprint per data row, 
+       as the binary fingerprint files used by the fpin tool.
+       Both are loaded only once while the files are not changed. The (None, None) result is also kept, so
+       the files in other formats are not read again in each call.
+    """
+    from AZutilities import FingerprintStore
+    key = (FPPath, NNDataPath)
+    mtimes = (os.path.getmtime(FPPath), os.path.getmtime(NNDataPath))
+    if key in _fpStores and _fpStores[key][0] == mtimes:
+        return _fpStores[key][1:]
+    file = open(FPPath,"r")
+    fingerprints = [line.strip().split("\t")[-1] for line in file if line.strip()]
+    file.close()
+    if not fingerprints or [fp for fp in fingerprints if fp.strip("01")]:
+        _fpStores[key] = (mtimes, None, None)
+        return None, None
+    file = open(NNDataPath,"r")
+    rows = [line.rstrip("\n").split('\t') for line in file if line.strip()][1:]
+    file.close()
+    if len(rows) != len(fingerprints):
+        _fpStores[key] = (mtimes, None, None)
+        return None, None
+    store = FingerprintStore.FingerprintStore(fingerprints)
+    _fpStores[key] = (mtimes, store, rows)
+    return store, rows
+
+
 def getNearestNeighbors(query, n, NNDataPath, FPPath = None, resPath = None, idx = 0):
     """ get the n nearest neighbors
         query: bin string with query fingerprint
@@ -89,18 +125,25 @@ def getNearestNeighbors(query, n, NNDataPath, FPPath = None, resPath = None, idx
     idxSimilarity = 0
 
 
-    Nbits = 2048
-    cmdStr = 'echo "' + query + '" | fpin ' + FPPath + " "  +NNDataPath + ' 0.0 '+str(n)
-    status,output = commands.getstatusoutput(cmdStr)
-    if status:
-        print status
-        print output
-        raise Exception(str(output))
-    #             TS              SMILES                    AZID         DATE       expRes
-    # output = "0.7117   CCCC(C)C1(C(=O)NC(=O)NC1=O)CC   AZ10046012   2009-12-02   3.480007"
-    TS=[]
-    for ts in output.split("\n"):
-        TS.append(ts.strip().split('\t'))
+    store, rows = getFingerprintStore(FPPath, NNDataPath)
+    if store is not None:
+        #             TS              SMILES                    AZID         DATE       expRes
+        # TS[n] = ["0.7117", "CCCC(C)C1(C(=O)NC(=O)NC1=O)CC", "AZ10046012", "2009-12-02", "3.480007"]
+        TS = [["%.4f" % sim] + rows[fpIdx] for fpIdx, sim in store.nearest(query, n, 0.0)]
+    else:
+        # Fingerprint files not in the text format are searched with the external fpin tool
+        Nbits = 2048
+        cmdStr = 'echo "' + query + '" | fpin ' + FPPath + " "  +NNDataPath + ' 0.0 '+str(n)
+        status,output = commands.getstatusoutput(cmdStr)
+        if status:
+            print status
+            print output
+            raise Exception(str(output))
+        #             TS              SMILES                    AZID         DATE       expRes
+        # output = "0.7117   CCCC(C)C1(C(=O)NC(=O)NC1=O)CC   AZ10046012   2009-12-02   3.480007"
+        TS=[]
+        for ts in output.split("\n"):
+            TS.append(ts.strip().split('\t'))
     # in TS:
     #    TS[n][0] - tanimoto similarity
     #    TS[n][1] - SMILES
@@ -6,6 +6,7 @@ import string
 
 import orange
 from AZutilities import dataUtilities
+from AZutilities import descCache
 
 #import userDefined Utilites if it exists
 if os.path.isfile(os.path.join( os.environ["AZORANGEHOME"], "azorange","AZutilities","extraUtilities.py")):
@@ -64,7 +65,39 @@ def getSMILESAttr(data):
     else:       
         return smilesName
 
-def getObabelDescResult(data,descList):
+# The descriptors cache, opened when first used. It reopens its connection when used by a forked process
+_descCache = None
+
+def getToolkitVersion(toolkit):
+    """ Returns the version of the toolkit to be used in the descriptors cache key ("" if unknown) """
+    try:
+        if toolkit == "rdk":
+            from rdkit import rdBase
+            return rdBase.rdkitVersion
+        elif toolkit == "obabel":
+            return obabel.ob.OBReleaseVersion()
+    except:
+        pass
+    return ""
+
+def getDescsResults(data, smilesName, toolkit, descList, calcFunc, useCache = True, params = ""):
+    """ Returns a dict {smiles: calcFunc(smiles)} for all the smiles in data
+        If useCache, the results of the molecules already calculated with the same toolkit, descList and params 
+        are retrieved from the descriptors cache, and only the new molecules are calculated.
+    """
+    global _descCache
+    smilesList = [str(ex[smilesName].value) for ex in data]
+    if useCache:
+        if _descCache is None:
+            _descCache = descCache.DescCache()
+        return _descCache.getDescs(smilesList, toolkit, getToolkitVersion(toolkit), descList, calcFunc, params)
+    results = {}
+    for smi in smilesList:
+        if smi not in results:
+            results[smi] = calcFunc(smi)
+    return results
+
+def getObabelDescResult(data,descList,useCache = True):
     """ Calculates the descriptors for the descList using obabel
         It expects an attribute containing smiles with a name defined in AZOrangeConfig.SMILESNAMES
         It returns a dataset with the same smiles input variable, and as many variables as the descriptors 
@@ -78,18 +111,18 @@ def getObabelDescResult(data,descList):
     myDescList = [desc.replace(toolkitsDef["obabel"]["tag"],"") for desc in descList if toolkitsDef["obabel"]["tag"] in desc]
     if not myDescList: return None
        
+    results = getDescsResults(data, smilesName, "obabel", myDescList, lambda smile: obabel.readstring("smi", smile).calcdesc(myDescList), useCache)
     resData = orange.ExampleTable(orange.Domain([data.domain[smilesName]] + [orange.FloatVariable(toolkitsDef["obabel"]["tag"]+name) for name in myDescList],0))
     for ex in data:
         newEx = orange.Example(resData.domain)
         newEx[smilesName] = ex[smilesName]
-        mol = obabel.readstring("smi", str(newEx[smilesName].value)) 
-        moldesc = mol.calcdesc(myDescList)
+        moldesc = results[str(newEx[smilesName].value)]
         for desc in myDescList:
             newEx[toolkitsDef["obabel"]["tag"]+desc] = moldesc[desc]
         resData.append(newEx)
     return resData
    
-def getWebelDescResult(data,descList):
+def getWebelDescResult(data,descList,useCache = True):
     """ Calculates the descriptors for the descList using Webel
         It expects an attribute containing smiles with a name defined in AZOrangeConfig.SMILESNAMES
         It returns a dataset with the same smiles input variable, and as many variables as the descriptors 
@@ -104,11 +137,7 @@ def getWebelDescResult(data,descList):
     if not myDescList: return None
 
     #Compute the results
-    results = {}
-    for ex in data:
-        smile = str(ex[smilesName].value)
-        mol = webel.readstring("smi", smile)
-        results[smile] = mol.calcdesc(myDescList)
+    results = getDescsResults(data, smilesName, "webel", myDescList, lambda smile: webel.readstring("smi", smile).calcdesc(myDescList), useCache)
     # Get all the different descriptor names returned by webel
     varNames = []
     for res in results:
@@ -128,7 +157,7 @@ def getWebelDescResult(data,descList):
     return resData
 
 
-def getCdkDescResult(data,descList):
+def getCdkDescResult(data,descList,useCache = True):
     """ Calculates the descriptors for the descList using cdk
         It expects an attribute containing smiles with a name defined in AZOrangeConfig.SMILESNAMES
         It returns a dataset with the same smiles input variable, and as many variables as the descriptors 
@@ -142,11 +171,7 @@ def getCdkDescResult(data,descList):
     myDescList = [desc.replace(toolkitsDef["cdk"]["tag"],"") for desc in descList if toolkitsDef["cdk"]["tag"] in desc]
     if not myDescList: return None
     #Compute the results
-    results = {}
-    for ex in data:
-        smile = str(ex[smilesName].value)
-        mol = cdk.readstring("smi", smile)
-        results[smile] = mol.calcdesc(myDescList)
+    results = getDescsResults(data, smilesName, "cdk", myDescList, lambda smile: cdk.readstring("smi", smile).calcdesc(myDescList), useCache)
     # Get all the different descriptor names returned by cdk
     varNames = []
     for res in results:
@@ -166,7 +191,7 @@ def getCdkDescResult(data,descList):
     return resData
   
  
-def getRdkDescResult(data,descList, radius = 1):
+def getRdkDescResult(data,descList, radius = 1, useCache = True):
     """ Calculates the descriptors for the descList using RDK
         It expects an attribute containing smiles with a name defined in AZOrangeConfig.SMILESNAMES
         It returns a dataset with the same smiles input variable, and as many variables as the descriptors 
@@ -195,81 +220,69 @@ def getRdkDescResult(data,descList, radius = 1):
                 FP_desc.append(attr)
         myDescList = tmpDescList
 
-    #Get fingerprints in advance
+    def calcDescs(molStr):
+        """ Returns the descriptors and the fingerprint counts of the molecule, parsing it only once """
+        try:
+            chemMol = rdk.Chem.MolFromSmiles(molStr,True)
+            if chemMol:
+                mol = rdk.Molecule(chemMol)
+            else:
+                chemMol = rdk.Chem.MolFromSmiles(molStr,False) 
+                mol = rdk.readstring("mol", rdk.Chem.MolToMolBlock(chemMol))
+            res = {"descs": mol.calcdesc(myDescList), "FP": {}}
+            if FingerPrints:
+                resDict = rdk.AllChem.GetMorganFingerprint(chemMol,radius).GetNonzeroElements()
+                for ID in resDict:
+                    res["FP"][toolkitsDef["rdk"]["tag"]+"FP_"+str(ID)] = float(resDict[ID])
+            return res
+        except:
+            return None
+
+    #Compute the results of each molecule only once
+    results = getDescsResults(data, smilesName, "rdk", myDescList, calcDescs, useCache, params = "FingerPrints="+str(FingerPrints)+",radius="+str(radius))
+
+    #Get the attributes from the results
+    attrObj = []
     fingerPrintsAttrs = []
-    fingerPrintsRes = {}
+    fpNames = set()
+    for ex in data:
+        res = results[str(ex[smilesName].value)]
+        if res is None:
+            continue
+        if not attrObj:
+            for desc in myDescList:
+                if type(res["descs"][desc]) == str:
+                    attrObj.append(orange.StringVariable(toolkitsDef["rdk"]["tag"] + desc))
+                else:
+                    attrObj.append(orange.FloatVariable(toolkitsDef["rdk"]["tag"] + desc))
+        for name in res["FP"]:
+            if name not in fpNames:
+                fpNames.add(name)
+                fingerPrintsAttrs.append(orange.FloatVariable(name))
     if FingerPrints:
-        for ex in data:
-            mol = str(ex[smilesName].value)
-            try:
-                chemMol = rdk.Chem.MolFromSmiles(mol,True)
-                if not chemMol:
-                    chemMol = rdk.Chem.MolFromSmiles(mol,False)
-                fingerPrint = rdk.AllChem.GetMorganFingerprint(chemMol,radius)
-                resDict = fingerPrint.GetNonzeroElements()
-            except:
-                continue
-            fingerPrintsRes[mol] = {}
-            for ID in resDict:
-                count = resDict[ID]
-                name = toolkitsDef["rdk"]["tag"]+"FP_"+str(ID)
-                if name not in [x.name for x in fingerPrintsAttrs]:
-                    fingerPrintsAttrs.append(orange.FloatVariable(name))
-                fingerPrintsRes[mol][name] = float(count)
         #Add FP attributes even if there was no reference to it. Models will need it as FP not present, i.e. equal 0.0 !
         for fpDesc in FP_desc:
             name = toolkitsDef["rdk"]["tag"]+fpDesc
-            if name not in [str(attr.name) for attr in fingerPrintsAttrs]:
+            if name not in fpNames:
+                fpNames.add(name)
                 fingerPrintsAttrs.append(orange.FloatVariable(name))
-    #Test attrTypes
-    for ex in data:
-        try:
-             attrObj = []
-             molStr = str(ex[smilesName].value)
-             chemMol = rdk.Chem.MolFromSmiles(molStr,True)
-             if not chemMol:
-                chemMol = rdk.Chem.MolFromSmiles(molStr,False)
-             mol = rdk.readstring("mol", rdk.Chem.MolToMolBlock(chemMol))
-             moldesc = mol.calcdesc(myDescList)
-             for desc in myDescList:
-		 if type(moldesc[desc]) == str:
-                     attrObj.append(orange.StringVariable(toolkitsDef["rdk"]["tag"] + desc))
-                 else:
-                     attrObj.append(orange.FloatVariable(toolkitsDef["rdk"]["tag"] + desc))
-
-             #Process fingerprints
-             if FingerPrints:
-                 for desc in [fp for fp in fingerPrintsAttrs if fp.name not in attrObj]:
-                     attrObj.append(desc)#orange.FloatVariable(desc.name))
-             break
-        except:
-            continue    
-
+        attrObj += fingerPrintsAttrs
 
     resData = orange.ExampleTable(orange.Domain([data.domain[smilesName]] + attrObj,0))     
     badCompounds = 0
     for ex in data:
         newEx = orange.Example(resData.domain)   # All attrs: ?, ?, ?, ..., ?
         newEx[smilesName] = ex[smilesName]
-        molStr = str(newEx[smilesName].value)
+        res = results[str(newEx[smilesName].value)]
         # OBS - add something keeping count on the number of unused smiles
         try:
-             chemMol = rdk.Chem.MolFromSmiles(molStr,True)
-             if not chemMol:
-                chemMol = rdk.Chem.MolFromSmiles(molStr,False) 
-             mol = rdk.readstring("mol", rdk.Chem.MolToMolBlock(chemMol))
-             #mol = rdk.readstring("smi", molStr)
-             moldesc = mol.calcdesc(myDescList)
              for desc in myDescList:
-                 newEx[toolkitsDef["rdk"]["tag"]+desc] = moldesc[desc]
+                 newEx[toolkitsDef["rdk"]["tag"]+desc] = res["descs"][desc]
  
              #Process fingerprints
              if FingerPrints:
                  for desc in fingerPrintsAttrs:
-                     if desc.name in fingerPrintsRes[molStr]:
-                         newEx[desc.name] = fingerPrintsRes[molStr][desc.name]
-                     else:
-                         newEx[desc.name] = 0.0
+                     newEx[desc.name] = res["FP"].get(desc.name, 0.0)
              resData.append(newEx)
         except: 
             badCompounds += 1
@@ -279,10 +292,12 @@ def getRdkDescResult(data,descList, radius = 1):
 
     return resData
  
-def getCinfonyDescResults(origData,descList,radius=1):
+def getCinfonyDescResults(origData,descList,radius=1,useCache=True):
     """Calculates the cinfony descriptors on origData
        maintains the input variables and class
        Adds the Cinfony descritors 
+       If useCache, the descriptors already calculated for the same molecules are retrieved from the
+       descriptors cache (AZOrangeConfig.DESCCACHEPATH, if set) and only the new molecules are calculated
             Returns a new Dataset"""
     if not origData or not descList: return None
     smilesName = getSMILESAttr(origData)
@@ -302,13 +317,13 @@ def getCinfonyDescResults(origData,descList,radius=1):
     results = []
 
     # Calculate available descriptors
-    res = getObabelDescResult(data,descList)
+    res = getObabelDescResult(data,descList,useCache)
     if res: results.append(res)
-    res = getRdkDescResult(data,descList,radius)
+    res = getRdkDescResult(data,descList,radius,useCache)
     if res: results.append(res)
-    res = getWebelDescResult(data,descList)
+    res = getWebelDescResult(data,descList,useCache)
     if res: results.append(res)
-    res = getCdkDescResult(data,descList)
+    res = getCdkDescResult(data,descList,useCache)
     if res: results.append(res)
     # Convert any nan to a '?'
     if len(results):
@@ -9,8 +9,34 @@ from AZutilities import evalUtilities
 from AZutilities import miscUtilities
 import orngStat
 import os,random
+import multiprocessing
 from pprint import pprint
 import statc
+from trainingMethods import AZBaseClasses
+
+def _runFoldTask(task):
+    """ Runs one (ML method, fold) task of UnbiasedAccuracyGetter.getAcc in a worker process.
+        The model is saved in a scratch dir so that it can be loaded by the parent process.
+    """
+    ml, foldN = task
+    getter, DataIdxs, MLmethods = miscUtilities.getLocalPoolArgs()
+    modelPath = None
+    try:
+        foldRes = getter._runFold(ml, foldN, MLmethods[ml], DataIdxs)
+        modelPath = miscUtilities.createScratchDir(desc = "AccWOptParamModel", seed = str(os.getpid())+"_"+str(foldN))
+        foldRes["model"].write(os.path.join(modelPath, "model"))
+        foldRes["model"] = None
+    except:
+        if modelPath:
+            miscUtilities.removeDir(modelPath)
+            modelPath = None
+        foldRes = {"model": None, "error": str(sys.exc_info()[0]) +" "+\
+                                            str(sys.exc_info()[1]) +" "+\
+                                            str(traceback.extract_tb(sys.exc_info()[2]))}
+    foldRes["ml"] = ml
+    foldRes["foldN"] = foldN
+    foldRes["modelPath"] = modelPath
+    return foldRes
 
 
 
@@ -30,6 +56,7 @@ class UnbiasedAccuracyGetter():
         self.testAttrFilter = None
         self.testFilterVal = None
         self.sampler = dataUtilities.SeedDataSampler
+        self.nWorkers = 1          # Number of local processes running the folds of each ML method. 0 uses all the cores
         # Append arguments to the __dict__ member variable 
         self.__dict__.update(kwds)
         self.learnerName = ""
@@ -244,6 +271,145 @@ class UnbiasedAccuracyGetter():
 
         return res
         
+    def _runFold(self, ml, foldN, learner, DataIdxs):
+        """ Optimizes, trains and tests the learner in the fold foldN of DataIdxs
+            Returns a dict with the results of the fold:
+                {"nTrainEx", "nTestEx", "optAcc", "model", "results", "exp_pred", "logTxt", "runningTime", "error"}
+        """
+        startTime = time.time()
+        # Seed each fold independently so that the results do not depend on the order
+        #   the folds are run, neither on whether they run in local worker processes
+        random.seed(str(ml)+"_"+str(foldN))
+        logTxt = ""
+        exp_pred = []
+        trainData = self.data.select(DataIdxs,foldN,negate=1)
+        testData = self.data.select(DataIdxs,foldN)
+        smilesAttr = dataUtilities.getSMILESAttr(trainData)
+        if smilesAttr:
+            self.__log("Found SMILES attribute:"+smilesAttr)
+            if learner.specialType == 1:
+               trainData = dataUtilities.attributeSelectionData(trainData, [smilesAttr, trainData.domain.classVar.name]) 
+               testData = dataUtilities.attributeSelectionData(testData, [smilesAttr, testData.domain.classVar.name]) 
+               self.__log("Selected attrs: "+str([attr.name for attr in trainData.domain]))
+            else:
+               trainData = dataUtilities.attributeDeselectionData(trainData, [smilesAttr]) 
+               testData = dataUtilities.attributeDeselectionData(testData, [smilesAttr]) 
+               self.__log("Selected attrs: "+str([attr.name for attr in trainData.domain[0:3]] + ["..."] + [attr.name for attr in trainData.domain[len(trainData.domain)-3:]]))
+
+        #Test if trainsets inside optimizer will respect dataSize criterias.
+        #  if not, don't optimize, but still train the model
+        dontOptimize = False
+        if self.responseType != "Classification" and (len(trainData)*(1-1.0/self.nInnerFolds) < 20):
+            dontOptimize = True
+        else:                      
+            tmpDataIdxs = self.sampler(trainData, self.nInnerFolds)
+            tmpTrainData = trainData.select(tmpDataIdxs,1,negate=1)
+            if not self.__checkTrainData(tmpTrainData, False):
+                dontOptimize = True
+
+        SpecialModel = None
+        if dontOptimize:
+            logTxt += "       Fold "+str(foldN)+": Too few compounds to optimize model hyper-parameters\n"
+            self.__log(logTxt)
+            if trainData.domain.classVar.varType == orange.VarTypes.Discrete:
+                res = evalUtilities.crossValidation([learner], trainData, folds=5, stratified=orange.MakeRandomIndices.StratifiedIfPossible, random_generator = random.randint(0, 100))
+                optAcc = evalUtilities.CA(res)[0]
+            else:
+                res = evalUtilities.crossValidation([learner], trainData, folds=5, stratified=orange.MakeRandomIndices.StratifiedIfPossible, random_generator = random.randint(0, 100))
+                optAcc = evalUtilities.R2(res)[0]
+        else:
+            if learner.specialType == 1: 
+                    if trainData.domain.classVar.varType == orange.VarTypes.Discrete:
+                            optInfo, SpecialModel = learner.optimizePars(trainData, folds = 5)
+                            optAcc = optInfo["Acc"]
+                    else:
+                            res = evalUtilities.crossValidation([learner], trainData, folds=5, stratified=orange.MakeRandomIndices.StratifiedIfPossible, random_generator = random.randint(0, 100))
+                            optAcc = evalUtilities.R2(res)[0]
+            else:
+                    runPath = miscUtilities.createScratchDir(baseDir = AZOC.NFS_SCRATCHDIR, desc = "AccWOptParam", seed = str(os.getpid())+"_"+str(id(trainData)))
+                    trainData.save(os.path.join(runPath,"trainData.tab"))
+                    tunedPars = paramOptUtilities.getOptParam(
+                        learner = learner, 
+                        trainDataFile = os.path.join(runPath,"trainData.tab"), 
+                        paramList = self.paramList, 
+                        useGrid = False, 
+                        verbose = self.verbose, 
+                        queueType = self.queueType, 
+                        runPath = runPath, 
+                        nExtFolds = None, 
+                        nFolds = self.nInnerFolds,
+                        logFile = self.logFile,
+                        getTunedPars = True,
+                        fixedParams = self.fixedParams)
+                    if not learner or not learner.optimized:
+                        self.__log("       WARNING: GETACCWOPTPARAM: The learner "+str(ml)+" was not optimized.")
+                        self.__log("                It will be ignored")
+                        #self.__log("                It will be set to default parameters")
+                        self.__log("                    DEBUG can be done in: "+runPath)
+                        #Set learner back to default 
+                        #learner = learner.__class__()
+                        raise Exception("The learner "+str(ml)+" was not optimized.")
+                    else:
+                        if trainData.domain.classVar.varType == orange.VarTypes.Discrete:
+                            optAcc = tunedPars[0]
+                        else:
+                            res = evalUtilities.crossValidation([learner], trainData, folds=5, stratified=orange.MakeRandomIndices.StratifiedIfPossible, random_generator = random.randint(0, 100))
+                            optAcc = evalUtilities.R2(res)[0]
+
+                        miscUtilities.removeDir(runPath) 
+        #Train the model
+        if SpecialModel is not None:
+            model = SpecialModel 
+        else:
+            model = learner(trainData)
+        #Test the model
+        if self.responseType == "Classification":
+            results = (evalUtilities.getClassificationAccuracy(testData, model), evalUtilities.getConfMat(testData, model) )
+        else:
+            # Predict using bulk-predict
+            predictions = model(testData)
+            # Gather predictions
+            for n,ex in enumerate(testData):
+                exp_pred.append((ex.getclass().value, predictions[n].value))
+            results = (evalUtilities.calcRMSE(exp_pred), evalUtilities.calcRsqrt(exp_pred) )
+
+        return {"nTrainEx":len(trainData), "nTestEx":len(testData), "optAcc":optAcc, "model":model, "results":results,
+                "exp_pred":exp_pred, "logTxt":logTxt, "runningTime":time.time() - startTime, "error":None}
+
+
+    def __getParallelFoldsResults(self, sortedML, foldsN, DataIdxs, MLmethods, nWorkers, callBack = None):
+        """ Runs each pair of ML method and fold in a pool of nWorkers local processes.
+            The models are saved by the workers and loaded back in this process.
+            Returns a dict {(ml, foldN): <result of _runFold>} or None if stopped by the callBack
+        """
+        tasks = [(ml, foldN) for ml in sortedML for foldN in foldsN]
+        nWorkers = min(nWorkers, len(tasks))
+        self.__log("Running "+str(len(tasks))+" fold tasks in "+str(nWorkers)+" local processes")
+        foldsRes = {}
+
+        def onError(task, error):
+            return {"ml": task[0], "foldN": task[1], "model": None, "modelPath": None, "error": error}
+
+        def onResult(idx, foldRes, nDone):
+            foldsRes[(foldRes["ml"], foldRes["foldN"])] = foldRes
+            if callBack and not callBack((100*nDone)/len(tasks)):
+                return False
+            return True
+
+        # The workers inherit the data and learners when the pool forks
+        stopped = miscUtilities.runInLocalPool(_runFoldTask, tasks, nWorkers, args = (self, DataIdxs, MLmethods), \
+                    onResult = onResult, onError = onError) is None
+
+        # Load the models saved by the workers
+        for foldRes in foldsRes.values():
+            if foldRes["modelPath"]:
+                if not stopped:
+                    foldRes["model"] = AZBaseClasses.modelRead(os.path.join(foldRes["modelPath"], "model"))
+                miscUtilities.removeDir(foldRes["modelPath"])
+        if stopped:
+            return None
+        return foldsRes
+
     def getAcc(self, callBack = None, callBackWithFoldModel = None):
         """ For regression problems, it returns the RMSE and the Q2 
             For Classification problems, it returns CA and the ConfMat
@@ -315,6 +481,16 @@ class UnbiasedAccuracyGetter():
 
         stepsDone = 0
         nTotalSteps = len(sortedML) * self.nExtFolds  
+        if type(self.learner) == dict:
+            self.paramList = None
+        # Run all the fold/ML method pairs in local worker processes
+        nWorkers = self.nWorkers or multiprocessing.cpu_count()
+        if nWorkers > 1 and len(sortedML) * nFolds > 1:
+            foldsRes = self.__getParallelFoldsResults(sortedML, foldsN, DataIdxs, MLmethods, nWorkers, callBack)
+            if foldsRes is None:
+                return None
+        else:
+            foldsRes = None
         for ml in sortedML:
           startTime = time.time()
           self.__log("    > "+str(ml)+"...")
@@ -327,123 +503,40 @@ class UnbiasedAccuracyGetter():
             nTestEx[ml] = []
             optAcc[ml] = []
             logTxt = ""
+            runningTime = 0
             for foldN in foldsN:
-                if type(self.learner) == dict:
-                    self.paramList = None
-
-                trainData = self.data.select(DataIdxs,foldN,negate=1)
-                testData = self.data.select(DataIdxs,foldN)
-                smilesAttr = dataUtilities.getSMILESAttr(trainData)
-                if smilesAttr:
-                    self.__log("Found SMILES attribute:"+smilesAttr)
-                    if MLmethods[ml].specialType == 1:
-                       trainData = dataUtilities.attributeSelectionData(trainData, [smilesAttr, trainData.domain.classVar.name]) 
-                       testData = dataUtilities.attributeSelectionData(testData, [smilesAttr, testData.domain.classVar.name]) 
-                       self.__log("Selected attrs: "+str([attr.name for attr in trainData.domain]))
-                    else:
-                       trainData = dataUtilities.attributeDeselectionData(trainData, [smilesAttr]) 
-                       testData = dataUtilities.attributeDeselectionData(testData, [smilesAttr]) 
-                       self.__log("Selected attrs: "+str([attr.name for attr in trainData.domain[0:3]] + ["..."] + [attr.name for attr in trainData.domain[len(trainData.domain)-3:]]))
-
-                nTrainEx[ml].append(len(trainData))
-                nTestEx[ml].append(len(testData))
-                #Test if trainsets inside optimizer will respect dataSize criterias.
-                #  if not, don't optimize, but still train the model
-                dontOptimize = False
-                if self.responseType != "Classification" and (len(trainData)*(1-1.0/self.nInnerFolds) < 20):
-                    dontOptimize = True
-                else:                      
-                    tmpDataIdxs = self.sampler(trainData, self.nInnerFolds)
-                    tmpTrainData = trainData.select(tmpDataIdxs,1,negate=1)
-                    if not self.__checkTrainData(tmpTrainData, False):
-                        dontOptimize = True
-
-                SpecialModel = None
-                if dontOptimize:
-                    logTxt += "       Fold "+str(foldN)+": Too few compounds to optimize model hyper-parameters\n"
-                    self.__log(logTxt)
-                    if trainData.domain.classVar.varType == orange.VarTypes.Discrete:
-                        res = evalUtilities.crossValidation([MLmethods[ml]], trainData, folds=5, stratified=orange.MakeRandomIndices.StratifiedIfPossible, random_generator = random.randint(0, 100))
-                        CA = evalUtilities.CA(res)[0]
-                        optAcc[ml].append(CA)
-                    else:
-                        res = evalUtilities.crossValidation([MLmethods[ml]], trainData, folds=5, stratified=orange.MakeRandomIndices.StratifiedIfPossible, random_generator = random.randint(0, 100))
-                        R2 = evalUtilities.R2(res)[0]
-                        optAcc[ml].append(R2)
-                else:
-                    if MLmethods[ml].specialType == 1: 
-                            if trainData.domain.classVar.varType == orange.VarTypes.Discrete:
-                                    optInfo, SpecialModel = MLmethods[ml].optimizePars(trainData, folds = 5)
-                                    optAcc[ml].append(optInfo["Acc"])
-                            else:
-                                    res = evalUtilities.crossValidation([MLmethods[ml]], trainData, folds=5, stratified=orange.MakeRandomIndices.StratifiedIfPossible, random_generator = random.randint(0, 100))
-                                    R2 = evalUtilities.R2(res)[0]
-                                    optAcc[ml].append(R2)
-                    else:
-                            runPath = miscUtilities.createScratchDir(baseDir = AZOC.NFS_SCRATCHDIR, desc = "AccWOptParam", seed = id(trainData))
-                            trainData.save(os.path.join(runPath,"trainData.tab"))
-                            tunedPars = paramOptUtilities.getOptParam(
-                                learner = MLmethods[ml], 
-                                trainDataFile = os.path.join(runPath,"trainData.tab"), 
-                                paramList = self.paramList, 
-                                useGrid = False, 
-                                verbose = self.verbose, 
-                                queueType = self.queueType, 
-                                runPath = runPath, 
-                                nExtFolds = None, 
-                                nFolds = self.nInnerFolds,
-                                logFile = self.logFile,
-                                getTunedPars = True,
-                                fixedParams = self.fixedParams)
-                            if not MLmethods[ml] or not MLmethods[ml].optimized:
-                                self.__log("       WARNING: GETACCWOPTPARAM: The learner "+str(ml)+" was not optimized.")
-                                self.__log("                It will be ignored")
-                                #self.__log("                It will be set to default parameters")
-                                self.__log("                    DEBUG can be done in: "+runPath)
-                                #Set learner back to default 
-                                #MLmethods[ml] = MLmethods[ml].__class__()
-                                raise Exception("The learner "+str(ml)+" was not optimized.")
-                            else:
-                                if trainData.domain.classVar.varType == orange.VarTypes.Discrete:
-                                    optAcc[ml].append(tunedPars[0])
-                                else:
-                                    res = evalUtilities.crossValidation([MLmethods[ml]], trainData, folds=5, stratified=orange.MakeRandomIndices.StratifiedIfPossible, random_generator = random.randint(0, 100))
-                                    R2 = evalUtilities.R2(res)[0]
-                                    optAcc[ml].append(R2)
-
-                                miscUtilities.removeDir(runPath) 
-                #Train the model
-                if SpecialModel is not None:
-                    model = SpecialModel 
+                if foldsRes is None:
+                    foldRes = self._runFold(ml, foldN, MLmethods[ml], DataIdxs)
                 else:
-                    model = MLmethods[ml](trainData)
-                models[ml].append(model)
-                #Test the model
-                if self.responseType == "Classification":
-                    results[ml].append((evalUtilities.getClassificationAccuracy(testData, model), evalUtilities.getConfMat(testData, model) ) )
-                else:
-                    local_exp_pred = []
-                    # Predict using bulk-predict
-                    predictions = model(testData)
-                    # Gather predictions
-                    for n,ex in enumerate(testData):
-                        local_exp_pred.append((ex.getclass().value, predictions[n].value))
-                    results[ml].append((evalUtilities.calcRMSE(local_exp_pred), evalUtilities.calcRsqrt(local_exp_pred) ) )
-                    #Save the experimental value and correspondent predicted value
-                    exp_pred[ml] += local_exp_pred
-                if callBack:
+                    foldRes = foldsRes[(ml, foldN)]
+                    if foldRes["error"]:
+                        raise Exception(foldRes["error"])
+                    if foldRes["model"] is None:
+                        raise Exception("The model of fold "+str(foldN)+" could not be loaded from the worker process.")
+                logTxt += foldRes["logTxt"]
+                runningTime += foldRes["runningTime"]
+                nTrainEx[ml].append(foldRes["nTrainEx"])
+                nTestEx[ml].append(foldRes["nTestEx"])
+                optAcc[ml].append(foldRes["optAcc"])
+                models[ml].append(foldRes["model"])
+                results[ml].append(foldRes["results"])
+                #Save the experimental value and correspondent predicted value
+                exp_pred[ml] += foldRes["exp_pred"]
+                if callBack and foldsRes is None:
                      stepsDone += 1
                      if not callBack((100*stepsDone)/nTotalSteps): return None
                 if callBackWithFoldModel:
-                    callBackWithFoldModel(model) 
-
+                    callBackWithFoldModel(foldRes["model"]) 
             res = self.createStatObj(results[ml], exp_pred[ml], nTrainEx[ml], nTestEx[ml],self.responseType, self.nExtFolds, logTxt, labels = hasattr(self.data.domain.classVar,"values") and list(self.data.domain.classVar.values) or None )
             if self.verbose > 0: 
                 print "UnbiasedAccuracyGetter!Results  "+ml+":\n"
                 pprint(res)
             if not res:
                 raise Exception("No results available!")
-            res["runningTime"] = time.time() - startTime
+            if foldsRes is None:
+                res["runningTime"] = time.time() - startTime
+            else:
+                res["runningTime"] = runningTime
             statistics[ml] = copy.deepcopy(res)
             self.__writeResults(statistics)
             self.__log("       OK")
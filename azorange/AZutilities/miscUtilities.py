@@ -245,6 +245,219 @@ def removeDir(dirToRem):
     else:
         return False
 
+# State shared with the worker processes of runInLocalPool. It is set before creating the pool so that the
+#   workers inherit it when they are forked, instead of pickling it with each task.
+_localPool = {"args": None, "monitor": None}
+
+def getLocalPoolArgs():
+    """Returns the args given to runInLocalPool, to be used by the tasks running in its worker processes"""
+    return _localPool["args"]
+
+
+def _initLocalPoolWorker(nWorkers, monitorAddress):
+    from AZutilities import threadPolicy
+    import socket
+    threadPolicy.setWorkerCap(nWorkers)
+    # The parent notices that this worker died when this connection is closed. It must not be inherited by
+    #   the programs the tasks run, or they would keep it open.
+    monitor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    monitor.connect(monitorAddress)
+    fcntl.fcntl(monitor.fileno(), fcntl.F_SETFD, fcntl.fcntl(monitor.fileno(), fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+    _localPool["monitor"] = monitor
+
+
+def _runLocalPoolTask(func, idx, attempt, task):
+    # Report which task this worker runs so that the parent can notice if it dies meanwhile.
+    # The result is pickled here so that any error, including an unpicklable result, reaches the
+    #   parent through the apply_async callback.
+    import sys, traceback, cPickle
+    _localPool["monitor"].sendall(str(idx)+" "+str(attempt)+"\n")
+    try:
+        return (idx, attempt, None, cPickle.dumps(func(task), cPickle.HIGHEST_PROTOCOL))
+    except:
+        traceback.print_exc()
+        return (idx, attempt, str(sys.exc_info()[0]) + " " + str(sys.exc_info()[1]), None)
+
+
+def _monitorLocalPoolWorkers(listener, stopFd, events):
+    """Runs in a thread of the runInLocalPool process. Each worker connects to listener and reports the tasks
+       it starts. When a worker connection is closed, posts ("died", idx, attempt) in events for the last
+       task the worker started. Returns when stopFd is readable.
+    """
+    import select
+    workers = {}    # connection: [unread data, (idx, attempt) of the last task started]
+    try:
+        while True:
+            readable = select.select([listener, stopFd] + workers.keys(), [], [])[0]
+            if stopFd in readable:
+                return
+            for conn in readable:
+                if conn is listener:
+                    workers[listener.accept()[0]] = ["", None]
+                    continue
+                data = conn.recv(4096)
+                if not data:
+                    if workers[conn][1] is not None:
+                        events.put(("died",) + workers[conn][1])
+                    del workers[conn]
+                    conn.close()
+                    continue
+                lines = (workers[conn][0] + data).split("\n")
+                workers[conn][0] = lines[-1]
+                for line in lines[:-1]:
+                    idx, attempt = line.split()
+                    workers[conn][1] = (int(idx), int(attempt))
+    finally:
+        for conn in workers:
+            conn.close()
+
+
+def runInLocalPool(func, tasks, nWorkers = 0, args = None, onResult = None, onError = None, isFailed = None, \
+                   maxRestarts = 0, onRestart = None):
+    """Runs func(task) for each task in tasks in a pool of nWorkers local processes (0 uses all the cores).
+       Each worker process is capped to its share of the OpenCV threads (threadPolicy.setWorkerCap).
+       func must be a module level function. The tasks can get args with getLocalPoolArgs(). It is inherited 
+       by the worker processes when they are forked, so it can hold data that is expensive to pickle.
+       When called from a daemonic process, like a worker of another local pool, the tasks run serially in
+       that process since it is not allowed to have children.
+
+       The task results are collected as they arrive:
+           onError(task, error)        Returns the result of a task that raised an exception or whose worker
+                                       process died (e.g. a segfault). By default the result is None.
+           isFailed(result)            Returns True if the result is of a failed task. By default the tasks of 
+                                       onError are the failed ones.
+           onRestart(idx, result, n)   Called before running a failed task for the n-th time. The failed tasks
+                                       are run again up to maxRestarts times.
+           onResult(idx, result, nDone)  Called with the final result of tasks[idx] and the number of tasks done.
+                                       If it returns False, the pool is terminated and None is returned.
+       The apply_async callbacks and a thread watching the connections of the workers post the results and
+       the deaths of the workers in a queue that this process waits on.
+       Returns the list of results, in the order of tasks, or None if stopped by onResult.
+    """
+    import multiprocessing
+    from multiprocessing.connection import arbitrary_address
+    import sys, traceback, cPickle, socket, threading, Queue
+    if not tasks:
+        return []
+    results = [None] * len(tasks)
+    nRestarts = [0] * len(tasks)
+    nDone = [0]
+
+    def handleResult(idx, result, error):
+        """Returns "restart" if tasks[idx] must run again, "stop" if onResult stopped the pool, otherwise "done" """
+        if error is not None:
+            print "ERROR on the local task "+str(idx)+": "+error
+            result = None
+            if onError:
+                result = onError(tasks[idx], error)
+            failed = isFailed is None or isFailed(result)
+        else:
+            failed = isFailed is not None and isFailed(result)
+        if failed and nRestarts[idx] < maxRestarts:
+            nRestarts[idx] += 1
+            if onRestart:
+                onRestart(idx, result, nRestarts[idx])
+            return "restart"
+        results[idx] = result
+        nDone[0] += 1
+        if onResult and onResult(idx, result, nDone[0]) is False:
+            return "stop"
+        return "done"
+
+    if multiprocessing.current_process().daemon:
+        # Keep the args of the pool running this process, its task may still need them
+        poolArgs = _localPool["args"]
+        _localPool["args"] = args
+        try:
+            for idx, task in enumerate(tasks):
+                action = "restart"
+                while action == "restart":
+                    error = None
+                    result = None
+                    try:
+                        result = func(task)
+                    except:
+                        error = str(sys.exc_info()[0]) + " " + str(sys.exc_info()[1])
+                        traceback.print_exc()
+                    action = handleResult(idx, result, error)
+                if action == "stop":
+                    return None
+        finally:
+            _localPool["args"] = poolArgs
+        return results
+
+    nWorkers = max(1, min(nWorkers or multiprocessing.cpu_count(), len(tasks)))
+    pending = {}            # idx: (attempt, AsyncResult)
+    events = Queue.Queue()  # ("result", idx, attempt, error, pickledResult) or ("died", idx, attempt)
+    stopped = False
+    workerDied = False
+    monitorAddress = arbitrary_address("AF_UNIX")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(monitorAddress)
+    listener.listen(nWorkers)
+    stopRead, stopWrite = os.pipe()
+    monitor = threading.Thread(target = _monitorLocalPoolWorkers, args = (listener, stopRead, events))
+    monitor.daemon = True
+    monitor.start()
+    _localPool["args"] = args
+    pool = multiprocessing.Pool(nWorkers, _initLocalPoolWorker, (nWorkers, monitorAddress))
+
+    def submit(idx):
+        pending[idx] = (nRestarts[idx], pool.apply_async(_runLocalPoolTask, (func, idx, nRestarts[idx], tasks[idx]), \
+                                                         callback = lambda res: events.put(("result",) + res)))
+    try:
+        for idx in range(len(tasks)):
+            submit(idx)
+        while pending and not stopped:
+            event = events.get()
+            idx, attempt = event[1:3]
+            # Skip the events of an attempt already handled
+            if idx not in pending or pending[idx][0] != attempt:
+                continue
+            result = None
+            if event[0] == "result":
+                error = event[3]
+                if error is None:
+                    try:
+                        result = cPickle.loads(event[4])
+                    except:
+                        error = str(sys.exc_info()[0]) + " " + str(sys.exc_info()[1])
+            else:
+                # The worker may have sent the result just before dying. Then its event is in the queue.
+                pending[idx][1].wait(1)
+                if pending[idx][1].ready():
+                    continue
+                error = "The worker process died"
+                workerDied = True
+            del pending[idx]
+            action = handleResult(idx, result, error)
+            if action == "restart":
+                submit(idx)
+            elif action == "stop":
+                stopped = True
+    except:
+        stopped = True
+        raise
+    finally:
+        # The pool never closes while waiting for the result of a task whose worker died
+        if stopped or pending or workerDied:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+        os.write(stopWrite, "x")
+        monitor.join()
+        listener.close()
+        os.close(stopRead)
+        os.close(stopWrite)
+        if os.path.exists(monitorAddress):
+            os.remove(monitorAddress)
+        _localPool["args"] = None
+    if stopped:
+        return None
+    return results
+
+
 def isNumber(inStr):
     """Returns True if the string inStr can be converted to float, i.e. it ts a number (int or float)"""
     try:
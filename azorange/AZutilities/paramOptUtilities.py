@@ -6,6 +6,9 @@ import orange
 import types
 import string
 import os, sys
+import signal
+import socket
+import tempfile
 import orngTest
 import AZLearnersParamsConfig
 from AZutilities import miscUtilities
@@ -27,7 +30,7 @@ version = 11
 class Appspack:
     userVars = ("qsubFile","advancedMPIoptions","np","machinefile","externalControl","useParameters", "learner", "dataSet", "runPath", "verbose",\
                 "evaluateMethod", "findMin", "samplingMethod", "nFolds","useGridSearchFirst","gridSearchInnerPoints", "queueType", "nExtFolds", \
-                "useStd") 
+                "useStd", "usePersistentEvaluator") 
     LEAVE_ONE_OUT         = 0
     FOLD_CROSS_VALIDATION = 1
     def __init__(self, **kwds):
@@ -55,6 +58,8 @@ class Appspack:
         self.nExtFolds = None            # The number of folds to use in a loop over CV with different seeds. To reduce the 
                                          # influence of data sampling on the generalization accuracy of each model parameter point.
         self.useStd = True               # Do not select optimize parameter unless the accuracy differenc is significant.
+        self.usePersistentEvaluator = False  # Evaluate the appspack points in a long-lived process (AZEvalServer.py) that loads 
+                                         # the dataset and the CV folds only once. Only used when all the processes run in this host.
         # Append arguments to the __dict__ member variable 
         self.__dict__.update(kwds)
 
@@ -67,6 +72,8 @@ class Appspack:
         self.origParameters = None      # All the optimization parameters present in the static AZLearnersParamsConfig.py file
         self.finishedFlag = True        # Flag indicating the termination of Optimization
         self.appspackPID = 0            # the PID of current appspack process for this object instance
+        self.evalServerPID = 0          # the PID of the persistent evaluator process (AZEvalServer.py), if running
+        self.evalServerSocket = None    # the unix socket where the persistent evaluator receives the points to evaluate
         self.tunedParameters = "No parameters yet."                     # the tuned parameters after success optimization
         self.qsubFile = None            # Name of file for sge job
         self.qsubJobId = None           # qsub job id
@@ -112,6 +119,7 @@ class Appspack:
                 if ("appspack" in psLine or "mpirun" in psLine or "qsub" in psLine) and "<defunct>" not in psLine:
                     return False
                 else:
+                    self.__StopEvalServer()
                     self.assignTunedParameters()
                     self.finishedFlag = True
                     self.appspackPID = 0
@@ -140,6 +148,7 @@ class Appspack:
                             time.sleep(0.5)
                         readsDone += 1
                     if "appspack" not in psLine or "<defunct>" in psLine:
+                            self.__StopEvalServer()
                             self.tunedParameters = "The optimizer was stopped by the user"
                             self.appspackPID = 0
                             self.finishedFlag = True
@@ -903,8 +912,13 @@ fh.close()
         if not self.parameters:
             return None
         # Create the python script to be called by appspack: self.runPath+"runScript.py"
-        if self.__CreateAppspackScript(file = self.runPath+"runScript.py", evaluateMethod = self.evaluateMethod, findMin = self.findMin) == None:
-            return None
+        #   When using the persistent evaluator, the runScript.py only forwards the point to the evaluator
+        if self.usePersistentEvaluator and self.__IsLocalRun() and self.__StartEvalServer(self.runPath+"runScript.py"):
+            if self.verbose > 0: print "Using persistent evaluator with PID ",self.evalServerPID
+        else:
+            if self.usePersistentEvaluator and self.verbose > 0: print "WARNING: Not possible to use the persistent evaluator. Each point will be evaluated in a new process."
+            if self.__CreateAppspackScript(file = self.runPath+"runScript.py", evaluateMethod = self.evaluateMethod, findMin = self.findMin) == None:
+                return None
         # Call APPSPACK with input file = self.runPath+"input.apps" and wait it to finish  
         self.usedMPI = False    
         if self.advancedMPIoptions or (self.machinefile != None and (type(self.machinefile) in [types.ListType,types.StringType, types.IntType])):
@@ -977,6 +991,7 @@ fh.close()
                     if self.verbose > 1: print "Command:",args
                     exitCode = os.spawnvpe(os.P_WAIT, appspackExec, args, os.environ)
                     if self.verbose > 1: print "Exited code:",exitCode
+                    self.__StopEvalServer()
                     self.finishedFlag = True
                     if exitCode != 0:
                         return None
@@ -999,16 +1014,104 @@ fh.close()
                         self.finishedFlag = False
                 else:
                     if not self.isFinished():
+                        self.__StopEvalServer()
                         return None
                     if self.verbose > 1: print "Command:",args
                     self.appspackPID = os.spawnvpe(os.P_NOWAIT, appspackExec , args, os.environ)
                     if self.verbose > 1: print "Running PID:",self.appspackPID
                     if self.appspackPID == 0:
+                        self.__StopEvalServer()
                         return None
                     else:
                         self.finishedFlag = False
         return True
 
+    def __IsLocalRun(self):
+        """Returns True if all the appspack processes run in this host, so that they can reach the local socket
+           of the persistent evaluator: machinefile None or an integer (local cores), or a list of machines or a
+           machinefile naming only this host. Any advancedMPIoptions may place processes in other hosts.
+        """
+        if self.advancedMPIoptions:
+            return False
+        if self.machinefile is None or type(self.machinefile) == types.IntType:
+            return True
+        if type(self.machinefile) == types.ListType:
+            machines = self.machinefile
+        elif type(self.machinefile) == types.StringType and self.machinefile != "qsub" and os.path.isfile(self.machinefile):
+            machinesFile = open(self.machinefile)
+            machines = [line.split()[0] for line in machinesFile if line.strip() and not line.strip().startswith("#")]
+            machinesFile.close()
+        else:
+            return False
+        localNames = ["localhost", "127.0.0.1", socket.gethostname(), socket.getfqdn()]
+        for machine in machines:
+            if str(machine).split(":")[0].strip() not in localNames:
+                return False
+        return True
+
+    def __StartEvalServer(self, clientFile):
+        """Starts the persistent evaluator (AZEvalServer.py) which loads the dataset and the CV folds once and
+           evaluates in a forked child each point requested by appspack. 
+           The clientFile is created to be called by appspack instead of the full evaluation script. It 
+           only sends the input and output files of each point to the evaluator through a unix socket.
+           Returns True when the evaluator is ready to receive points, None otherwise
+        """
+        self.__StopEvalServer()
+        evalScript = self.runPath+"evalScript.py"
+        if self.__CreateAppspackScript(file = evalScript, evaluateMethod = self.evaluateMethod, findMin = self.findMin, preloadedData = True) == None:
+            return None
+        # Unix socket paths are limited to ~100 chars, so the runPath cannot be used
+        self.evalServerSocket = os.path.join(tempfile.gettempdir(), "AZEvalServer_"+str(os.getpid())+"_"+str(id(self))+".sock")
+        if self.samplingMethod == self.LEAVE_ONE_OUT:
+            sampling = "LOO"
+        else:
+            sampling = "CV"
+        args = ["python", os.path.join(os.path.dirname(__file__),"AZEvalServer.py"), evalScript, self.dataSet, sampling, \
+                str(self.nFolds), str(self.nExtFolds or 0), self.evalServerSocket]
+        if self.verbose > 1: print "Command:",args
+        self.evalServerPID = os.spawnvpe(os.P_NOWAIT, "python", args, os.environ)
+        # Wait until the dataset is loaded and the evaluator is listening
+        while not os.path.exists(self.evalServerSocket):
+            if os.waitpid(self.evalServerPID, os.WNOHANG)[0] != 0:
+                if self.verbose > 0: print "ERROR: The persistent evaluator exited before being ready"
+                self.evalServerPID = 0
+                return None
+            time.sleep(0.2)
+
+        if os.path.exists(clientFile):
+            os.remove(clientFile)
+        try:
+            pyFile = open(clientFile,"w")
+            pyFile.write("""# File automatically created by  paramOptUtilities.py
+# Sends the point to the persistent evaluator and waits for it to write the output file
+import sys, socket
+client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+client.connect("%s")
+client.sendall(sys.argv[1] + "\\t" + sys.argv[2] + "\\n")
+status = client.makefile("r").readline().strip()
+client.close()
+if status != "OK":
+    sys.exit(1)
+""" % self.evalServerSocket)
+            pyFile.close()
+        except:
+            self.__StopEvalServer()
+            return None
+        return True
+
+    def __StopEvalServer(self):
+        """Terminates the persistent evaluator if it is running"""
+        if not self.evalServerPID:
+            return
+        try:
+            os.kill(self.evalServerPID, signal.SIGTERM)
+            os.waitpid(self.evalServerPID, 0)
+        except OSError:
+            pass
+        if self.evalServerSocket and os.path.exists(self.evalServerSocket):
+            os.remove(self.evalServerSocket)
+        self.evalServerPID = 0
+
     def __log(self, text):
         """Adds a new line (what's in text) to the logFile"""
         textOut = str(time.asctime()) + ": " +text
@@ -1146,12 +1249,14 @@ echo "end mpirun"
         os.system("chmod a+x "+self.qsubFile)
 
 
-    def __CreateAppspackScript(self, file, evaluateMethod, findMin, paramsConfigFile = "AZLearnersParamsConfig", paramKeys = "None"):
+    def __CreateAppspackScript(self, file, evaluateMethod, findMin, paramsConfigFile = "AZLearnersParamsConfig", paramKeys = "None", preloadedData = False):
         """
         Creates the script to be called by appspack on each evaluation of the function in a specific point
         The point being evaluated is passed by appspack on the input file of parameter 1 and the output 
         (the image of the input variables) must be placed in the output file specified by appspack on
         second parameter
+        If preloadedData, the script is to be run by the persistent evaluator (AZEvalServer.py) which 
+        defines the dataSet and the CVIndices before running it.
         It uses the globals:
                 self.runPath
                 self.learner
@@ -1177,6 +1282,10 @@ echo "end mpirun"
 
         if self.samplingMethod == self.LEAVE_ONE_OUT:
            sMethod = "orngTest.leaveOneOut([learner], dataSet)"
+        elif preloadedData and self.nExtFolds:
+           sMethod = "orngTest.testWithIndices([learner], dataSet, CVIndices[idx])"
+        elif preloadedData:
+           sMethod = "orngTest.testWithIndices([learner], dataSet, CVIndices)"
         elif self.nExtFolds:    ## by default: samplingMethod = self.FOLD_CROSS_VALIDATION
            sMethod = "orngTest.crossValidation([learner], dataSet, folds=" + str(self.nFolds) + ", strat=orange.MakeRandomIndices.StratifiedIfPossible, randomGenerator = MyRandom)"
         else:
@@ -1217,7 +1326,7 @@ echo "end mpirun"
         return True
 
 
-def getOptParam(learner, trainDataFile, paramList = None, useGrid = False, verbose = 0, queueType = "NoSGE", runPath = None, nExtFolds = None, nFolds = 5, logFile = "", getTunedPars = False, fixedParams = {}):
+def getOptParam(learner, trainDataFile, paramList = None, useGrid = False, verbose = 0, queueType = "NoSGE", runPath = None, nExtFolds = None, nFolds = 5, logFile = "", getTunedPars = False, fixedParams = {}, usePersistentEvaluator = False):
     """
     Optimize the parameters in paramList. If no parametres defines, optimize defauld parameters (defined in AZLearnersParmsConfig). 
     Run optimization in parallel.
@@ -1227,6 +1336,7 @@ def getOptParam(learner, trainDataFile, paramList = None, useGrid = False, verbo
                 'batch.q'
                 'quick.q' (jobs start immediatly but are terminated after 30 min)
     runPath: If directory not provided, will run in NFS_SCRATCHDIR
+    usePersistentEvaluator: Evaluate all points in one process that loads the data once (only used with 'NoSGE')
     """
     # Find the name of the Learner
     learnerName = str(learner.__class__)[:str(learner.__class__).rfind("'")].split(".")[-1]
@@ -1293,6 +1403,7 @@ def getOptParam(learner, trainDataFile, paramList = None, useGrid = False, verbo
                     machinefile = machinefile,\
                     verbose = verbose,\
                     queueType = queueType,
+                    usePersistentEvaluator = usePersistentEvaluator,
                     logFile = logFile)
 
     if verbose > 0:
@@ -5,6 +5,7 @@ import time
 import string
 import os
 
+import numpy
 import orange
 from AZutilities import dataUtilities
 from AZutilities import miscUtilities
@@ -16,41 +17,40 @@ import AZOrangeConfig as AZOC
 
 NO_OF_NEIGHBORS = 3    # Neighbor info not returned from calcMD
 
+def getDescriptorMatrix(data, names = None):
+    """
+    Returns a numpy matrix with the numeric values of the attributes of data (in the order of names if defined).
+    Discrete attributes must have numeric values. Raises ValueError for non-numeric or missing values.
+    """
+    if names is not None:
+        data = dataUtilities.attributeSelectionData(data, names)
+    X = data.toNumpyMA()[0]
+    if numpy.ma.getmaskarray(X).any():
+        raise ValueError("The data has missing values")
+    X = numpy.ma.filled(X, 0).astype(numpy.float)
+    for idx, attr in enumerate(data.domain.attributes):
+        if attr.varType == orange.VarTypes.Discrete:
+            # Use the numeric value of the discrete values instead of their index
+            values = numpy.array([float(value) for value in attr.values], numpy.float)
+            X[:,idx] = values[X[:,idx].astype(int)]
+    return X
+
+
 def getTrainingSet(data):
+    """Creates the TrainingSet object used by the Mahalanobis calculator from the attributes in data"""
+    descr_names = [attr.name for attr in data.domain.attributes]
+    data_table = getDescriptorMatrix(data)
 
-    # Write the data to disk to be able to create the TrainingSet object
-    fileName = os.path.join(AZOC.SCRATCHDIR, "tmpTextFile"+str(time.time())+".txt")
-    #print "FileName: ",fileName
-    fid = open(fileName, "w")
- 
     # Create SMILES and ID with artificial values.
-    header = ["SMILES", "ID"]
-
-    # Write header
-    for attr in data.domain.attributes:
-        header.append(attr.name) 
-    fid.write(string.join(header, "\t")+"\n")
- 
-    # Write the data matrix
-    for ex in data:
-        valueList = ["XXX", "XX"]  # Smiles and ID attributes
-        try:
+    smiles_list = ["XXX"] * len(data)
+    id_list = ["XX"] * len(data)
+    if "Compound Name" in data.domain and "Molecule SMILES" in data.domain:
+        for idx, ex in enumerate(data):
             if ex["Compound Name"] and ex["Molecule SMILES"]:
-                valueList = [ex["Molecule SMILES"].value,ex["Compound Name"].value]
-        except:
-            pass
-        for attr in ex:
-            valueList.append(str(attr.value))
-        # Remove the response value if it exists
-        if data.domain.classVar: 
-            valueList = valueList[0:len(valueList)-1]
-        fid.write(string.join(valueList, "\t")+"\n")
-    fid.close() 
-    
-    # Create the TrainingSet object
-    trainingSet = TrainingSet.read_training_set(open(fileName))
-
-    return trainingSet
+                smiles_list[idx] = ex["Molecule SMILES"].value
+                id_list[idx] = ex["Compound Name"].value
+
+    return TrainingSet.TrainingSet(smiles_list, id_list, None, descr_names, data_table)
 
 def rmClassEx(data):
 
@@ -126,19 +126,12 @@ def calcMahalanobis(data, testData, invCovMatFile = None, centerFile = None, dat
         trainingSet = None
         trainingset_descriptor_names = [attr.name for attr in domain.attributes] 
     mahalanobisCalculator = Mahalanobis.MahalanobisDistanceCalculator(trainingSet,invCovMatFile,centerFile,dataTableFile)
-    MDlist = []
-    for ex in testData:
-        # Create a numeric vector from the example and assure the same order as in trainingset_descriptor_names
-        descriptor_values = []
-        for name in trainingset_descriptor_names:
-            try:
-                descriptor_values.append(float(ex[name].value))
-            except:
-                raise Exception("Not possible to calculate Mahalanobis distances. Some attribute is not numeric.")
-                
-        #descriptor_values = [1.5] * len(trainingset_descriptor_names)
-        MD = mahalanobisCalculator.calculateDistances(descriptor_values, nNN)
-        MDlist.append(MD)
+    # Create a numeric matrix from the examples and assure the same order as in trainingset_descriptor_names
+    try:
+        descriptor_matrix = getDescriptorMatrix(testData, trainingset_descriptor_names)
+    except:
+        raise Exception("Not possible to calculate Mahalanobis distances. Some attribute is not numeric.")
+    MDlist = mahalanobisCalculator.calculateBatchDistances(descriptor_matrix, nNN)
     return MDlist
 
 
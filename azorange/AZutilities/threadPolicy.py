@@ -0,0 +1,99 @@
+"""
+Number of threads used by the OpenCV learners (RF, CvSVM, CvANN, CvBoost and CvBayes) for training and prediction.
+
+The policy is set by AZOrangeConfig.OPENCVNTHREADS or with setThreadPolicy:
+    - "auto"  : one thread for each of the CPUs this process is allowed to run on (CPU affinity)
+    - N > 0   : a fixed number of N threads
+The worker processes of the local parallel pools (cross validation folds, optimizer folds, consensus members,
+CvANN initial weights) are capped to their share of the CPUs, so that nWorkers processes together do not
+use more threads than the available CPUs.
+"""
+import os
+import multiprocessing
+
+import AZOrangeConfig as AZOC
+try:
+    from opencv import cv
+except:
+    cv = None
+
+_policy = {"nThreads": getattr(AZOC, "OPENCVNTHREADS", "auto"), "cap": None, "applied": None, "nCPUs": None}
+
+
+def _readAvailableCPUs():
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("Cpus_allowed:"):
+                nCPUs = sum([bin(int(word, 16)).count("1") for word in line.split(":")[1].strip().split(",")])
+                if nCPUs > 0:
+                    return nCPUs
+    except:
+        pass
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def getAvailableCPUs():
+    """Returns the number of CPUs this process is allowed to run on. 
+       It is read only once (and again by setWorkerCap), since getNumThreads is called for every prediction.
+    """
+    if _policy["nCPUs"] is None:
+        _policy["nCPUs"] = _readAvailableCPUs()
+    return _policy["nCPUs"]
+
+
+def _parseNThreads(nThreads):
+    """Returns the int number of threads in nThreads, or None if nThreads is "auto" or not set.
+       As in the RF NumThreads parameter, 0 also means as many threads as CPUs.
+    """
+    if nThreads is None or str(nThreads).strip().lower() in ("", "none", "auto"):
+        return None
+    try:
+        nThreads = int(nThreads)
+    except ValueError:
+        print "WARNING: Invalid number of threads "+str(nThreads)+". Using 'auto'"
+        return None
+    if nThreads <= 0:
+        return None
+    return nThreads
+
+
+def setThreadPolicy(nThreads = "auto"):
+    """Sets the number of threads used by the OpenCV learners: "auto" or a fixed number of threads"""
+    _policy["nThreads"] = nThreads
+
+
+def setWorkerCap(nWorkers):
+    """Caps the number of threads of this process to its share of the CPUs when running as one of nWorkers
+       parallel processes. Used as the initializer of the local multiprocessing pools.
+    """
+    _policy["nCPUs"] = _readAvailableCPUs()
+    _policy["cap"] = max(getAvailableCPUs() // max(int(nWorkers), 1), 1)
+    applyThreadPolicy()
+
+
+def getNumThreads(nThreads = None):
+    """Returns the number of threads to use. nThreads overrides the global policy when it is a number,
+       as done by the NumThreads parameter of the RF learner.
+    """
+    requested = _parseNThreads(nThreads)
+    if requested is None:
+        requested = _parseNThreads(_policy["nThreads"])
+    if requested is None:
+        requested = getAvailableCPUs()
+    if _policy["cap"]:
+        requested = min(requested, _policy["cap"])
+    return requested
+
+
+def applyThreadPolicy(nThreads = None):
+    """Sets in OpenCV the number of threads returned by getNumThreads(nThreads) and returns it"""
+    n = getNumThreads(nThreads)
+    if cv is not None and _policy["applied"] != n:
+        cv.cvSetNumThreads(n)
+        _policy["applied"] = n
+    return n
@@ -5,12 +5,31 @@ Base Classes for AZ methods.
 import imp
 import orange
 import types,os
+import tarfile
+import json
+from StringIO import StringIO
 from AZutilities import dataUtilities
 from AZutilities import descUtilities
+from AZutilities import miscUtilities
 import pickle
 import copy
+import numpy
+from collections import OrderedDict
 #from trainingMethods import AZorngConsensus 
 
+# Single file model bundles: an uncompressed tar archive with the manifest as first member followed by the model dir
+MODELBUNDLEVERSION = 1
+MODELBUNDLEMANIFEST = "manifest.json"
+MODELBUNDLEDIR = "model"
+
+# Maximum number of models kept in the cache of modelRead
+MODELCACHESIZE = 8
+# File written last when a model is saved, listing the files of the model. Its modification time tells modelRead
+#   with useCache that the model was saved again.
+MODELMANIFEST = "modelManifest.txt"
+# Models loaded by modelRead with useCache, least recently used first:  {realPath: (signature, classifier)}
+_modelCache = OrderedDict()
+
 def getCorrespondingLearner(modelPath, getParameters = True):
     """ Determines what is the learner used to build the model in modelPath.
         if the Learner is to be optimized, one can set getParameters = False so that the model does not have to be loaded (if it would be needed when there is no parameters.pkl for loading)
@@ -148,17 +167,156 @@ def getModelDomain(modelPath):
  
 
 
-def modelRead(modelFile=None,verbose = 0,retrunClassifier = True):
+def _modelSignature(modelFile):
+    """Returns the modification times of modelFile and of its MODELMANIFEST, used to detect changed models.
+       The manifest is written last each time the model is saved, so the model tree is not walked.
+       The models saved without a manifest use the modification times of all the dirs and files in them, 
+       including the nested models (e.g. the C*.model dirs of a consensus model)"""
+    try:
+        signature = [os.path.getmtime(modelFile)]
+        manifestPath = os.path.join(modelFile, MODELMANIFEST)
+        if os.path.isfile(manifestPath):
+            signature.append(os.path.getmtime(manifestPath))
+        elif os.path.isdir(modelFile):
+            for root, dirs, files in os.walk(modelFile):
+                dirs.sort()
+                for fileName in dirs + sorted(files):
+                    filePath = os.path.join(root, fileName)
+                    signature.append((os.path.relpath(filePath, modelFile), os.path.getmtime(filePath)))
+        return tuple(signature)
+    except OSError:
+        return None
+
+
+def warmModelCache(modelFiles, verbose = 0):
+    """Loads the models in the list modelFiles into the cache used by modelRead(..., useCache = True)
+       Returns the list of the loaded classifiers (None for the models that could not be loaded)
+       These are the same objects that modelRead will return, see modelRead for the shared state."""
+    return [modelRead(modelFile, verbose, useCache = True) for modelFile in modelFiles]
+
+
+def evictModel(modelFile = None):
+    """Removes the model in modelFile from the cache used by modelRead(..., useCache = True)
+       If modelFile is not defined, all the models are removed from the cache"""
+    if modelFile is None:
+        _modelCache.clear()
+    else:
+        _modelCache.pop(os.path.realpath(modelFile), None)
+
+
+def isModelBundle(modelFile):
+    """Returns True if modelFile is a single file model bundle written by writeModelBundle"""
+    return os.path.isfile(modelFile) and tarfile.is_tarfile(modelFile)
+
+
+def writeModelBundle(classifier, bundlePath):
+    """Saves the classifier in the single file bundlePath. The bundle is an uncompressed tar archive with:
+            manifest.json   - format version, model type and the list of files of the model
+            model/...       - the files written by classifier.write
+       so it can be copied as one file and read back by modelRead with one sequential read.
+       Returns True on success, False otherwise."""
+    scratchDir = miscUtilities.createScratchDir(desc = "modelBundle")
+    modelDir = os.path.join(scratchDir, MODELBUNDLEDIR)
+    try:
+        if not classifier.write(modelDir) or not os.path.isdir(modelDir):
+            print "ERROR: Could not save the model to create the bundle ",bundlePath
+            return False
+        files = []
+        for root, dirs, fileNames in os.walk(modelDir):
+            dirs.sort()
+            for fileName in sorted(fileNames):
+                files.append(os.path.relpath(os.path.join(root, fileName), scratchDir))
+        manifest = json.dumps({"version": MODELBUNDLEVERSION, "modelType": modelRead(modelDir, retrunClassifier = False), "files": files})
+
+        tmpPath = bundlePath + ".tmp"
+        tar = tarfile.open(tmpPath, "w")
+        info = tarfile.TarInfo(MODELBUNDLEMANIFEST)
+        info.size = len(manifest)
+        tar.addfile(info, StringIO(manifest))
+        tar.add(modelDir, MODELBUNDLEDIR)
+        tar.close()
+        os.rename(tmpPath, bundlePath)
+        return True
+    finally:
+        miscUtilities.removeDir(scratchDir)
+
+
+def readModelBundle(bundlePath, verbose = 0, retrunClassifier = True):
+    """Loads the classifier saved in the single file bundlePath by writeModelBundle.
+       The bundle is read sequentially into a local scratch dir where the model is loaded from. The members
+       are not loaded from memory because the model readers (OpenCV load, the PLS reader, DataTable) only
+       accept file paths.
+       If not retrunClassifier, only the manifest is read and the model type is returned."""
+    scratchDir = None
+    try:
+        tar = tarfile.open(bundlePath, "r|")
+        member = tar.next()
+        if member is None or member.name != MODELBUNDLEMANIFEST:
+            print "ERROR: Missing manifest in the model bundle ",bundlePath
+            return None
+        manifest = json.loads(tar.extractfile(member).read())
+        if manifest["version"] > MODELBUNDLEVERSION:
+            print "ERROR: The model bundle ",bundlePath," was saved with a newer version of AZOrange"
+            return None
+        if not retrunClassifier:
+            return manifest["modelType"] and str(manifest["modelType"])
+        scratchDir = miscUtilities.createScratchDir(desc = "modelBundle")
+        member = tar.next()
+        while member is not None:
+            # Do not allow members to be extracted outside the scratch dir
+            if member.name.split("/")[0] != MODELBUNDLEDIR or ".." in member.name.split("/"):
+                print "ERROR: Invalid member ",member.name," in the model bundle ",bundlePath
+                return None
+            tar.extract(member, scratchDir)
+            member = tar.next()
+        tar.close()
+        for filePath in manifest["files"]:
+            if not os.path.isfile(os.path.join(scratchDir, filePath)):
+                print "ERROR: File ",filePath," is missing in the model bundle ",bundlePath
+                return None
+        return modelRead(os.path.join(scratchDir, MODELBUNDLEDIR), verbose)
+    except (tarfile.TarError, IOError, ValueError, KeyError), e:
+        print "ERROR: Could not read the model bundle ",bundlePath,": ",e
+        return None
+    finally:
+        miscUtilities.removeDir(scratchDir)
+
+
+def modelRead(modelFile=None,verbose = 0,retrunClassifier = True, useCache = False):
     """Get the type of model saved in 'modelPath' and loads the respective model
        Returns the Classifier saved in the respective model path
        If called without parameters, it returns a list of known classifier types
        It can returns the classifier, or just a string with the Type
+       If useCache, the classifier is kept in memory and returned in the next calls with useCache while 
+       the model files are not changed. The same classifier object is shared by all those calls, so its
+       state is shared too: the nPredictions counter, the DFV extremes, the ExFix domain map and the
+       examplesFixedLog. Callers needing their own state must use modelRead without useCache.
+       The cache keeps the last MODELCACHESIZE models used.
+       modelFile can be a model dir or a single file bundle written by writeModelBundle.
 
-            modelRead (modelFile [, verbose = 0] [, retrunClassifier = True] )"""
+            modelRead (modelFile [, verbose = 0] [, retrunClassifier = True] [, useCache = False] )"""
 
     if not modelFile:
         return ("SignSVM","CvSVM", "CvANN", "PLS", "CvRF", "CvBoost", "CvBayes", "Consensus")
 
+    if useCache and retrunClassifier:
+        key = os.path.realpath(modelFile)
+        signature = _modelSignature(key)
+        if key in _modelCache:
+            cachedSignature, loadedModel = _modelCache.pop(key)
+            if cachedSignature == signature:
+                _modelCache[key] = (cachedSignature, loadedModel)
+                return loadedModel
+        loadedModel = modelRead(modelFile, verbose)
+        if loadedModel is not None and signature is not None:
+            _modelCache[key] = (signature, loadedModel)
+            while len(_modelCache) > MODELCACHESIZE:
+                _modelCache.popitem(last = False)
+        return loadedModel
+
+    if isModelBundle(modelFile):
+        return readModelBundle(modelFile, verbose, retrunClassifier)
+
     modelType = None
     loadedModel = None
     if os.path.isfile(os.path.join(modelFile,"model.svm")):
@@ -402,10 +560,148 @@ class AZClassifier(object):
             return None
         return res
 
+    def predictBatch(self, data, returnProbs = False):
+        """Predicts all the examples in the ExampleTable 'data' at once.
+           Returns a numpy array with one predicted value per example:
+               Classification: the index of the predicted value in classVar.values
+               Regression:     the predicted value
+           The examples that could not be predicted are set to nan.
+           If returnProbs is True, it returns a tuple (values, probabilities) where probabilities is a numpy array 
+           with one row per example and one column per class value, or None for regression.
+           Returns None if the data is not compatible with the classifier, and empty arrays if it has no examples.
+           This base version predicts the examples one by one. The classifiers should override it with a native 
+           batch prediction where the domain is fixed once and the whole data is predicted from one matrix.
+        """
+        if data is None:
+            return None
+        values = numpy.empty(len(data))
+        probs = self._newBatchProbs(len(data))
+        for idx,ex in enumerate(data):
+            res = self._singlePredict(ex, orange.GetBoth)
+            if not res or res[0] is None:
+                values[idx] = numpy.nan
+                if probs is not None: probs[idx] = numpy.nan
+                continue
+            values[idx] = self._value2float(res[0])
+            if probs is not None:
+                for idxVal in range(probs.shape[1]):
+                    probs[idx,idxVal] = res[1][idxVal]
+        if returnProbs:
+            return (values, probs)
+        else:
+            return values
+
+    def _getBatchData(self, data, impute = True):
+        """Fixes the examples in 'data' to the classifier domain and imputes them if impute is True.
+           The domain map to the classifier domain is compiled only once and applied to the whole table (ExFix.fixTable).
+           Returns an ExampleTable with the classifier domain or None if data is not compatible with the classifier.
+           An empty table is returned for data without examples.
+        """
+        if data is None or not self.domain:
+            return None
+        if not self.ExFix.ready:
+            self.ExFix.set_domain(self.domain)
+            self.ExFix.set_examplesFixedLog(self.examplesFixedLog)
+        fixedData = self.ExFix.fixTable(data)
+        if fixedData is None:
+            if self.verbose > 0: print "The data does not have the same variables as the model."
+            return None
+        if impute and self.imputer and len(fixedData):
+            fixedData = self.imputer(fixedData)
+            if not fixedData:
+                if self.verbose > 0: print "Unable to impute the data."
+                return None
+        return fixedData
+
+    def _getBatchMatrix(self, data, impute = True):
+        """Same as _getBatchData but returns a numpy masked array with the attributes in the order used for
+           training, or None if data is not compatible with the classifier.
+        """
+        fixedData = self._getBatchData(data, impute)
+        if fixedData is None:
+            return None
+        if len(fixedData) == 0:
+            return numpy.ma.zeros((0, len(fixedData.domain.attributes)))
+        return fixedData.toNumpyMA()[0]
+
+    def _emptyBatchResult(self, returnProbs = False):
+        """Returns the result of predictBatch for data without examples"""
+        values = numpy.empty(0)
+        if returnProbs:
+            return (values, self._newBatchProbs(0))
+        else:
+            return values
+
+    def _value2float(self, value):
+        """Converts an orange Value to a float: the value index for discrete values and nan for unknown values"""
+        if value is None or value.isSpecial():
+            return numpy.nan
+        return float(value)
+
+    def _newBatchProbs(self, nEx):
+        """Returns a zeroed array for the probabilities of nEx examples, or None if the class is not discrete"""
+        if self.classVar.varType != orange.VarTypes.Discrete:
+            return None
+        return numpy.zeros((nEx, len(self.classVar.values)))
+
+    def _generateBatchProbs(self, values):
+        """Returns the probabilities for the predicted values setting the predicted class value to 1 
+           It is used by classifiers that do not return real probabilities. 
+        """
+        probs = self._newBatchProbs(len(values))
+        if probs is None:
+            return None
+        known = ~numpy.isnan(values)
+        probs[~known] = numpy.nan
+        probs[numpy.flatnonzero(known), values[known].astype(int)] = 1.0
+        return probs
+
+    def predictBatchDFV(self, data):
+        """Returns a numpy array with the Decision Function Value (see returnDFV of the predictions) of each example
+           in the ExampleTable 'data', nan for the examples that could not be predicted.
+           Returns None if the data is not compatible with the classifier.
+           This base version predicts the examples one by one. The classifiers should override it when they can
+           calculate the DFV of the whole data from one matrix.
+        """
+        if data is None:
+            return None
+        DFVs = numpy.empty(len(data))
+        for idx,ex in enumerate(data):
+            res = self(ex, returnDFV = True)
+            if not res or res[1] is None:
+                DFVs[idx] = numpy.nan
+            else:
+                DFVs[idx] = res[1]
+        return DFVs
+
+    def _updateBatchDFVExtremes(self, DFVs):
+        """Updates the DFV extremes with the DFVs of a batch prediction"""
+        known = DFVs[~numpy.isnan(DFVs)]
+        if len(known):
+            self._updateDFVExtremes(float(known.min()))
+            self._updateDFVExtremes(float(known.max()))
+
+    def writeBundle(self, bundlePath):
+        """Saves the model in the single file bundlePath (see writeModelBundle). It can be loaded with modelRead"""
+        return writeModelBundle(self, bundlePath)
+
     def _saveParameters(self, path):
         fileh = open(path, 'w') 
         pickle.dump(self.parameters,fileh)
         fileh.close()
+
+    def _writeManifest(self, path):
+        """Writes the MODELMANIFEST of the model saved in the dir path with the list of its files.
+           Must be called after all the other files of the model are written."""
+        files = []
+        for root, dirs, fileNames in os.walk(path):
+            dirs.sort()
+            for fileName in sorted(fileNames):
+                if root != path or fileName != MODELMANIFEST:
+                    files.append(os.path.relpath(os.path.join(root, fileName), path))
+        fileh = open(os.path.join(path, MODELMANIFEST), 'w')
+        fileh.write("\n".join(files)+"\n")
+        fileh.close()
  
     def _updateDFVExtremes(self, DFV):
         if DFV < self._DFVExtremes["min"]:
@@ -439,7 +735,7 @@ class AZClassifier(object):
         """
         #    Determine Signature and non-Signature descriptor names
         #signDesc = []   # This Disable distinction from signatures ans non-signatures
-        cinfonyDesc, clabDesc, signatureHeight, bbrcDesc, signDesc = descUtilities.getDescTypes([attr.name for attr in self.domain.attributes])
+        signDesc = getSignatureDescs([attr.name for attr in self.domain.attributes])
 
         varGrad = []
 
@@ -448,70 +744,79 @@ class AZClassifier(object):
         ex = ExFix.fixExample(inEx)
         if self.basicStat == None or not self.NTrainEx or (self.domain.classVar.varType == orange.VarTypes.Discrete and len(self.domain.classVar.values)!=2):
             return None
-        if gradRef == None:
-            gradRef = self(ex,returnDFV = True)[1]
-        
-        def calcDiscVarGrad(var,ex,gradRef):
-            step = 1   # MUST be 1!!
-            if ex[var].isSpecial():
-                return ([gradRef, gradRef],step)
-            localMaxDiff = 0
-            localMaxPred = gradRef
-            #Uncomment next line to skip discrete variables
-            #return localMaxPred
-            for val in self.domain[var].values:
-                localEx = orange.Example(ex)
-                localEx[var] = val
-                pred = self(localEx,returnDFV = True)[1]
-                if abs(pred - gradRef) > localMaxDiff:
-                    localMaxDiff = abs(pred - gradRef)
-                    localMaxPred = pred
-            return ([localMaxPred, gradRef], step)
-
-
-        def calcContVarGrad(var,ex,gradRef):
-            localEx = orange.Example(ex)
-            if c_step is None:
-                if self.domain.classVar.varType == orange.VarTypes.Discrete:  # Classification
-                     coef_step = 1.0
-                else:
-                     coef_step = 0.08   # Needs confirmation! Coefficient step: c
+
+        if c_step is None:
+            if self.domain.classVar.varType == orange.VarTypes.Discrete:  # Classification
+                 coef_step = 1.0
             else:
-                #  used for testing significance: comment next and uncomment next-next
-                raise(Exception("This mode should only be used for debugging! Comment this line if debugging."))
-                #coef_step = float(c_step)
+                 coef_step = 0.08   # Needs confirmation! Coefficient step: c
+        else:
+            #  used for testing significance: comment next and uncomment next-next
+            raise(Exception("This mode should only be used for debugging! Comment this line if debugging."))
+            #coef_step = float(c_step)
 
-            if var in signDesc:
-                step = 1           # Set step to one in case od signatures
+        # All the perturbed copies of the example are predicted in one batch. 
+        # perturbed[attr.name] holds (step, [indexes of its copies in the batch])
+        batch = dataUtilities.DataTable(self.domain)
+        if gradRef == None:
+            batch.append(orange.Example(ex))
+        perturbed = {}
+        for attr in self.domain.attributes:
+            var = attr.name
+            if attr.varType == orange.VarTypes.Discrete:
+                step = 1   # MUST be 1!!
+                if ex[var].isSpecial():
+                    localValues = []
+                else:
+                    localValues = self.domain[var].values
             else:
-                #   dev - Standard deviation:  http://orange.biolab.si/doc/reference/Orange.statistics.basic/
-                if "dev" in self.basicStat[var]:
+                if var in signDesc:
+                    step = 1           # Set step to one in case od signatures
+                elif "dev" in self.basicStat[var]:
+                    #   dev - Standard deviation:  http://orange.biolab.si/doc/reference/Orange.statistics.basic/
                     step = self.basicStat[var]["dev"] * coef_step
                 else:
-                    return ([gradRef, gradRef], 0) 
-
-            if ex[var].isSpecial():
-                return ([gradRef, gradRef], step)
-            # step UP
-            localEx[var] = ex[var] + step
-            ResUp = self(localEx,returnDFV = True)[1]
-            # step DOWN
-            localEx[var] = ex[var] - step 
-            ResDown = self(localEx,returnDFV = True)[1]
-            return ([ResUp, ResDown], step)
-
-        def calcVarGrad(var,ex,gradRef):
+                    step = 0
+                if step == 0 or ex[var].isSpecial():
+                    localValues = []
+                else:
+                    # step UP and step DOWN
+                    localValues = [ex[var] + step, ex[var] - step]
+            perturbed[var] = (step, range(len(batch), len(batch) + len(localValues)))
+            for val in localValues:
+                localEx = orange.Example(ex)
+                localEx[var] = val
+                batch.append(localEx)
+        DFVs = []
+        if len(batch):
+            DFVs = self.predictBatchDFV(batch)
+            if DFVs is None:
+                if self.verbose > 0: print "Unable to predict the perturbed examples"
+                return None
+            DFVs = DFVs.tolist()
+        if gradRef == None:
+            gradRef = DFVs[0]
+
+        def calcVarGrad(attr):
+            step, idxs = perturbed[attr.name]
             if attr.varType == orange.VarTypes.Discrete:
-                res,step = calcDiscVarGrad(attr.name,ex,gradRef)
+                #Uncomment next line to skip discrete variables
+                #idxs = []
+                localMaxDiff = 0
+                localMaxPred = gradRef
+                for idx in idxs:
+                    if abs(DFVs[idx] - gradRef) > localMaxDiff:
+                        localMaxDiff = abs(DFVs[idx] - gradRef)
+                        localMaxPred = DFVs[idx]
                 #          f(a)   f(x)
-                _grad = (res[0]-res[1])  # /step   ... but step MUST be 1!!
-                _faMax = res[0]
+                _grad = (localMaxPred-gradRef)  # /step   ... but step MUST be 1!!
+                _faMax = localMaxPred
             else:
-                res,step = calcContVarGrad(attr.name,ex,gradRef)
-                if step == 0:
+                if step == 0 or not idxs:
                     _grad = 0
                 else:
-                    _grad =  (res[0]-res[1])/(2.0*step)
+                    #         f(x+step)     f(x-step)
+                    _grad =  (DFVs[idxs[0]]-DFVs[idxs[1]])/(2.0*step)
                 _faMax = None
             return (_grad, _faMax)
 
@@ -528,7 +833,7 @@ class AZClassifier(object):
         #print "  %s  " % (str(gradRef)),
 
         for attr in self.domain.attributes:
-            grad = calcVarGrad(attr.name,ex,gradRef)
+            grad = calcVarGrad(attr)
             # Print used for testing significance
             #print  "  %s  " % (str(grad[0])),
 
@@ -614,6 +919,19 @@ class AZClassifier(object):
                               "DOWN": DOWNd[0:min(nRet,len(DOWNd))]}   } 
 
 
+# Signature descriptors of each list of attribute names used by getTopImportantVars
+_signDescCache = {}
+
+def getSignatureDescs(descList):
+    """Returns the set of the signature descriptors in descList (see descUtilities.getDescTypes).
+       The result is memoized for each list of descriptors.
+    """
+    key = tuple(descList)
+    if key not in _signDescCache:
+        _signDescCache[key] = frozenset(descUtilities.getDescTypes(list(descList))[4])
+    return _signDescCache[key]
+
+
 def groupTiedScores(theList, n):
     """Goup elements which were tied according the measure [n]
         theList is expected to be a list of lists and will output a list of lists of lists
@@ -9,23 +9,124 @@ import AZBaseClasses
 import orange,Orange
 import sys
 import re
+import ast
 import pickle
+import copy
+import numpy
+import multiprocessing
 
 from cStringIO import StringIO
 from tokenize import generate_tokens
 
 from AZutilities import dataUtilities
-#from AZutilities import miscUtilities
+from AZutilities import miscUtilities
 
 import AZOrangeConfig as AZOC
 
 def IF0(expr, ifTrue):
     """Tests expr, and if it is zero, return what's in ifTrue otherwise return the expr"""
+    if isinstance(expr, numpy.ndarray):
+        return numpy.where(expr == 0, ifTrue, expr)
     if expr == 0:
         return ifTrue
     else:
         return expr
-    
+
+
+def _vAnd(*values):
+    return numpy.logical_and.reduce([numpy.asarray(v, bool) for v in numpy.broadcast_arrays(*values)])
+
+def _vOr(*values):
+    return numpy.logical_or.reduce([numpy.asarray(v, bool) for v in numpy.broadcast_arrays(*values)])
+
+def _vNot(value):
+    return numpy.logical_not(value)
+
+def _vIf(test, ifTrue, ifFalse):
+    return numpy.where(test, ifTrue, ifFalse)
+
+
+class _VectorizeExpression(ast.NodeTransformer):
+    """Rewrites the boolean operations and conditional expressions of a consensus expression so that
+       it can be evaluated with whole arrays of member predictions at once.
+       The vectorized and/or return booleans instead of one of their operands. hasBoolOp tells if the expression has them.
+    """
+    def __init__(self):
+        ast.NodeTransformer.__init__(self)
+        self.hasBoolOp = False
+
+    def _call(self, name, args, node):
+        return ast.copy_location(ast.Call(func = ast.Name(id = name, ctx = ast.Load()), args = args, keywords = [], starargs = None, kwargs = None), node)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        self.hasBoolOp = True
+        return self._call(isinstance(node.op, ast.And) and "_vAnd" or "_vOr", node.values, node)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call("_vNot", [node.operand], node)
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self._call("_vIf", [node.test, node.body, node.orelse], node)
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        # Chained comparisons:  a < b < c  ->  (a < b) and (b < c)
+        operands = [node.left] + node.comparators
+        comparisons = [ast.copy_location(ast.Compare(left = operands[idx], ops = [op], comparators = [operands[idx+1]]), node) for idx, op in enumerate(node.ops)]
+        return self._call("_vAnd", comparisons, node)
+
+
+class CompiledExpression(object):
+    """A consensus expression compiled once, where the member predictions are read from the mapping _p:
+            scalar  - code to evaluate with the predictions of one example
+            vector  - code to evaluate with arrays holding the predictions of all the examples
+       The vector code only gives the same results as the scalar one for the expressions with and/or (hasBoolOp) if
+       they are used as conditions, as in the logical expressions. In a regression expression such as (a > b and a) or b
+       the scalar code returns the operand and the vector one a boolean.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.scalar = compile(source, "<consensus expression>", "eval")
+        vectorizer = _VectorizeExpression()
+        tree = vectorizer.visit(ast.parse(source, "<consensus expression>", "eval"))
+        self.vector = compile(ast.fix_missing_locations(tree), "<consensus expression>", "eval")
+        self.hasBoolOp = vectorizer.hasBoolOp
+
+    def __call__(self, predictions, vectorized = False):
+        namespace = {"_p": predictions, "_vAnd": _vAnd, "_vOr": _vOr, "_vNot": _vNot, "_vIf": _vIf}
+        if vectorized:
+            return eval(self.vector, globals(), namespace)
+        return eval(self.scalar, globals(), namespace)
+
+
+def _trainMember(key):
+    """Trains the member learners[key] of a ConsensusLearner in a worker process.
+       The model is saved in a scratch dir so that it can be loaded by the parent process.
+       Returns the tuple (key, modelPath, error)
+    """
+    learners, trainingData = miscUtilities.getLocalPoolArgs()
+    modelPath = None
+    try:
+        classifier = learners[key](trainingData)
+        if not classifier:
+            return (key, None, "Could not create the model")
+        modelPath = miscUtilities.createScratchDir(desc = "ConsensusMember", seed = str(os.getpid())+"_"+str(key))
+        if not classifier.write(os.path.join(modelPath, "model")):
+            miscUtilities.removeDir(modelPath)
+            return (key, None, "Could not save the model")
+    except:
+        if modelPath:
+            miscUtilities.removeDir(modelPath)
+        return (key, None, str(sys.exc_info()[0]) + " " + str(sys.exc_info()[1]))
+    return (key, modelPath, None)
+
 
 class ConsensusLearner(AZBaseClasses.AZLearner):
     """
@@ -54,6 +155,7 @@ class ConsensusLearner(AZBaseClasses.AZLearner):
         self.NTrainEx = 0
         self.verbose = 0
         self.weights = None
+        self.nWorkers = 1       # Number of local processes training the member learners. 0 uses all the cores
         # Append arguments to the __dict__ member variable
         self.__dict__.update(kwds)
 
@@ -75,35 +177,43 @@ class ConsensusLearner(AZBaseClasses.AZLearner):
             print "ERROR: Missing expression! You must provide an expression together with the learner mapping."
             return None
 
+        if type(self.learners).__name__ == 'list' and trainingData.domain.classVar.varType == orange.VarTypes.Discrete and len(trainingData.domain.classVar.values) != 2:
+            print "ERROR: The Consensus model only supports binary classification or regression problems."
+            return None
+
         # Call the train method
         if type(self.learners).__name__ == 'list':
+            keys = range(len(self.learners))
+        else:
+            keys = self.learners.keys()
+        nWorkers = min(self.nWorkers or multiprocessing.cpu_count(), len(keys))
+        if nWorkers > 1:
+            trained = self._trainMembersInParallel(trainingData, keys, nWorkers)
+        else:
+            trained = ((key, self.learners[key](trainingData)) for key in keys)
+
+        classifiers = {}
+        for key, newClassifier in trained:
+            if not newClassifier:
+                if self.verbose > 0:
+                    print "ERROR: Could not create the model ",str(self.learners[key])
 
-            if trainingData.domain.classVar.varType == orange.VarTypes.Discrete and len(trainingData.domain.classVar.values) != 2:
-                print "ERROR: The Consensus model only supports binary classification or regression problems."
                 return None
+            else:
+                classifiers[key] = newClassifier
+                #Try to get the imputeData, basicStat from a model that have it!
+                if hasattr(newClassifier, "basicStat") and newClassifier.basicStat and not self.basicStat:
+                    self.basicStat = newClassifier.basicStat
+                
+                if hasattr(newClassifier, "NTrainEx") and newClassifier.basicStat and not self.NTrainEx:
+                    self.NTrainEx = len(trainingData)
+                    
+                if hasattr(newClassifier, "imputeData") and newClassifier.imputeData and not self.imputeData:
+                    self.imputeData = newClassifier.imputeData
 
-            
+        if type(self.learners).__name__ == 'list':
             # Default behaviour, no expression defined.
-            classifiers = []
-            for learner in self.learners:
-                classifiers.append(learner(trainingData))
-                if not classifiers[-1]:
-                    if self.verbose > 0:
-                        print "ERROR: Could not create the model ",str(learner)
-
-                    return None
-                else:                   
-                    #Try to get the imputeData, basicStat from a model that have it!
-                    if hasattr(classifiers[-1], "basicStat") and classifiers[-1].basicStat and not self.basicStat:
-                        self.basicStat = classifiers[-1].basicStat
-                    
-                    if hasattr(classifiers[-1], "NTrainEx") and classifiers[-1].basicStat and not self.NTrainEx:
-                        self.NTrainEx = len(trainingData)
-                        
-                    if hasattr(classifiers[-1], "imputeData") and classifiers[-1].imputeData and not self.imputeData:
-                        self.imputeData = classifiers[-1].imputeData
-                            
-            return ConsensusClassifier(classifiers = classifiers,
+            return ConsensusClassifier(classifiers = [classifiers[key] for key in keys],
                                        classVar = trainingData.domain.classVar,
                                        verbose = self.verbose,
                                        domain = trainingData.domain,
@@ -112,27 +222,6 @@ class ConsensusLearner(AZBaseClasses.AZLearner):
                                        basicStat = self.basicStat,
                                        imputeData = self.imputeData)
         else:
-            classifiers = {}
-            for learner in self.learners:
-                newClassifier = self.learners[learner](trainingData)
-
-                if not newClassifier:
-                    if self.verbose > 0:
-                        print "ERROR: Could not create the model ",str(learner)
-
-                    return None
-                else:
-                    classifiers[learner] = newClassifier
-                    #Try to get the imputeData, basicStat from a model that have it!
-                    if hasattr(newClassifier, "basicStat") and newClassifier.basicStat and not self.basicStat:
-                        self.basicStat = newClassifier.basicStat
-                    
-                    if hasattr(newClassifier, "NTrainEx") and newClassifier.basicStat and not self.NTrainEx:
-                        self.NTrainEx = len(trainingData)
-                        
-                    if hasattr(newClassifier, "imputeData") and newClassifier.imputeData and not self.imputeData:
-                        self.imputeData = newClassifier.imputeData
-                            
             return ConsensusClassifier(classifiers = classifiers,
                                        expression = self.expression,
                                        weights = self.weights,
@@ -144,6 +233,28 @@ class ConsensusLearner(AZBaseClasses.AZLearner):
                                        basicStat = self.basicStat,
                                        imputeData = self.imputeData)
 
+    def _trainMembersInParallel(self, trainingData, keys, nWorkers):
+        """Trains the member learners identified by keys in a pool of nWorkers local processes.
+           Returns a list of (key, classifier) tuples, with classifier None for the members that failed.
+        """
+        if self.verbose > 0:
+            print "Training "+str(len(keys))+" consensus members in "+str(nWorkers)+" local processes"
+        # The workers inherit the learners and the training data when the pool forks
+        results = miscUtilities.runInLocalPool(_trainMember, keys, nWorkers, args = (self.learners, trainingData), \
+                    onError = lambda key, error: (key, None, error))
+
+        # Load the models saved by the workers
+        trained = []
+        for key, modelPath, error in results:
+            classifier = None
+            if modelPath:
+                classifier = AZBaseClasses.modelRead(os.path.join(modelPath, "model"))
+                miscUtilities.removeDir(modelPath)
+            elif error and self.verbose > 0:
+                print "ERROR training the consensus member "+str(key)+": "+error
+            trained.append((key, classifier))
+        return trained
+
 
 class ConsensusClassifier(AZBaseClasses.AZClassifier):
     def __new__(cls, name = "Consensus classifier", **kwds):
@@ -181,6 +292,74 @@ class ConsensusClassifier(AZBaseClasses.AZClassifier):
         if type(self.classifiers).__name__ == 'list' and self.domain.classVar.varType == orange.VarTypes.Discrete and len(self.domain.classVar.values) != 2:
                 raise Exception("ERROR: The Consensus model only supports binary classification or regression problems.")
 
+        self._compileExpression()
+
+
+    def _compileExpression(self):
+        """Compiles the custom expression once so that it is not parsed for each prediction.
+           Discrete: self._compiledExpression is a list of (condition, result) where condition is a CompiledExpression
+                     or None for the rules without a logical expression
+           Regression: self._compiledExpression is a CompiledExpression
+           On errors, self._compiledExpression is None and self._expressionError has the message to report
+        """
+        self._compiledExpression = None
+        self._expressionError = None
+        self._compiledFor = copy.copy(self.expression)
+        if type(self.classifiers).__name__ != 'dict' or not self.expression:
+            return
+        names = self.classifiers.keys()
+        try:
+            if self._discreteProblemClass():
+                rules = []
+                for exp in self.expression:
+                    logicalExp, logicalRes = exp.split('->')
+                    logicalExp = logicalExp.strip()
+                    logicalRes = logicalRes.strip()
+
+                    if logicalRes == "None":
+                        self._expressionError = "ERROR: Logical result cannot be None. For unknown values use ? instead!"
+                        return
+
+                    if len(logicalExp) == 0:
+                        rules.append((None, logicalRes))
+                        continue
+                    tokens = []
+                    for token in self._lexLogicalExp(logicalExp):
+                        if token in names:
+                            tokens.append("_p[%r]" % token)
+                        elif token in self.classVar.values:
+                            tokens.append(repr(token))
+                        else:
+                            tokens.append(token)
+                    rules.append((CompiledExpression(' '.join(tokens)), logicalRes))
+                self._compiledExpression = rules
+            else:
+                tokens = []
+                for token in self._lexRegressionExp(self.expression):
+                    if token in names:
+                        tokens.append("_p[%r]" % token)
+                    else:
+                        tokens.append(token)
+                self._compiledExpression = CompiledExpression(' '.join(tokens))
+        except SyntaxError, e:
+            if self._discreteProblemClass():
+                self._expressionError = "Syntax Error!\n Learner names must be isolated with spaces for ex. use ( RF == SVM ) and not (RF==SVM).\nCheck your custom logical expression: "+str(e)+"\nActual expression: "+str(self.expression)
+            else:
+                self._expressionError = "Syntax Error! Check your custom regression expression: "+str(e)
+        except Exception, e:
+            if self._discreteProblemClass():
+                self._expressionError = "Exception: Check your custom logical expression.\n Learner names must be isolated with spaces for ex. use ( RF == SVM ) and not (RF==SVM).\nActual expression: "+str(self.expression)
+            else:
+                self._expressionError = "Exception Error! Check your custom regression expression: "+str(e)
+
+    def _getCompiledExpression(self):
+        """Returns the compiled expression, compiling it again if the expression was changed"""
+        if not hasattr(self, "_compiledFor") or self._compiledFor != self.expression:
+            self._compileExpression()
+        if self._expressionError:
+            print self._expressionError
+        return self._compiledExpression
+
 
     def _singlePredict(self, origExample = None, resultType = orange.GetValue, returnDFV = False):
         """
@@ -333,6 +512,9 @@ class ConsensusClassifier(AZBaseClasses.AZClassifier):
         if origExample == None:
             return self.classifiers[0](None, resultType)
         else:
+            compiledExpression = self._getCompiledExpression()
+            if compiledExpression is None:
+                return None
             # Predict using the models  
             predictions = {}   #The individual predictions for each repective classifier in classifiers
             predicted = None
@@ -344,44 +526,17 @@ class ConsensusClassifier(AZBaseClasses.AZClassifier):
                 if self.verbose:
                     print self.status
 
-                # Init votes
-                votes = {}
-                for pv in self.classVar.values:
-                    votes[pv] = 0
-
-                # Do prediction and construct distribution of votes
                 for c in self.classifiers:
-                    predictions[c] = self.classifiers[c](origExample)
-                    votes[predictions[c].value] += 1
+                    predictions[c] = self.classifiers[c](origExample).value
 
-                result = None
-                for exp in self.expression:
+                for condition, logicalRes in compiledExpression:
                     try:
-                        logicalExp, logicalRes = exp.split('->')
-                        logicalExp = logicalExp.strip()
-                        logicalRes = logicalRes.strip()
-
-                        if logicalRes == "None":
-                            print "ERROR: Logical result cannot be None. For unknown values use ? instead!"
-                            return None
-
-                        if len(logicalExp) == 0:
+                        if condition is None or condition(predictions):
+                            if self.verbose and condition is not None:
+                                print "Logical Expression is True: ", condition.source
                             predicted = logicalRes
                             break
-
-                        rawParseTree = self._lexLogicalExp(logicalExp)
-                        modParseTree = self._parseLogicalTree(rawParseTree, predictions, self.classVar.values)
-                        result = self._interpretLogicalTree(modParseTree)
-                        if result:
-                            if self.verbose:
-                                print "Logical Expression is True: ", ''.join(modParseTree)
-                            predicted = logicalRes
-                            break
-                    except SyntaxError, (errno, strerror):
-                        print "Syntax Error!\n Learner names must be isolated with spaces for ex. use ( RF == SVM ) and not (RF==SVM).\nCheck your custom logical expression: ", strerror
-                        print "Actual expression: "+str(self.expression)
-                        return None
-                    except Exception:#, (errno, strerror):
+                    except Exception:
                         print "Exception: Check your custom logical expression.\n Learner names must be isolated with spaces for ex. use ( RF == SVM ) and not (RF==SVM)."
                         print "Actual expression: "+str(self.expression)
                         return None
@@ -394,7 +549,12 @@ class ConsensusClassifier(AZBaseClasses.AZClassifier):
                     print self.status
                     
                 for c in self.classifiers:
-                    predictions[c] = self.classifiers[c](origExample)
+                    memberPrediction = self.classifiers[c](origExample)
+                    if memberPrediction is None or memberPrediction.isSpecial():
+                        if self.verbose:
+                            print "The member "+str(c)+" could not predict the example"
+                        return None
+                    predictions[c] = float(memberPrediction)
 
                 if self.weights:
                     for p in predictions:
@@ -402,14 +562,9 @@ class ConsensusClassifier(AZBaseClasses.AZClassifier):
                             predictions[p] *= self.weights[p](origExample)
                         
                 try:
-                    rawParseTree = self._lexRegressionExp(self.expression)
-                    modParseTree = self._parseRegressionTree(rawParseTree, predictions)
-                    result = self._interpretRegressionTree(modParseTree)
-                except SyntaxError, (errno, strerror):
-                    print "Syntax Error! Check your custom regression expression: ", strerror
-                    return None
-                except Exception, (errno, strerror):
-                    print "Exception Error! Check your custom regression expression: ", strerror
+                    result = compiledExpression(predictions)
+                except Exception, e:
+                    print "Exception Error! Check your custom regression expression: ", e
                     return None
                 
                 DFV = predicted = result
@@ -442,19 +597,63 @@ class ConsensusClassifier(AZBaseClasses.AZClassifier):
                 return (res,DFV)
             else:
                 return res
-                
-    def _parseRegressionTree(self, tree, predictionResults):
-        """ Replace the variables with results from the classifiers """
-        for k in predictionResults.keys():
-            for n,i in enumerate(tree):
-                if k == i:
-                    tree[n] = str(predictionResults[k])
-                    
-        return tree
-            
-    def _interpretRegressionTree(self, tree):
-        #print tree
-        return eval(''.join(tree))
+
+    def predictBatch(self, data, returnProbs = False):
+        """Predicts all the examples in the ExampleTable 'data' at once. See AZBaseClasses.AZClassifier.predictBatch
+           With a custom expression, each member predicts the whole data and the compiled expression 
+           combines the columns of member predictions in one vectorized step.
+        """
+        if type(self.classifiers).__name__ != 'dict' or data is None or len(data) == 0:
+            return AZBaseClasses.AZClassifier.predictBatch(self, data, returnProbs)
+        compiledExpression = self._getCompiledExpression()
+        if compiledExpression is None:
+            return None
+        if self.classVar.varType != orange.VarTypes.Discrete and compiledExpression.hasBoolOp:
+            # and/or return one of their operands, which the vectorized expression does not
+            return AZBaseClasses.AZClassifier.predictBatch(self, data, returnProbs)
+        predictions = {}
+        for c in self.classifiers:
+            predictions[c] = self.classifiers[c].predictBatch(data)
+            if predictions[c] is None:
+                return None
+        nEx = len(data)
+        try:
+            if self.classVar.varType == orange.VarTypes.Discrete:
+                # Convert the predicted value indexes to the value strings used in the expression
+                valueNames = numpy.array(list(self.classVar.values) + ["?"], dtype = object)
+                for c in predictions:
+                    idxs = numpy.where(numpy.isnan(predictions[c]), len(self.classVar.values), predictions[c]).astype(int)
+                    predictions[c] = valueNames[idxs]
+                values = numpy.empty(nEx)
+                values[:] = numpy.nan
+                undecided = numpy.ones(nEx, bool)
+                for condition, logicalRes in compiledExpression:
+                    if condition is None:
+                        selected = undecided.copy()
+                    else:
+                        selected = undecided & numpy.asarray(condition(predictions, vectorized = True), bool)
+                    if logicalRes in self.classVar.values:
+                        values[selected] = self.classVar.values.index(logicalRes)
+                    undecided &= ~selected
+                self._isRealProb = False
+                probs = self._generateBatchProbs(values)
+            else:
+                if self.weights:
+                    for p in predictions:
+                        if p in self.weights:
+                            predictions[p] = predictions[p] * numpy.array([self.weights[p](ex) for ex in data], float)
+                values = numpy.asarray(compiledExpression(predictions, vectorized = True), float) * numpy.ones(nEx)
+                probs = None
+        except Exception:
+            # Expressions using functions that do not work on arrays are evaluated for each example
+            if self.verbose:
+                print "The custom expression cannot be evaluated on vectors. Predicting the examples one by one."
+            return AZBaseClasses.AZClassifier.predictBatch(self, data, returnProbs)
+        self.nPredictions += nEx
+        if returnProbs:
+            return (values, probs)
+        else:
+            return values
 
     def _lexRegressionExp(self, exp):
         STRING = 1
@@ -463,23 +662,6 @@ class ConsensusClassifier(AZBaseClasses.AZClassifier):
                         if token[STRING])
         return exprList
 
-    def _parseLogicalTree(self, tree, predictionResults, predictionClasses):
-        """ Replace the variables with results from the classifiers """
-        for k in predictionResults.keys():
-            for n,i in enumerate(tree):
-                if k == i:
-                    tree[n] = str(predictionResults[k])
-                    
-        """ Modify the tree such that predictionClasses are actual strings """
-        for i, item in enumerate(tree):
-            if item in predictionClasses:
-                tree[i] = '"%s"' % tree[i]
-                
-        return tree
-            
-    def _interpretLogicalTree(self, tree):
-        return eval(''.join(tree))
-
     def _lexLogicalExp(self, exp):
         STRING = 1
         exprList = re.split(r'[ ]| or | and ', exp)
@@ -632,7 +814,8 @@ class ConsensusClassifier(AZBaseClasses.AZClassifier):
                     output = open(weightsFilename, 'wb+')
                     pickle.dump(self.weights, output)
                     output.close()
-                    
+
+            self._writeManifest(dirPath)
         except:            
                 if self.verbose > 0: print "ERROR: Could not save the Consensus model to ", dirPath
                 return False
@@ -3,9 +3,36 @@ import orange,Orange
 import AZBaseClasses
 from AZutilities import dataUtilities
 import AZOrangeConfig as AZOC
-import os
+import os,sys
+import numpy
+import multiprocessing
 from opencv import ml,cv
 from AZutilities import evalUtilities
+from AZutilities import miscUtilities
+from AZutilities import threadPolicy
+
+
+def _trainSeed(seed):
+    """Trains the CvANN of CvANNLearner with the initial weights of seed in a worker process.
+       The network is saved in a scratch dir so that it can be loaded by the parent process.
+       Returns the tuple (seed, Acc, nIter, modelPath)
+    """
+    learner, validationSet, trainInputs = miscUtilities.getLocalPoolArgs()
+    modelPath = None
+    try:
+        model = learner.__train__(weight = None, seed = seed, validationSet = validationSet, trainInputs = trainInputs)
+        if model is None:
+            return (seed, None, None, None)
+        Acc = learner._getValidationAcc(validationSet, model)
+        modelPath = miscUtilities.createScratchDir(desc = "CvANNSeed", seed = str(os.getpid())+"_"+str(seed))
+        model.classifier.save(os.path.join(modelPath, "model.ann"))
+    except:
+        if modelPath:
+            miscUtilities.removeDir(modelPath)
+        print "ERROR training the CvANN with seed "+str(seed)+": "+str(sys.exc_info()[1])
+        return (seed, None, None, None)
+    return (seed, Acc, model.nIter, modelPath)
+
 
 class CvANNLearner(AZBaseClasses.AZLearner):
     """
@@ -26,6 +53,7 @@ class CvANNLearner(AZBaseClasses.AZLearner):
         self.name = name
         self.trainData = None
         self.imputer = None
+        self.nWorkers = 1       # Number of local processes training the different initial weights. 0 uses all the cores
 	#Read default parameters from AZOrangeConfig.py file
         for par in ("activationFunction","sigmoidAlpha","sigmoidBeta","nHidden", "scaleData",
                     "scaleClass", "optAlg", "bp_dw_scale", 
@@ -36,6 +64,7 @@ class CvANNLearner(AZBaseClasses.AZLearner):
         self.__dict__.update(kwds)
 
     def __call__(self, data, weight = None):
+        threadPolicy.applyThreadPolicy()
         bestSeed = None
         bestAcc = None
         bestNiter = None
@@ -71,29 +100,40 @@ class CvANNLearner(AZBaseClasses.AZLearner):
             validationSet = None
 
         if self.verbose and self.nDiffIniWeights>1: print "=========== Training ",self.nDiffIniWeights," times with different initial weights =============="
-        for n in range(self.nDiffIniWeights):
-            if self.nDiffIniWeights <=1:
-                seed=0  #in opencv  mmlann seed=0 means the seed is disabled, and original seed will be used
-            else:
-                seed = len(cleanedData) * len(cleanedData.domain) * (n+1)  #seed can be any integer
-            #Create a model with a specific seed for training opencv ANN. 
-            #Also passing the step for the nIter optimization (self.stopUPs=0 - disable nIter optimization)
-            #Also passing the validation set to be used in internal opencv implemented nEphocs optimization.
-            model = self.__train__(weight = None, seed = seed, validationSet = validationSet)
+        if self.nDiffIniWeights <=1:
             #Skip evaluation if the weights loop is disabled
-            if self.nDiffIniWeights <=1:
-                return model
-                break
-            if cleanedData.domain.classVar.varType == orange.VarTypes.Discrete:
-                Acc = evalUtilities.getClassificationAccuracy(validationSet, model)
-            else:
-                Acc = -evalUtilities.getRMSE(validationSet, model)
-            if bestModel == None or (Acc > bestAcc) or (Acc == bestAcc and model.nIter < bestNiter):
+            #in opencv  mmlann seed=0 means the seed is disabled, and original seed will be used
+            return self.__train__(weight = None, seed = 0, validationSet = validationSet)
+        #Create the models with a specific seed for training opencv ANN. seed can be any integer
+        #Also passing the step for the nIter optimization (self.stopUPs=0 - disable nIter optimization)
+        #Also passing the validation set to be used in internal opencv implemented nEphocs optimization.
+        seeds = [len(cleanedData) * len(cleanedData.domain) * (n+1) for n in range(self.nDiffIniWeights)]
+        # The input matrices are the same for all the seeds
+        trainInputs = self._getTrainInputs(validationSet)
+        if trainInputs is None:
+            return None
+        nWorkers = min(self.nWorkers or multiprocessing.cpu_count(), len(seeds))
+        if nWorkers > 1:
+            results = self._trainSeedsInParallel(seeds, validationSet, trainInputs, nWorkers)
+        else:
+            results = self._trainSeeds(seeds, validationSet, trainInputs)
+        # The results are compared in the seeds order so that the same model is selected regardless of nWorkers
+        for seed, Acc, nIter, model in results:
+            if model is None:
+                continue
+            if bestModel == None or (Acc > bestAcc) or (Acc == bestAcc and nIter < bestNiter):
                 bestSeed = seed
                 bestAcc = Acc
-                bestNiter = model.nIter
+                bestNiter = nIter
                 bestModel = model
-            if self.verbose:  print "nIter:%-7s  Acc:%-20s  seed: %s" % (model.nIter,Acc,seed)
+            if self.verbose:  print "nIter:%-7s  Acc:%-20s  seed: %s" % (nIter,Acc,seed)
+        if nWorkers > 1:
+            # The models trained in parallel are saved by the workers. Only the best one is loaded
+            if bestModel:
+                bestModel = self._loadSeedModel(bestModel, bestSeed, bestNiter, trainInputs["varNames"])
+            for seed, Acc, nIter, modelPath in results:
+                if modelPath:
+                    miscUtilities.removeDir(modelPath)
 
         if self.verbose: print "================ Best model Found: ==================="
         if self.verbose: print "nIter:%-7s  Acc:%-20s  seed: %s" % (bestNiter,bestAcc,bestSeed)
@@ -108,17 +148,96 @@ class CvANNLearner(AZBaseClasses.AZLearner):
 
         return bestModel
 
-    def __train__(self, weight = None, seed=0, validationSet=None):
-        if not AZBaseClasses.AZLearner.__call__(self, self.trainData, weight):
-            return None
-        """Creates an ANN model from the data in origTrainingData. """
+    def _getValidationAcc(self, validationSet, model):
+        if self.trainData.domain.classVar.varType == orange.VarTypes.Discrete:
+            return evalUtilities.getClassificationAccuracy(validationSet, model)
+        else:
+            return -evalUtilities.getRMSE(validationSet, model)
+
+    def _trainSeeds(self, seeds, validationSet, trainInputs):
+        """Trains one model for each of the seeds. Returns a list of (seed, Acc, nIter, model) tuples"""
+        results = []
+        for seed in seeds:
+            model = self.__train__(weight = None, seed = seed, validationSet = validationSet, trainInputs = trainInputs)
+            if model is None:
+                results.append((seed, None, None, None))
+            else:
+                results.append((seed, self._getValidationAcc(validationSet, model), model.nIter, model))
+        return results
 
+    def _trainSeedsInParallel(self, seeds, validationSet, trainInputs, nWorkers):
+        """Trains one model for each of the seeds in a pool of nWorkers local processes.
+           Returns a list of (seed, Acc, nIter, modelPath) tuples in the seeds order, where modelPath is the
+           scratch dir where the worker saved the network.
+        """
+        if self.verbose: print "Training in "+str(nWorkers)+" local processes"
+        # The workers inherit the learner, the data and the input matrices when the pool forks
+        return miscUtilities.runInLocalPool(_trainSeed, seeds, nWorkers, args = (self, validationSet, trainInputs), \
+                    onError = lambda seed, error: (seed, None, None, None))
+
+    def _loadSeedModel(self, modelPath, seed, nIter, varNames):
+        """Creates the model with the network trained by a worker process"""
+        classifier = ml.CvANN_MLP()
+        classifier.load(os.path.join(modelPath, "model.ann"))
+        return self._newClassifier(classifier, seed, nIter, varNames)
+
+    def _newClassifier(self, classifier, seed, nIter, varNames):
+        return CvANNClassifier(seed = seed, classifier = classifier, classVar = self.trainData.domain.classVar,
+                        imputeData=self.imputer.defaults, verbose = self.verbose, varNames = varNames,
+                        nIter = nIter, basicStat = self.basicStat, NTrainEx = self.NTrainEx, parameters = self.parameters)
 
+    def _getTrainInputs(self, validationSet = None):
+        """Converts the training and validation data to the CvMat inputs of the opencv ANN training.
+           Returns a dict with the inputs or None if they could not be created.
+        """
         #Convert the ExampleTable to CvMat
         CvMatices = dataUtilities.ExampleTable2CvMat(self.trainData, True)
-        mat = CvMatices["matrix"]
-        responses = CvMatices["responses"]
-        varTypes = CvMatices["varTypes"]
+        inputs = {"matrix": CvMatices["matrix"], "responses": CvMatices["responses"], "varNames": CvMatices["varNames"]}
+
+        #compute priors (sample weights)
+        priors = self.convertPriors(self.priors, self.trainData.domain.classVar,getDict = True)
+        if type(priors) == str: #If a string is returned, there was a failure, and it is the respective error mnessage.
+            print priors
+            return None
+ 
+        if priors and self.optAlg == 1:
+            #scale priors
+            pSum=sum(priors.values())
+            if pSum==0:
+                print "ERROR: The priors cannot be all 0!"
+                return None
+            map(lambda k,v:priors.update({k: (v+0.0)/pSum}),priors.keys(),priors.values())
+            #Apply the priors to each respective sample
+            sample_weights = [1] * len(self.trainData)
+            for idx,sw in enumerate(sample_weights):
+                actualClass = str(self.trainData[idx].getclass().value)
+                if actualClass in priors:
+                    sample_weights[idx] = sample_weights[idx] * priors[actualClass]
+            inputs["sampleWeights"] = dataUtilities.List2CvMat(sample_weights,"CV_32FC1")
+        else:
+            inputs["sampleWeights"] = None
+
+        if self.stopUPs > 0:
+            #Convert the ExampleTable to CvMat
+            CvMatices = dataUtilities.ExampleTable2CvMat(validationSet, True)
+            inputs["valMatrix"] = CvMatices["matrix"]
+            inputs["valResponses"] = CvMatices["responses"]
+        else:
+            inputs["valMatrix"] = None
+            inputs["valResponses"] = None
+        return inputs
+
+    def __train__(self, weight = None, seed=0, validationSet=None, trainInputs = None):
+        if not AZBaseClasses.AZLearner.__call__(self, self.trainData, weight):
+            return None
+        """Creates an ANN model from the data in origTrainingData. """
+
+        if trainInputs is None:
+            trainInputs = self._getTrainInputs(validationSet)
+            if trainInputs is None:
+                return None
+        mat = trainInputs["matrix"]
+        responses = trainInputs["responses"]
 
         #Configure ANN params
         params = ml.CvANN_MLP_TrainParams()
@@ -161,42 +280,9 @@ class CvANNLearner(AZBaseClasses.AZLearner):
         if not self.scaleClass:
             scaleFlag = scaleFlag |  ml.CvANN_MLP.NO_OUTPUT_SCALE
        
-        #compute priors (sample weights)
-        priors = self.convertPriors(self.priors, self.trainData.domain.classVar,getDict = True)
-        if type(priors) == str: #If a string is returned, there was a failure, and it is the respective error mnessage.
-            print priors
-            return None
- 
-        if priors and self.optAlg == 1:
-            #scale priors
-            pSum=sum(priors.values())
-            if pSum==0:
-                print "ERROR: The priors cannot be all 0!"
-                return None
-            map(lambda k,v:priors.update({k: (v+0.0)/pSum}),priors.keys(),priors.values())
-            #Apply the priors to each respective sample
-            sample_weights = [1] * len(self.trainData)
-            for idx,sw in enumerate(sample_weights):
-                actualClass = str(self.trainData[idx].getclass().value)
-                if actualClass in priors:
-                    sample_weights[idx] = sample_weights[idx] * priors[actualClass]
-            CV_sample_weights = dataUtilities.List2CvMat(sample_weights,"CV_32FC1")
-        else:
-            CV_sample_weights = None
         #Train the model
-        if self.stopUPs > 0:
-            #Convert the ExampleTable to CvMat
-            CvMatices = dataUtilities.ExampleTable2CvMat(validationSet, True)
-            valMat = CvMatices["matrix"]
-            valResponses = CvMatices["responses"]
-        else:
-            valMat = None
-            valResponses = None
-        nIter = classifier.train(mat, responses, CV_sample_weights, None, params, scaleFlag, seed,self.stopUPs,valMat,valResponses)
-        model = CvANNClassifier(seed = seed, classifier = classifier, classVar = self.trainData.domain.classVar,
-                        imputeData=self.imputer.defaults, verbose = self.verbose, varNames = CvMatices["varNames"],
-                        nIter = nIter, basicStat = self.basicStat, NTrainEx = self.NTrainEx, parameters = self.parameters)
-        return model
+        nIter = classifier.train(mat, responses, trainInputs["sampleWeights"], None, params, scaleFlag, seed,self.stopUPs,trainInputs["valMatrix"],trainInputs["valResponses"])
+        return self._newClassifier(classifier, seed, nIter, trainInputs["varNames"])
 
 
 class CvANNClassifier(AZBaseClasses.AZClassifier):
@@ -235,6 +321,7 @@ class CvANNClassifier(AZBaseClasses.AZClassifier):
         orange.GetValue -         <type 'orange.Value'>              ->    <orange.Value 'Act'='3.44158792'>
         orange.GetProbabilities - <type 'orange.DiscDistribution'>   ->    <0.000, 0.000> 
         """
+        threadPolicy.applyThreadPolicy()
         #dataUtilities.rmAllMeta(examples)
         if len(origExamples.domain.getmetas()) == 0:
             examples = origExamples
@@ -306,6 +393,46 @@ class CvANNClassifier(AZBaseClasses.AZClassifier):
         else:
             return res
     
+    def predictBatch(self, data, returnProbs = False):
+        """Predicts all the examples in the ExampleTable 'data' at once. See AZBaseClasses.AZClassifier.predictBatch
+           The data is fixed to the model domain, imputed and converted to one matrix which is predicted by the
+           network in one single call.
+        """
+        threadPolicy.applyThreadPolicy()
+        orngMatrix = self._getBatchMatrix(data)
+        if orngMatrix is None:
+            return None
+        if len(orngMatrix) == 0:
+            return self._emptyBatchResult(returnProbs)
+        nEx, nAttrs = orngMatrix.shape
+        if self.classVar.varType == orange.VarTypes.Continuous: 
+            Nout = 1
+        else:
+            Nout = len(self.classVar.values)
+        inputs = cv.cvCreateMat(nEx,nAttrs,cv.CV_32FC1)
+        dataUtilities.Array2CvMat(numpy.ma.filled(orngMatrix, 0), inputs)
+        out = cv.cvCreateMat(nEx,Nout,cv.CV_32FC1)
+        self.classifier.predict(inputs,out)
+        outMatrix = dataUtilities.CvMat2Array(out).astype(numpy.float64)
+        self.nPredictions += nEx
+        if Nout == 1:
+            values = outMatrix[:,0]
+            if returnProbs:
+                return (values, None)
+            else:
+                return values
+        # Same as CvMat2orangeResponse with foldClass: the value with the max output, or nan if the output is nan
+        values = numpy.argmax(outMatrix, 1).astype(numpy.float64)
+        values[numpy.isnan(outMatrix).any(1)] = numpy.nan
+        if not returnProbs:
+            return values
+        #fix the probabilities so that values are between 0 and 1, as done for single examples
+        OutVector = outMatrix / outMatrix.sum(1).reshape(nEx,1)
+        subtract = abs(numpy.where(OutVector < 0, OutVector, 0).sum(1)).reshape(nEx,1)
+        probs = numpy.where(OutVector > 1, OutVector - subtract, OutVector)
+        probs[OutVector <= 0] = 0
+        return (values, probs)
+
     def __getProbabilities(self, fannOutVector):
         """Get the orange like output probabilities for the current predicted example"""
         dist = orange.DiscDistribution(self.classVar)
@@ -357,6 +484,7 @@ class CvANNClassifier(AZBaseClasses.AZClassifier):
             varNamesFile.close()
             #Save the parameters
             self._saveParameters(os.path.join(thePath,"parameters.pkl"))
+            self._writeManifest(thePath)
         except:
             if self.verbose > 0: print "ERROR: Could not save model to ", path
             return False
@@ -2,8 +2,10 @@ import pickle
 import orange
 import AZBaseClasses
 from AZutilities import dataUtilities
+from AZutilities import threadPolicy
 import AZOrangeConfig as AZOC
 import os
+import numpy
 from opencv import ml,cv
 
 class CvBayesLearner(AZBaseClasses.AZLearner):
@@ -35,6 +37,7 @@ class CvBayesLearner(AZBaseClasses.AZLearner):
 
     def __call__(self, data, weight = None):
         """Creates a Bayes model from the data in origTrainingData. """
+        threadPolicy.applyThreadPolicy()
         if not AZBaseClasses.AZLearner.__call__(self, data, weight):
             return None
         if data.domain.classVar.varType != orange.VarTypes.Discrete:
@@ -113,6 +116,7 @@ class CvBayesClassifier(AZBaseClasses.AZClassifier):
         orange.GetValue -         <type 'orange.Value'>              ->    <orange.Value 'Act'='3.44158792'>
         orange.GetProbabilities - <type 'orange.DiscDistribution'>   ->    <0.000, 0.000> 
         """
+        threadPolicy.applyThreadPolicy()
         #dataUtilities.rmAllMeta(examples)
         if len(origExamples.domain.getmetas()) == 0:
             examples = origExamples
@@ -182,6 +186,33 @@ class CvBayesClassifier(AZBaseClasses.AZClassifier):
             return res
   
    
+    def predictBatch(self, data, returnProbs = False):
+        """Predicts all the examples in the ExampleTable 'data' at once. See AZBaseClasses.AZClassifier.predictBatch
+           The data is fixed to the model domain, imputed, scaled and converted to one matrix which is predicted 
+           by the Bayes classifier in one single call.
+        """
+        threadPolicy.applyThreadPolicy()
+        orngMatrix = self._getBatchMatrix(data)
+        if orngMatrix is None:
+            return None
+        if len(orngMatrix) == 0:
+            return self._emptyBatchResult(returnProbs)
+        matrix = numpy.ma.filled(orngMatrix, 0)
+        if self.scalizer:
+            matrix = self.scalizer.scaleArray(matrix)
+        nEx, nAttrs = matrix.shape
+        samples = cv.cvCreateMat(nEx,nAttrs,cv.CV_32FC1)
+        dataUtilities.Array2CvMat(matrix, samples)
+        results = cv.cvCreateMat(nEx,1,cv.CV_32FC1)
+        self.classifier.predict(samples, results)
+        values = numpy.array([self._value2float(dataUtilities.CvMat2orangeResponse(float(v), self.classVar)) \
+                              for v in dataUtilities.CvMat2Array(results)[:,0]])
+        self.nPredictions += nEx
+        if returnProbs:
+            return (values, self._generateBatchProbs(values))
+        else:
+            return values
+
     def __generateProbabilities(self, prediction):
         # Method to artificialy generate a list the length of the number of classes and set the predicted class to 1
         dist = orange.DiscDistribution(self.classVar)
@@ -220,6 +251,7 @@ class CvBayesClassifier(AZBaseClasses.AZClassifier):
             varNamesFile.close()
             #Save the parameters
             self._saveParameters(os.path.join(thePath,"parameters.pkl"))
+            self._writeManifest(thePath)
         except:
             if self.verbose > 0: print "ERROR: Could not save model to ", path
             return False
@@ -1,8 +1,10 @@
 import string,orange
 import AZBaseClasses
 from AZutilities import dataUtilities
+from AZutilities import threadPolicy
 import AZOrangeConfig as AZOC
 import os
+import numpy
 from opencv import ml,cv
 import pickle
 
@@ -50,6 +52,7 @@ class CvBoostLearner(AZBaseClasses.AZLearner):
 
     def __call__(self, data, weight = None):
         """Creates a Boost model from the data in origTrainingData. """
+        threadPolicy.applyThreadPolicy()
         if not AZBaseClasses.AZLearner.__call__(self, data, weight):
             return None
         if data.domain.classVar.varType != orange.VarTypes.Discrete:
@@ -164,6 +167,7 @@ class CvBoostClassifier(AZBaseClasses.AZClassifier):
         orange.GetValue -         <type 'orange.Value'>              ->    <orange.Value 'Act'='3.44158792'>
         orange.GetProbabilities - <type 'orange.DiscDistribution'>   ->    <0.000, 0.000> 
         """
+        threadPolicy.applyThreadPolicy()
         #dataUtilities.rmAllMeta(examples)
         if len(origExamples.domain.getmetas()) == 0:
             examples = origExamples
@@ -230,6 +234,29 @@ class CvBoostClassifier(AZBaseClasses.AZClassifier):
             return res
   
    
+    def predictBatch(self, data, returnProbs = False):
+        """Predicts all the examples in the ExampleTable 'data' at once. See AZBaseClasses.AZClassifier.predictBatch
+           The data is fixed to the model domain, imputed and converted to one matrix once. Each row of that matrix
+           is then passed to the boosted trees without any further conversion.
+        """
+        threadPolicy.applyThreadPolicy()
+        orngMatrix = self._getBatchMatrix(data)
+        if orngMatrix is None:
+            return None
+        matrix = numpy.ma.filled(orngMatrix, 0)
+        nEx, nAttrs = matrix.shape
+        exToPredict = cv.cvCreateMat(1,nAttrs,cv.CV_32FC1)
+        values = numpy.empty(nEx)
+        for idx in xrange(nEx):
+            dataUtilities.Array2CvMat(matrix[idx], exToPredict)
+            out = self.classifier.predict(exToPredict)
+            values[idx] = self._value2float(dataUtilities.CvMat2orangeResponse(out, self.classVar))
+        self.nPredictions += nEx
+        if returnProbs:
+            return (values, self._generateBatchProbs(values))
+        else:
+            return values
+
     def __generateProbabilities(self, prediction):
         # Method to artificialy generate a list the length of the number of classes and set the predicted class to 1
         dist = orange.DiscDistribution(self.classVar)
@@ -266,6 +293,7 @@ class CvBoostClassifier(AZBaseClasses.AZClassifier):
             varNamesFile.close()
             #Save the parameters
             self._saveParameters(os.path.join(thePath,"parameters.pkl"))
+            self._writeManifest(thePath)
         except:
             if self.verbose > 0: print "ERROR: Could not save model to ", path
             return False
@@ -2,8 +2,10 @@ import pickle
 import orange,Orange
 import AZBaseClasses
 from AZutilities import dataUtilities
+from AZutilities import threadPolicy
 import AZOrangeConfig as AZOC
 import os
+import numpy
 from opencv import ml,cv
 
 class CvSVMLearner(AZBaseClasses.AZLearner):
@@ -50,6 +52,7 @@ class CvSVMLearner(AZBaseClasses.AZLearner):
 
     def __call__(self, data, weight = None):
         """Creates an SVM model from the data in origTrainingData. """
+        threadPolicy.applyThreadPolicy()
         if not AZBaseClasses.AZLearner.__call__(self, data, weight):
             if self.verbose > 0: print "Could not create base class instance"
             return None
@@ -196,6 +199,7 @@ class CvSVMClassifier(AZBaseClasses.AZClassifier):
                 If it is not a binary classifier, DFV will be equal to None
                 DFV will be a value from greater or equal to 0  
         """
+        threadPolicy.applyThreadPolicy()
         res = None
         #dataUtilities.rmAllMeta(examples)
         if len(origExamples.domain.getmetas()) == 0:
@@ -272,6 +276,69 @@ class CvSVMClassifier(AZBaseClasses.AZClassifier):
         self.nPredictions += 1
         return res
 
+    def predictBatch(self, data, returnProbs = False):
+        """Predicts all the examples in the ExampleTable 'data' at once. See AZBaseClasses.AZClassifier.predictBatch
+           The data is fixed to the model domain, imputed, scaled and converted to one matrix once. Each row of 
+           that matrix is then passed to the SVM without any further conversion.
+        """
+        threadPolicy.applyThreadPolicy()
+        res = self._predictBatchMatrix(data)
+        if res is None:
+            return None
+        res = res[0]
+        values = numpy.array([self._value2float(dataUtilities.CvMat2orangeResponse(v,self.classVar)) for v in res])
+        self.nPredictions += len(values)
+        if returnProbs:
+            return (values, self._generateBatchProbs(values))
+        else:
+            return values
+
+    def predictBatchDFV(self, data):
+        """Returns the DFV of all the examples in the ExampleTable 'data'. See AZBaseClasses.AZClassifier.predictBatchDFV
+           For binary classification it is the SVM decision function, otherwise the value predicted.
+        """
+        threadPolicy.applyThreadPolicy()
+        isBinary = self.classVar.varType != orange.VarTypes.Continuous and len(self.classVar.values) == 2
+        res = self._predictBatchMatrix(data, isBinary)
+        if res is None:
+            return None
+        if isBinary:
+            DFVs = res[1]
+        else:
+            #On Regression models assume the DVF as the value predicted
+            DFVs = res[0]
+        self.nPredictions += len(DFVs)
+        self._updateBatchDFVExtremes(DFVs)
+        return DFVs
+
+    def _predictBatchMatrix(self, data, getDFV = False):
+        """Fixes, imputes and scales 'data' into one matrix and predicts each of its rows with the SVM.
+           Returns the tuple (res, DFVs) of numpy arrays with the raw SVM responses back transformed to the 
+           original class scale, and the decision function values if getDFV is True (None otherwise).
+           Returns None if data is not compatible with the classifier.
+        """
+        orngMatrix = self._getBatchMatrix(data)
+        if orngMatrix is None:
+            return None
+        matrix = numpy.ma.filled(orngMatrix, 0)
+        if self.scalizer:
+            matrix = self.scalizer.scaleArray(matrix)
+        nEx, nAttrs = matrix.shape
+        exToPredict = cv.cvCreateMat(1,nAttrs,cv.CV_32FC1)
+        res = numpy.empty(nEx)
+        if getDFV:
+            DFVs = numpy.empty(nEx)
+        else:
+            DFVs = None
+        for idx in xrange(nEx):
+            dataUtilities.Array2CvMat(matrix[idx], exToPredict)
+            res[idx] = self.classifier.predict(exToPredict)
+            if getDFV:
+                DFVs[idx] = self.classifier.predict(exToPredict, True)
+        if self.scalizer:
+            res = self.scalizer.convertClass(res)
+        return (res, DFVs)
+
     def write(self, path):
         '''Save an SVM classifier to disk'''
         thePath = str(path)
@@ -307,6 +374,7 @@ class CvSVMClassifier(AZBaseClasses.AZClassifier):
             varNamesFile.close()
             #Save the parameters
             self._saveParameters(os.path.join(thePath,"parameters.pkl"))
+            self._writeManifest(thePath)
         except:
             if self.verbose > 0: print "ERROR: Could not save model to ", path
             return False
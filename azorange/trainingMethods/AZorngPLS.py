@@ -16,12 +16,49 @@ import orngStat
 import random
 import time
 import types
+import numpy
 
 import AZOrangeConfig as AZOC
 import AZBaseClasses
 from AZutilities import dataUtilities
 from AZutilities import miscUtilities
 
+def getPLSVarInfo(domain):
+    """Returns the strings (varNames, varValues) describing the variables of domain, being the class the last one, 
+       as expected by PlsAPI.TrainBuffer and PlsAPI.RunBuffer:
+            varNames  - Tab separated names of the variables. Discrete variables are preceded by '#'
+            varValues - One line per variable with the tab separated values of the discrete variables
+    """
+    varNames = []
+    varValues = []
+    for var in domain.variables:
+        if var.varType == orange.VarTypes.Discrete:
+            varNames.append("#" + var.name)
+            varValues.append("\t".join(var.values))
+        else:
+            varNames.append(var.name)
+            varValues.append("")
+    return "\t".join(varNames), "\n".join(varValues)
+
+
+def getPLSBuffer(data, withClass = True):
+    """Returns the imputed ExampleTable data as a buffer of doubles (one row per example) as expected by 
+       PlsAPI.TrainBuffer and PlsAPI.RunBuffer. Discrete variables hold the index of the value.
+       Continuous values are rounded to the number of decimals of their variables, as they were when passed 
+       to the PLS as text, so that the models and predictions do not change.
+    """
+    numPyData = data.toNumpyMA()
+    matrix = numpy.ma.filled(numPyData[0], 0).astype(numpy.float64)
+    variables = list(data.domain.attributes)
+    if withClass:
+        matrix = numpy.column_stack((matrix, numpy.ma.filled(numPyData[1], 0).astype(numpy.float64)))
+        variables.append(data.domain.classVar)
+    for idx, var in enumerate(variables):
+        if var.varType == orange.VarTypes.Continuous:
+            matrix[:, idx] = numpy.round(matrix[:, idx], var.numberOfDecimals)
+    return numpy.ascontiguousarray(matrix).tostring()
+
+
 class PLSLearner(AZBaseClasses.AZLearner):
 
     def __new__(cls, trainingData = None, name = "PLS learner", **kwds):
@@ -72,9 +109,14 @@ class PLSLearner(AZBaseClasses.AZLearner):
             return None
         #Remove from the domain any unused values of discrete attributes including class
         trainingData = dataUtilities.getDataWithoutUnusedValues(trainingData,True)
-        # Create path for the Orange data
-        scratchdir = miscUtilities.createScratchDir(desc="PLS")
-        OrngFile = os.path.join(scratchdir,"OrngData.tab")
+        # The PLS modules built before the buffer interface need the data in a file
+        inMemory = hasattr(pls.PlsAPI, "TrainBuffer")
+        if inMemory:
+            scratchdir = None
+        else:
+            # Create path for the Orange data
+            scratchdir = miscUtilities.createScratchDir(desc="PLS")
+            OrngFile = os.path.join(scratchdir,"OrngData.tab")
 
         # Remove meta attributes from training data to make the imputer work with examples without the meta attributes. 
         #dataUtilities.rmAllMeta(trainingData)
@@ -87,10 +129,11 @@ class PLSLearner(AZBaseClasses.AZLearner):
         self.imputer = orange.ImputerConstructor_average(trainData)
 	# Impute the data 
 	trainData = self.imputer(trainData)
-        # Save the Data already imputed to an Orange formated file
-	if self.verbose > 1: print time.asctime(), "Saving Orange Data to a tab file..."
-        orange.saveTabDelimited(OrngFile,trainData)
-	if self.verbose > 1: print time.asctime(), "done"
+        if not inMemory:
+            # Save the Data already imputed to an Orange formated file
+            if self.verbose > 1: print time.asctime(), "Saving Orange Data to a tab file..."
+            orange.saveTabDelimited(OrngFile,trainData)
+            if self.verbose > 1: print time.asctime(), "done"
 
         # Create the PLS instance
 	if self.verbose > 1: print time.asctime(), "Creating PLS Object..."
@@ -108,12 +151,18 @@ class PLSLearner(AZBaseClasses.AZLearner):
         else:
 	    learner.SetParameter('k',self.k)
 	learner.SetParameter('precision',self.precision)	
-	learner.SetParameter('sDir',scratchdir)  #AZOC.SCRATCHDIR)
+        if scratchdir:
+            learner.SetParameter('sDir',scratchdir)  #AZOC.SCRATCHDIR)
 	
-        # Read the Orange Formated file and Train the Algorithm
 	# TRAIN
 	if self.verbose > 1: print time.asctime(), "Training..."
-        learner.Train(OrngFile)
+        if inMemory:
+            # Train the Algorithm with the imputed data passed as a buffer of doubles
+            varNames, varValues = getPLSVarInfo(trainData.domain)
+            learner.TrainBuffer(getPLSBuffer(trainData), len(trainData.domain.variables), varNames, varValues)
+        else:
+            # Read the Orange Formated file and Train the Algorithm
+            learner.Train(OrngFile)
 	if self.verbose > 1:
 		print "Train finished at ", time.asctime()
 		print "PLS trained in: " + str(learner.GetCPUTrainTime()) + " seconds";
@@ -122,9 +171,9 @@ class PLSLearner(AZBaseClasses.AZLearner):
 		print "Precision:  " +  learner.GetParameter("precision")
 
         # Remove the scratch file
-        if self.verbose == 0:
+        if scratchdir and self.verbose == 0:
 	    miscUtilities.removeDir(scratchdir)
-	else:
+	elif scratchdir:
 	    print "The directory " + scratchdir + " was not deleted because DEBUG flag is ON"
 	del trainData
         impData=self.imputer.defaults
@@ -149,6 +198,7 @@ class PLSClassifier(AZBaseClasses.AZClassifier):
 	self.name = name
         self.imputer = None
         self.domain = None
+        self._varValues = None
         self.ExFix = dataUtilities.ExFix()
 
         if self.imputeData:
@@ -205,37 +255,15 @@ class PLSClassifier(AZBaseClasses.AZClassifier):
 	        examplesImp = inExamples
 	
             DFV = None	
-            # Transform the orange data to the PLS prediction data format 
-            PLSFeatureVector = self.getFeatureVector(examplesImp)
-            # Return the result of the prediction for one feature vector
-	    PLSOut = self.classifier.Run(PLSFeatureVector)
-            if self.verbose > 0: print "PLSOut: ",PLSOut
-	    if PLSOut.find("ERROR")>=0:
-                print "Error returned by PLS:"
-                print "  PLSOut: ",PLSOut
-                print "Class:",str(self.classVar)
-                if self.classVar.varType == orange.VarTypes.Discrete:
-                    print "values = ",str(self.classVar.values)
-                else:
-                    print "Numerical Variable"
-                print "Returning '?'"
-                PLSOut = '?' #"ERROR"
-	    orngOut=string.split(PLSOut,"\t")
-            if self.verbose > 0: print "orngOut: ",orngOut
-	    #convert result to orange value
-            try:
-	        value=orange.Value(self.classVar,orngOut[len(orngOut)-1])
-            except:
-                print "Error converting the Class back to orange format:"
-                print "Class:",str(self.classVar)  
-                if self.classVar.varType == orange.VarTypes.Discrete:
-                    print "values = ",str(self.classVar.values)
-                else:
-                    print "Numerical Variable"
-                print "Returned by PLS:",str(PLSOut)
-                print "Value in orange Format (Would be the last element of PLSout): ",str(orngOut),"  ->  ",str(orngOut[len(orngOut)-1])
-                print "Returning '?'"
-                value=orange.Value(self.classVar,'?')
+            values = self._runPLSBuffer(dataUtilities.DataTable(examplesImp.domain, [examplesImp]))
+            if values is not None:
+                value = self._float2value(values[0])
+            else:
+                # Transform the orange data to the PLS prediction data format 
+                PLSFeatureVector = self.getFeatureVector(examplesImp)
+                # Return the result of the prediction for one feature vector
+                value = self._runPLS(PLSFeatureVector)
+                del PLSFeatureVector
 	    if self.classVar.varType == orange.VarTypes.Discrete: 
                 score = self.getProbabilities(value)
                 probOf1 = score[self.classVar.values[1]]
@@ -250,7 +278,6 @@ class PLSClassifier(AZBaseClasses.AZClassifier):
                     self._updateDFVExtremes(DFV)
 	    # Assure that large local variables are deleted
 	    del examplesImp
-	    del PLSFeatureVector
 
 	    #Return the desired quantity	
             if resultType == orange.GetProbabilities:
@@ -269,11 +296,88 @@ class PLSClassifier(AZBaseClasses.AZClassifier):
 
 
 
+    def _runPLS(self, PLSFeatureVector):
+        """Predicts one feature vector (see getFeatureVector) and returns the prediction as an orange Value"""
+        PLSOut = self.classifier.Run(PLSFeatureVector)
+        if self.verbose > 0: print "PLSOut: ",PLSOut
+        if PLSOut.find("ERROR")>=0:
+            print "Error returned by PLS:"
+            print "  PLSOut: ",PLSOut
+            print "Class:",str(self.classVar)
+            if self.classVar.varType == orange.VarTypes.Discrete:
+                print "values = ",str(self.classVar.values)
+            else:
+                print "Numerical Variable"
+            print "Returning '?'"
+            PLSOut = '?' #"ERROR"
+        orngOut=string.split(PLSOut,"\t")
+        if self.verbose > 0: print "orngOut: ",orngOut
+        #convert result to orange value
+        try:
+            value=orange.Value(self.classVar,orngOut[len(orngOut)-1])
+        except:
+            print "Error converting the Class back to orange format:"
+            print "Class:",str(self.classVar)  
+            if self.classVar.varType == orange.VarTypes.Discrete:
+                print "values = ",str(self.classVar.values)
+            else:
+                print "Numerical Variable"
+            print "Returned by PLS:",str(PLSOut)
+            print "Value in orange Format (Would be the last element of PLSout): ",str(orngOut),"  ->  ",str(orngOut[len(orngOut)-1])
+            print "Returning '?'"
+            value=orange.Value(self.classVar,'?')
+        return value
+
+    def _runPLSBuffer(self, examplesImp):
+        """Predicts all the examples in the imputed ExampleTable examplesImp, with the classifier domain, in one call
+           to the PLS. Returns a numpy array with the value index (classification) or value (regression) predicted
+           for each example, or None if the PLS module does not support predicting from a buffer.
+        """
+        if not hasattr(self.classifier, "RunBuffer"):
+            return None
+        if self._varValues is None:
+            self._varValues = getPLSVarInfo(examplesImp.domain)[1]
+        out = self.classifier.RunBuffer(getPLSBuffer(examplesImp, withClass = False), self._varValues)
+        if len(out) != len(examplesImp) * numpy.dtype(numpy.float64).itemsize:
+            if self.verbose > 0: print "Error returned by PLS when predicting from a buffer."
+            return None
+        return numpy.fromstring(out, dtype = numpy.float64)
+
+    def _float2value(self, value):
+        """Converts a value predicted by _runPLSBuffer to an orange Value"""
+        if numpy.isnan(value):
+            return orange.Value(self.classVar, '?')
+        if self.classVar.varType == orange.VarTypes.Discrete:
+            return orange.Value(self.classVar, int(value))
+        return orange.Value(self.classVar, float(value))
+
     def getProbabilities(self, prediction):
         dist = orange.DiscDistribution(self.domain.classVar)
         dist[prediction]=1
 	return dist
 
+    def predictBatch(self, data, returnProbs = False):
+        """Predicts all the examples in the ExampleTable 'data' at once. See AZBaseClasses.AZClassifier.predictBatch
+           The data is fixed to the model domain and imputed once for the whole table, and passed to the PLS 
+           as one buffer of doubles. 
+        """
+        examplesImp = self._getBatchData(data)
+        if examplesImp is None:
+            return None
+        nEx = len(examplesImp)
+        if nEx == 0:
+            return self._emptyBatchResult(returnProbs)
+        values = self._runPLSBuffer(examplesImp)
+        if values is None:
+            values = numpy.empty(nEx)
+            for idx,ex in enumerate(examplesImp):
+                values[idx] = self._value2float(self._runPLS(self.getFeatureVector(ex)))
+        self.nPredictions += nEx
+        if returnProbs:
+            return (values, self._generateBatchProbs(values))
+        else:
+            return values
+
     def getFeatureVector(self, orangeVector):
         """ Transforms one orange type of data example ([5.1, 3.5, POS, 0.2, 'Iris-setosa'], special list) 
             to a PLS type ("5.1 3.5 POS 0.2", string). """
@@ -309,6 +413,7 @@ class PLSClassifier(AZBaseClasses.AZClassifier):
                 varNamesFile.close()
                 #Save the parameters
                 self._saveParameters(os.path.join(filePath,"parameters.pkl"))
+                self._writeManifest(str(filePath))
         except:            
                 if self.verbose > 0: print "ERROR: Could not save model to ", path
                 return False
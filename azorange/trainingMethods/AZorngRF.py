@@ -11,6 +11,7 @@ import pickle
 ##scPA
 import AZBaseClasses
 from math import sqrt
+import numpy
 from opencv import ml
 from opencv import cv
 
@@ -19,6 +20,7 @@ import orange,Orange
 
 from AZutilities import dataUtilities
 from AZutilities import miscUtilities
+from AZutilities import threadPolicy
 
 import AZOrangeConfig as AZOC
 
@@ -58,8 +60,8 @@ class RFLearner(AZBaseClasses.AZLearner):
         if not self.__dict__.has_key("useBuiltInMissValHandling"):
             self.__dict__["useBuiltInMissValHandling"] = AZOC.RFDEFAULTDICT["useBuiltInMissValHandling"]
 
-        # NumThreads: Number of threads to be used by opencv. 
-        # 0 means it will use as much threads as number of cores. Default 1.
+        # NumThreads: Number of threads to be used by opencv. Default 1.
+        # "auto" or 0 use the global thread policy (AZOC.OPENCVNTHREADS), see AZutilities/threadPolicy.py
         if not self.__dict__.has_key("NumThreads"):
             self.__dict__["NumThreads"] = AZOC.RFDEFAULTDICT["NumThreads"]
 
@@ -108,7 +110,7 @@ class RFLearner(AZBaseClasses.AZLearner):
             return None
 
         # Set the number of theatd to be used ny opencv
-        cv.cvSetNumThreads(max(int(self.NumThreads),0))
+        threadPolicy.applyThreadPolicy(self.NumThreads)
         #Remove from the domain any unused values of discrete attributes including class
         trainingData = dataUtilities.getDataWithoutUnusedValues(trainingData,True)
 
@@ -352,6 +354,7 @@ class RFClassifier(AZBaseClasses.AZClassifier):
                 If it is not a binary classifier, DFV will be equal to None
                 DFV will be a value from -0.5 to 0.5
         """
+        threadPolicy.applyThreadPolicy()
         if origExample == None:
             return self.classifier(None, resultType)
         else:
@@ -392,27 +395,28 @@ class RFClassifier(AZBaseClasses.AZClassifier):
                 if not exampleCvMat:
                     if self.verbose > 0: print "Could not convert the example to a valid CvMat objct for prediction"
                     return none
-                # Predict using the RFmodel object
-                prediction = self.classifier.predict(exampleCvMat,missing_mask)
 	        probabilities = None
                 DFV = None
-                # Back transform the prediction to the original classes and calc probabilities
-                prediction = dataUtilities.CvMat2orangeResponse(prediction, self.classVar)
-                # Calculate artificial probabilities - not returned by the OpenCV RF algorithm
-                if self.classVar.varType == orange.VarTypes.Discrete:
+                if self.classVar.varType == orange.VarTypes.Discrete and len(self.classVar.values) == 2:
+                    # The class and the probabilities are derived from the same pass over the trees
+                    prediction, probOf1 = self._predictBinary(exampleCvMat,missing_mask)
                     if resultType != orange.GetValue:
-                        if len(self.classVar.values) == 2:
-                            probOf1 = self.classifier.predict_prob(exampleCvMat,missing_mask)
-                            probabilities = self.__getProbabilities(probOf1)
-                            DFV = self.convert2DFV(probOf1)
-                            self._isRealProb = True 
-                        else:
-                            #Need to make sure to return meanful probabilities to the cases where opencvRF does not support probabilities
-                            # to be compatible with possible callers asking for probabilities. 
-                            probabilities = self.__generateProbabilities(prediction)
-                            self._isRealProb = False
-                    elif len(self.classVar.values) == 2 and returnDFV:
-                        DFV = self.convert2DFV(self.classifier.predict_prob(exampleCvMat,missing_mask))
+                        probabilities = self.__getProbabilities(probOf1)
+                        self._isRealProb = True 
+                    if resultType != orange.GetValue or returnDFV:
+                        DFV = self.convert2DFV(probOf1)
+                else:
+                    # Predict using the RFmodel object
+                    prediction = self.classifier.predict(exampleCvMat,missing_mask)
+                    # Back transform the prediction to the original classes and calc probabilities
+                    prediction = dataUtilities.CvMat2orangeResponse(prediction, self.classVar)
+                if self.classVar.varType == orange.VarTypes.Discrete:
+                    if resultType != orange.GetValue and len(self.classVar.values) != 2:
+                        # Calculate artificial probabilities - not returned by the OpenCV RF algorithm
+                        #Need to make sure to return meanful probabilities to the cases where opencvRF does not support probabilities
+                        # to be compatible with possible callers asking for probabilities. 
+                        probabilities = self.__generateProbabilities(prediction)
+                        self._isRealProb = False
                 else:
                     #On Regression models assume the DVF as the value predicted
                     if not prediction.isSpecial():
@@ -455,6 +459,125 @@ class RFClassifier(AZBaseClasses.AZClassifier):
             else:
                 return res
 
+    def _predictBinary(self, exampleCvMat, missing_mask = None):
+        """Predicts one example of a binary classifier with a single pass over the trees.
+           Returns the tuple (prediction, probOf1) where probOf1 is the fraction of tree votes for the class 
+           represented by 1 in opencvRF. The predicted class is the one with most votes. Only on a tie the 
+           forest is asked for the class, as the opencv tie break depends on the order of the votes.
+        """
+        probOf1 = self.classifier.predict_prob(exampleCvMat,missing_mask)
+        if probOf1 > 0.5:
+            prediction = 1
+        elif probOf1 < 0.5:
+            prediction = 0
+        else:
+            prediction = self.classifier.predict(exampleCvMat,missing_mask)
+        return dataUtilities.CvMat2orangeResponse(prediction, self.classVar), probOf1
+
+    def _iterBatchCvMats(self, data):
+        """Yields (exampleCvMat, missingCvMat) with each example of data fixed to the model domain, imputed and 
+           converted to one matrix once. The same CvMat objects are filled for each example.
+           Yields nothing if data is not compatible with the classifier.
+        """
+        orngMatrix = self._getBatchMatrix(data, impute = not self.useBuiltInMissValHandling)
+        if orngMatrix is None:
+            return
+        nEx, nAttrs = orngMatrix.shape
+        matrix = numpy.ma.filled(orngMatrix, 0)
+        exampleCvMat = cv.cvCreateMat(1,nAttrs,cv.CV_32FC1)
+        if self.useBuiltInMissValHandling:
+            missingMask = numpy.ma.getmaskarray(orngMatrix)
+            missingCvMat = cv.cvCreateMat(1,nAttrs,cv.CV_8UC1)
+        else:
+            missingCvMat = None
+        for idx in xrange(nEx):
+            dataUtilities.Array2CvMat(matrix[idx], exampleCvMat)
+            if missingCvMat is not None:
+                dataUtilities.Array2CvMat(missingMask[idx], missingCvMat)
+            yield exampleCvMat, missingCvMat
+
+    def getVoteFractions(self, data):
+        """Returns a numpy array with one row per example in the ExampleTable 'data' and one column per class value
+           with the fraction of trees voting for each class value, for use in calibration or conformal prediction.
+           The votes are only available for binary classifiers (opencvRF limitation). Returns None otherwise, 
+           or if data is not compatible with the classifier.
+        """
+        if self.classVar.varType != orange.VarTypes.Discrete or len(self.classVar.values) != 2:
+            if self.verbose > 0: print "The tree votes are only available for binary classifiers"
+            return None
+        if not data:
+            return None
+        threadPolicy.applyThreadPolicy()
+        probOf1 = numpy.array([self.classifier.predict_prob(exampleCvMat,missingCvMat) for exampleCvMat,missingCvMat in self._iterBatchCvMats(data)])
+        if len(probOf1) != len(data):
+            return None
+        return self.__probOf1ToBatchProbs(probOf1)
+
+    def predictBatchDFV(self, data):
+        """Returns the DFV of all the examples in the ExampleTable 'data'. See AZBaseClasses.AZClassifier.predictBatchDFV
+           For binary classification it is derived from the fraction of tree votes, and for regression it is the 
+           predicted value.
+        """
+        if data is None:
+            return None
+        if self.classVar.varType == orange.VarTypes.Continuous:
+            DFVs = self.predictBatch(data)
+            if DFVs is None:
+                return None
+        elif len(self.classVar.values) == 2:
+            threadPolicy.applyThreadPolicy()
+            probOf1 = numpy.array([self.classifier.predict_prob(exampleCvMat,missingCvMat) for exampleCvMat,missingCvMat in self._iterBatchCvMats(data)])
+            if len(probOf1) != len(data):
+                return None
+            DFVs = -(probOf1-0.5)
+            self.nPredictions += len(DFVs)
+        else:
+            # No DFV for multi-class problems
+            return numpy.ones(len(data)) * numpy.nan
+        self._updateBatchDFVExtremes(DFVs)
+        return DFVs
+
+    def __probOf1ToBatchProbs(self, probOf1):
+        #Find the class value index represented by the scalar 1 in opencvRF
+        class1 = int(dataUtilities.CvMat2orangeResponse(1, self.classVar))
+        probs = self._newBatchProbs(len(probOf1))
+        probs[:,class1] = probOf1
+        probs[:,1-class1] = 1 - probOf1
+        return probs
+
+    def predictBatch(self, data, returnProbs = False):
+        """Predicts all the examples in the ExampleTable 'data' at once. See AZBaseClasses.AZClassifier.predictBatch
+           The data is fixed to the model domain, imputed and converted to one matrix once. Each row of that matrix
+           is then passed to the forest without any further conversion.
+           For binary classification the probabilities are the fraction of tree votes, obtained in the same pass
+           over the trees as the predicted class.
+        """
+        if data is None:
+            return None
+        threadPolicy.applyThreadPolicy()
+        isBinary = self.classVar.varType == orange.VarTypes.Discrete and len(self.classVar.values) == 2
+        values = []
+        probOf1 = []
+        for exampleCvMat, missingCvMat in self._iterBatchCvMats(data):
+            if isBinary:
+                prediction, p1 = self._predictBinary(exampleCvMat,missingCvMat)
+                probOf1.append(p1)
+            else:
+                prediction = dataUtilities.CvMat2orangeResponse(self.classifier.predict(exampleCvMat,missingCvMat), self.classVar)
+            values.append(self._value2float(prediction))
+        if len(values) != len(data):
+            return None
+        values = numpy.array(values, dtype = float)
+        self.nPredictions += len(values)
+        if not returnProbs:
+            return values
+        if isBinary:
+            probs = self.__probOf1ToBatchProbs(numpy.array(probOf1))
+            self._isRealProb = True
+        else:
+            probs = self._generateBatchProbs(values)
+        return (values, probs)
+
     def convert2DFV(self,probOf1):
         # Subtract 0.5 so that the threshold is 0 and invert the signal as all learners have standard DFV:
         # Positive Values for the first element of the class attributes, and negatove values to the second
@@ -536,6 +659,7 @@ class RFClassifier(AZBaseClasses.AZClassifier):
                 self._saveParameters(os.path.join(dirPath,"parameters.pkl"))
                 # Save the model
                 self.classifier.save(filePath)
+                self._writeManifest(dirPath)
         except:            
                 if self.verbose > 0: print "ERROR: Could not save model to ", path
                 return False
@@ -17,6 +17,9 @@
 #include <fstream>
 #include <sys/stat.h>
 #include <map>
+#include <vector>
+#include <cstring>
+#include <cstdlib>
 #include "PlsAPI.h"
 
 using namespace std;
@@ -36,6 +39,35 @@ string& strip(string& context)
 }
 
 
+vector<string> split(const string& context, char token)
+{
+    vector<string> fields;
+    string::size_type start = 0;
+    string::size_type pos;
+    while((pos = context.find(token, start)) != string::npos)
+    {
+        fields.push_back(context.substr(start, pos - start));
+        start = pos + 1;
+    }
+    fields.push_back(context.substr(start));
+    return fields;
+}
+
+
+//Returns true if the whole value is a number, as the values of the .amat files that are not mapped to strings
+bool isNumber(const string& value, real* number)
+{
+    if (value.empty())
+        return false;
+    char* end;
+    double parsed = strtod(value.c_str(), &end);
+    if (*end != '\0')
+        return false;
+    *number = parsed;
+    return true;
+}
+
+
 string& replaceAll(string& context, const string& from, const string& to)
 {
     size_t lookHere = 0;
@@ -203,6 +235,14 @@ bool PlsAPI::Train(string TrainFile)
     if (mVerbose) {time ( &rawtime ); cout<<ctime (&rawtime)<<"Time processing input data: "<<mWallFileProcessTime<<" seconds"<<endl;}
  
     //The Training 
+    TrainPredictor();
+    //Remove the temp directory if NOT in debug mode       
+    if(not mDEBUG) system(string(string("/bin/rm -rf ") + ScratchDir).c_str());
+    return mTrained;
+}
+
+bool PlsAPI::TrainPredictor()
+{
     mCPUTrainTime = clock();  
     mWallTrainTime = time(NULL); 
     try{
@@ -219,8 +259,6 @@ bool PlsAPI::Train(string TrainFile)
     {
         mCPUTrainTime =((double)clock() - mCPUTrainTime)/(double)CLOCKS_PER_SEC;
         mWallTrainTime =(double)time(NULL) - mWallTrainTime;
-        //Remove the temp directory if NOT in debug mode       
-        if(not mDEBUG) system(string(string("/bin/rm -rf ") + ScratchDir).c_str());
         mTrained=false;
         return false;
     }
@@ -228,12 +266,158 @@ bool PlsAPI::Train(string TrainFile)
     mCPUTrainTime =((double)clock() - mCPUTrainTime)/(double)CLOCKS_PER_SEC;
     mWallTrainTime =(double)time(NULL) - mWallTrainTime;
     if (mVerbose) {time ( &rawtime ); cout<<ctime (&rawtime)<<"Time training PLS: "<<mWallTrainTime<<" seconds"<<endl;}
-    //Remove the temp directory if NOT in debug mode       
-    if(not mDEBUG) system(string(string("/bin/rm -rf ") + ScratchDir).c_str());
     mTrained=Predictor.IsTrained();
     return mTrained;
 }
 
+bool PlsAPI::TrainBuffer(const char* Buffer, size_t BufferSize, int NCols, string VarNames, string VarValues)
+{
+    vector<string> names = split(VarNames, '\t');
+    vector<string> valueLines = split(VarValues, '\n');
+    if (NCols < 2 || (int)names.size() != NCols || (int)valueLines.size() != NCols || BufferSize % (NCols * sizeof(double)) != 0)
+    {
+        if (mVerbose) cout<<"ERROR: The train buffer does not match the number of variables"<<endl;
+        return false;
+    }
+    int NRows = BufferSize / (NCols * sizeof(double));
+    if (NRows < 1)
+        return false;
+
+    mOutSymbNum = 0;
+    //Free the memory used by last train if any
+    Predictor.forget();
+
+    //Copy the data to a PLearn matrix. The buffer is not assumed to be aligned for doubles
+    mWallFileProcessTime = (double)time(NULL);
+    Mat data(NRows, NCols);
+    for(int row=0; row<NRows; row++)
+        for(int col=0; col<NCols; col++)
+        {
+            double value;
+            memcpy(&value, Buffer + (row * NCols + col) * sizeof(double), sizeof(double));
+            data(row, col) = value;
+        }
+    mTrainMatrix = VMat(data);
+    TVec<string> fieldNames(NCols);
+    mVarNames = "";
+    for(int col=0; col<NCols; col++)
+    {
+        fieldNames[col] = names[col];
+        replaceAll(fieldNames[col], " ", "_");
+        mVarNames += fieldNames[col] + string("\t");
+    }
+    mTrainMatrix->declareFieldNames(fieldNames);
+    mTrainMatrix->defineSizes(NCols - 1, 1, 0);
+
+    //Map the value indexes of the discrete variables to PLearn string mappings the same way
+    //they are created when loading a file with the values: in order of appearance.
+    //As in the file, the numeric values of the discrete descriptors are kept as numbers, 
+    //and the class values are always mapped since they are written with the 'D' prefix
+    for(int col=0; col<NCols; col++)
+    {
+        if (fieldNames[col].at(0) != '#')
+            continue;
+        vector<string> values = split(valueLines[col], '\t');
+        for(int row=0; row<NRows; row++)
+        {
+            int idx = (int)data(row, col);
+            if (idx < 0 || idx >= (int)values.size())
+            {
+                if (mVerbose) cout<<"ERROR: Invalid value index "<<idx<<" in variable "<<fieldNames[col]<<endl;
+                mTrained = false;
+                return false;
+            }
+            string value = values[idx];
+            strip(value);
+            replaceAll(value, " ", "_nbsp_");
+            real code;
+            if (col == NCols - 1)
+                value = string("D") + value;
+            else if (isNumber(value, &code))
+            {
+                data(row, col) = code;
+                continue;
+            }
+            code = mTrainMatrix->getStringVal(col, value);
+            if (isnan(code))
+                code = mTrainMatrix->addStringMapping(col, value);
+            data(row, col) = code;
+        }
+    }
+    mWallFileProcessTime = (double)time(NULL) - mWallFileProcessTime;
+    if (mVerbose) {time ( &rawtime ); cout<<ctime (&rawtime)<<"Time processing input data: "<<mWallFileProcessTime<<" seconds"<<endl;}
+
+    return TrainPredictor();
+}
+
+string PlsAPI::RunBuffer(const char* Buffer, size_t BufferSize, string VarValues)
+{
+    if(!mTrained)
+        return string("");
+    int NCols = mTrainMatrix->inputsize();
+    vector<string> valueLines = split(VarValues, '\n');
+    if (NCols < 1 || (int)valueLines.size() != NCols + 1 || BufferSize % (NCols * sizeof(double)) != 0)
+        return string("");
+    int NRows = BufferSize / (NCols * sizeof(double));
+    bool categoricalOut = (mTrainMatrix.fieldName(NCols)).at(0)=='#';
+    vector<string> classValues = split(valueLines[NCols], '\t');
+
+    //The PLS codes of the values of each discrete descriptor
+    vector< vector<real> > codes(NCols);
+    for(int col=0; col<NCols; col++)
+    {
+        if ((mTrainMatrix.fieldName(col)).at(0) != '#')
+            continue;
+        vector<string> values = split(valueLines[col], '\t');
+        for(unsigned int idx=0; idx<values.size(); idx++)
+        {
+            string value = values[idx];
+            strip(value);
+            replaceAll(value, " ", "_nbsp_");
+            real code = mTrainMatrix->getStringVal(col, value);
+            codes[col].push_back(isnan(code) ? (real)atof(value.c_str()) : code);
+        }
+    }
+
+    Vec Vin(NCols);
+    Vec Vout(Predictor.outputsize());
+    vector<double> results(NRows, MISSING_VALUE);
+    for(int row=0; row<NRows; row++)
+    {
+        try{
+            for(int col=0; col<NCols; col++)
+            {
+                double value;
+                memcpy(&value, Buffer + (row * NCols + col) * sizeof(double), sizeof(double));
+                if (codes[col].size() > 0)
+                    Vin[col] = (value >= 0 && value < codes[col].size()) ? codes[col][(int)value] : MISSING_VALUE;
+                else
+                    Vin[col] = value;
+            }
+            Predictor.computeOutput(Vin,Vout);
+            real res = Vout[Vout.size()-1];
+            if(categoricalOut)
+            {
+                string OutputVector = CategoricalOutput(res);
+                replaceAll(OutputVector, "_nbsp_", " ");
+                for(unsigned int idx=0; idx<classValues.size(); idx++)
+                    if (classValues[idx] == OutputVector)
+                    {
+                        results[row] = idx;
+                        break;
+                    }
+            }
+            else
+                results[row] = res;
+        }
+        catch (...)
+        {
+            if (mVerbose) cout<<"ERROR: Error while running the PLS algorithm for example "<<row<<endl;
+        }
+    }
+    return string((const char*)&results[0], NRows * sizeof(double));
+}
+
 string PlsAPI::Run(string InputVector, char Token)
 {
     if(!mTrained)
@@ -288,43 +472,7 @@ string PlsAPI::Run(string InputVector, char Token)
         {
             if (mDEBUG) cout<<"Out is Categ."<<endl;
             //The output is Categorical (Classifier)
-            OutputVector = mTrainMatrix->getValString(mTrainMatrix->inputsize(),round(res));
-            if (OutputVector=="")
-            {
-                //cout<<"Res is out!!"<<endl;
-                try
-                {
-                    map<string, real>::iterator itIni;
-                    map<string, real>::iterator itEnd;
-                    map<string, real>::iterator it;
-                    map<string,real> the_map=mTrainMatrix->getStringToRealMapping(mTrainMatrix->inputsize());
-                    it = the_map.begin();
-                    itIni = the_map.begin();
-                    itEnd = the_map.begin();
-                    for(it++ ; it!=the_map.end(); it++ )
-                    {
-                        if(it->second<itIni->second)
-                            itIni=it;
-                        if(it->second>itEnd->second)
-                            itEnd=it;
-                    }                    
-                     if(mDEBUG) cout<<"Init: "<<itIni->first<<"-"<<itIni->second<<endl;
-                     if(mDEBUG) cout<<"End: "<<itEnd->first<<"-"<<itEnd->second<<flush<<endl;
-                     if(res < itIni->second)
-                        OutputVector =  itIni->first;
-                     else if(res > itEnd->second)
-                        OutputVector =  itEnd->first;
-                     else
-                        OutputVector = "ERROR: Unexpected error in iterator";
-                    if(mDEBUG) cout<<"Predicted: "<<res<<" -> "<<OutputVector<<endl;
-                }
-                catch(...)
-                {
-                    OutputVector = "ERROR: Could not resolve mapping";
-                }
-            }
-            if(OutputVector[0]=='D')
-                OutputVector=OutputVector.substr(1,OutputVector.length()-1);
+            OutputVector = CategoricalOutput(res);
         }
         else
         {
@@ -359,6 +507,48 @@ string PlsAPI::Run(string InputVector, char Token)
         return replaceAll(OutputVector,"_nbsp_"," ");
 }
 
+string PlsAPI::CategoricalOutput(real res)
+{
+    string OutputVector = mTrainMatrix->getValString(mTrainMatrix->inputsize(),round(res));
+    if (OutputVector=="")
+    {
+        //cout<<"Res is out!!"<<endl;
+        try
+        {
+            map<string, real>::iterator itIni;
+            map<string, real>::iterator itEnd;
+            map<string, real>::iterator it;
+            map<string,real> the_map=mTrainMatrix->getStringToRealMapping(mTrainMatrix->inputsize());
+            it = the_map.begin();
+            itIni = the_map.begin();
+            itEnd = the_map.begin();
+            for(it++ ; it!=the_map.end(); it++ )
+            {
+                if(it->second<itIni->second)
+                    itIni=it;
+                if(it->second>itEnd->second)
+                    itEnd=it;
+            }                    
+             if(mDEBUG) cout<<"Init: "<<itIni->first<<"-"<<itIni->second<<endl;
+             if(mDEBUG) cout<<"End: "<<itEnd->first<<"-"<<itEnd->second<<flush<<endl;
+             if(res < itIni->second)
+                OutputVector =  itIni->first;
+             else if(res > itEnd->second)
+                OutputVector =  itEnd->first;
+             else
+                OutputVector = "ERROR: Unexpected error in iterator";
+            if(mDEBUG) cout<<"Predicted: "<<res<<" -> "<<OutputVector<<endl;
+        }
+        catch(...)
+        {
+            OutputVector = "ERROR: Could not resolve mapping";
+        }
+    }
+    if(OutputVector[0]=='D')
+        OutputVector=OutputVector.substr(1,OutputVector.length()-1);
+    return OutputVector;
+}
+
 bool PlsAPI::LoadPLSModel(string PLSModelDirPath)
 {
     mCPUTrainTime = clock();
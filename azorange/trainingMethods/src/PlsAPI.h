@@ -104,6 +104,48 @@ public:
     *description, it can also return "nan", "inf" or "-inf" in value field.
     */
     string Run(string InputVector, char Token = ' ');
+
+    /** Train the PLS algorithm from data in memory.
+    *
+    *@param Buffer The train data as a contiguous row major buffer of doubles,
+    *one row per example and one column per variable, being the class
+    *variable the last column. Discrete variables hold the index of the value
+    *in the list of values of the variable (see VarValues).
+    *
+    *@param BufferSize The size of Buffer in bytes.
+    *
+    *@param NCols The number of columns (variables) of the data.
+    *
+    *@param VarNames A tab separated string with the names of the variables,
+    *the discrete variables are preceded by the char '#'
+    *
+    *@param VarValues The values of the discrete variables: one line per 
+    *variable (separated by '\n') with the tab separated values. The lines 
+    *of the continuous variables are empty.
+    *
+    *@return True if the train was successful or false if it failed.
+    */
+    bool TrainBuffer(const char* Buffer, size_t BufferSize, int NCols, string VarNames, string VarValues);
+
+    /** Run the PLS algorithm for all the examples in a buffer.
+    *
+    *@param Buffer The input vectors as a contiguous row major buffer of 
+    *doubles, one row per example and one column per descriptor used to 
+    *train the model. Discrete descriptors hold the index of the value in 
+    *the list of values of the descriptor (see VarValues).
+    *
+    *@param BufferSize The size of Buffer in bytes.
+    *
+    *@param VarValues The values of the discrete descriptors and the class,
+    *in the same format as in TrainBuffer, being the class the last line.
+    *
+    *@return A buffer of doubles with one predicted value per example: the 
+    *predicted value for regression models or the index of the predicted 
+    *value in the class values for classification models. The examples that 
+    *could not be predicted are set to NaN. An empty buffer is returned if 
+    *the PLS is not trained or the input buffer has a wrong size.
+    */
+    string RunBuffer(const char* Buffer, size_t BufferSize, string VarValues);
     
     /** Load a PLS model from a file.
     *
@@ -249,6 +291,21 @@ protected:
     */
     bool IsFile(string Path);
 
+    /** Train the PLS with the data in mTrainMatrix.
+    *
+    *@return True if the train was successful or false if it failed.
+    */
+    bool TrainPredictor();
+
+    /** Converts the output of the PLS to the class value it represents.
+    *
+    *@param res The output of the PLS for a categorical class.
+    *
+    *@return The class value or a string starting with "ERROR" if it could
+    *not be resolved.
+    */
+    string CategoricalOutput(real res);
+
 private:
     bool mVerbose;          //flag for verbosity on stdout
     bool mDEBUG;            //flag for DEBUG proposes
@@ -6,4 +6,6 @@
 
 %include "PLS.h"
 %include "std_string.i"
+/* The data buffers of TrainBuffer and RunBuffer are passed as python strings */
+%apply (char *STRING, size_t LENGTH) { (const char* Buffer, size_t BufferSize) };
 %include "PlsAPI.h"
@@ -28,7 +28,7 @@ class OWCombiQSAR(OWWidget):
         self.inputs = [("Classified Examples", ExampleTable, self.setData)]
         self.outputs = [("Classifier", orange.Classifier), ("Examples", ExampleTable)]
 
-        self.queueTypes = ["NoSGE","batch.q","quick.q"] 
+        self.queueTypes = ["NoSGE","batch.q","quick.q","Local"] 
         self.outputModes = ["Model and statistics for all available algorithms (with model selection).", "Model and statistics (unbiased wrt model selection). Please note, time consuming."]
         self.name = name
 	self.dataset = None
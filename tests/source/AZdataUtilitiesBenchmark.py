@@ -0,0 +1,125 @@
+"""
+Benchmarks for dataUtilities procedures that are in the hot path of the training methods.
+This is not part of the test suite. Run it with:
+    python AZdataUtilitiesBenchmark.py [nAttrs]
+"""
+import sys
+import os
+import time
+import random
+
+import orange
+from opencv import cv
+from AZutilities import dataUtilities
+from AZutilities import miscUtilities
+
+SIZES = [1000, 10000, 100000]
+
+
+def createData(nEx, nAttrs, missingFrac = 0.05, seed = 1):
+    """Creates a random dataset with nAttrs continuous attributes and a binary class"""
+    random.seed(seed)
+    attrs = [orange.FloatVariable("Desc_"+str(idx)) for idx in range(nAttrs)]
+    classVar = orange.EnumVariable("Activity", values = ["POS","NEG"])
+    domain = orange.Domain(attrs, classVar)
+    data = dataUtilities.DataTable(domain)
+    for idx in xrange(nEx):
+        values = [random.random() > missingFrac and random.gauss(0,1) or "?" for a in attrs]
+        data.append(orange.Example(domain, values + [random.choice(["POS","NEG"])]))
+    return data
+
+
+def perCellExampleTable2CvMat(data):
+    """The cell by cell conversion used before the bulk conversion, kept here as reference."""
+    matrix = cv.cvCreateMat(len(data),len(data.domain.attributes),cv.CV_32FC1)
+    numPyData = data.toNumpyMA()
+    lenVars = range(len(data.domain.attributes))
+    if data.hasMissingValues():
+        mask = cv.cvCreateMat(len(data),len(data.domain.attributes),cv.CV_8UC1)
+        cv.cvSetZero(mask)
+        missing_data_mask = numPyData[0].mask
+        for idxEx,ex in enumerate(numPyData[0]):
+            for idx in lenVars:
+                if missing_data_mask[idxEx][idx]:
+                    cv.cvSet2D(mask,idxEx,idx,1)
+                else:
+                    cv.cvmSet(matrix,idxEx,idx,ex[idx])
+    else:
+        for idxEx,ex in enumerate(numPyData[0]):
+            for idx in lenVars:
+                cv.cvmSet(matrix,idxEx,idx,ex[idx])
+    return matrix
+
+
+def timeIt(function, *args):
+    start = time.time()
+    function(*args)
+    return max(time.time() - start, 1e-6)
+
+
+def benchExampleTable2CvMat(nAttrs = 100):
+    print "ExampleTable2CvMat with %d attributes" % nAttrs
+    print "%10s %20s %20s %10s" % ("nEx", "per-cell (rows/s)", "bulk (rows/s)", "speedup")
+    for nEx in SIZES:
+        data = createData(nEx, nAttrs)
+        tOld = timeIt(perCellExampleTable2CvMat, data)
+        tNew = timeIt(dataUtilities.ExampleTable2CvMat, data)
+        print "%10d %20.1f %20.1f %10.1f" % (nEx, nEx/tOld, nEx/tNew, tOld/tNew)
+
+
+def quadraticSeedDataSampler(data, nFolds):
+    """The SeedDataSampler that scanned all the examples for each pick, kept here as reference."""
+    nEx = len(data)
+    nTestEx = int(nEx/nFolds)
+    usedReg = [0] * nEx
+    foldsIdxs = [0] * nEx
+    random.seed(nEx + nFolds + len(data.domain.attributes))
+    for idx in range(nFolds):
+        for x in range(nTestEx):
+            Zidx = int(random.random() * (usedReg.count(0) - 1))
+            realIdx = [idxReg[0] for idxReg in enumerate(usedReg) if idxReg[1]==0][Zidx]
+            usedReg[realIdx] = 1
+            foldsIdxs[realIdx] = idx + 1
+    return foldsIdxs
+
+
+def benchSeedDataSampler(nFolds = 10):
+    print "SeedDataSampler with %d folds" % nFolds
+    print "%10s %20s %20s %20s" % ("nEx", "quadratic (s)", "version 1 (s)", "version 2 (s)")
+    for nEx in [1000, 10000, 100000, 1000000]:
+        data = createData(nEx, 1, 0)
+        # The reference sampler takes hours above 100000 examples
+        if nEx <= 10000:
+            tOld = "%20.3f" % timeIt(quadraticSeedDataSampler, data, nFolds)
+            if quadraticSeedDataSampler(data, nFolds) != dataUtilities.SeedDataSampler(data, nFolds):
+                print "ERROR: Different folds from the reference sampler"
+        else:
+            tOld = "%20s" % "-"
+        tV1 = timeIt(dataUtilities.SeedDataSampler, data, nFolds)
+        tV2 = timeIt(dataUtilities.SeedDataSampler, data, nFolds, 2)
+        print "%10d %s %20.3f %20.3f" % (nEx, tOld, tV1, tV2)
+
+
+def benchColumnar(nAttrs = 100):
+    print "Loading %d attributes from the .tab and the columnar format" % nAttrs
+    print "%10s %20s %20s %10s" % ("nEx", ".tab (rows/s)", "columnar (rows/s)", "speedup")
+    scratchdir = miscUtilities.createScratchDir(desc="ColumnarBenchmark")
+    for nEx in SIZES:
+        data = createData(nEx, nAttrs)
+        tabPath = os.path.join(scratchdir, "data"+str(nEx)+".tab")
+        columnarPath = os.path.join(scratchdir, "data"+str(nEx)+".columnar")
+        data.save(tabPath)
+        dataUtilities.saveColumnar(data, columnarPath)
+        tTab = timeIt(dataUtilities.DataTable, tabPath)
+        tColumnar = timeIt(dataUtilities.DataTable, columnarPath)
+        print "%10d %20.1f %20.1f %10.1f" % (nEx, nEx/tTab, nEx/tColumnar, tTab/tColumnar)
+    miscUtilities.removeDir(scratchdir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        benchExampleTable2CvMat(int(sys.argv[1]))
+    else:
+        benchExampleTable2CvMat()
+    benchSeedDataSampler()
+    benchColumnar()
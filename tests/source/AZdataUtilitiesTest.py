@@ -6,6 +6,7 @@ import unittest
 import orange
 from trainingMethods import AZorngPLS
 from AZutilities import dataUtilities
+from AZutilities import miscUtilities
 import AZOrangeConfig as AZOC
 
 
@@ -263,6 +264,47 @@ class dataUtilitiesTest(unittest.TestCase):
                     self.assertEqual(int(res[idx][attr.name]),int(ex[attr.name]),"D1p22: Examples values do not match")
 
 
+    def test_columnar(self):
+        """Test the save and load round trip of the columnar binary format"""
+        scratchdir = miscUtilities.createScratchDir(desc="columnarTest")
+        for idx, data in enumerate([self.wMetaData, self.missValsData, self.multiClassData]):
+            path = os.path.join(scratchdir, "data"+str(idx)+".azc")
+            self.assertEqual(dataUtilities.saveColumnar(data, path), path)
+            self.assert_(dataUtilities.isColumnar(path))
+            loaded = dataUtilities.DataTable(path)
+            self.assertEqual([attr.name for attr in loaded.domain], [attr.name for attr in data.domain])
+            self.assertEqual(sorted([attr.name for attr in loaded.domain.getmetas().values()]), \
+                             sorted([attr.name for attr in data.domain.getmetas().values()]))
+            self.assertEqual(len(loaded), len(data))
+            for exLoaded, ex in zip(loaded, data):
+                for attr in data.domain:
+                    if ex[attr].isSpecial():
+                        self.assert_(exLoaded[attr.name].isSpecial())
+                    else:
+                        self.assertEqual(str(exLoaded[attr.name]), str(ex[attr]))
+                for attr in data.domain.getmetas().values():
+                    self.assertEqual(str(exLoaded[attr.name]), str(ex[attr]))
+
+            # Memory-mapped numeric matrix
+            arrays = dataUtilities.loadColumnarArrays(path)
+            numAttrs = [attr for attr in data.domain.attributes if attr.varType != orange.VarTypes.String]
+            self.assertEqual(arrays["attributes"].shape, (len(data), len(numAttrs)))
+            self.assertEqual(arrays["varNames"], [attr.name for attr in numAttrs])
+            self.assertEqual(len(arrays["class"]), len(data))
+
+        # Non-ASCII discrete values and strings, and a string attribute between the numeric ones
+        domain = orange.Domain([orange.FloatVariable("X"), orange.StringVariable("Name"), \
+                                orange.EnumVariable("Site", values = ["Malm\xc3\xb6", "Lund"])], None)
+        data = dataUtilities.DataTable(domain, [[1.5, "Caf\xc3\xa9", "Malm\xc3\xb6"], ["?", "Lund", "Lund"]])
+        path = os.path.join(scratchdir, "nonASCII.azc")
+        self.assertEqual(dataUtilities.saveColumnar(data, path), path)
+        loaded = dataUtilities.DataTable(path)
+        self.assertEqual(list(loaded.domain["Site"].values), list(domain["Site"].values))
+        self.assertEqual([[str(val) for val in ex] for ex in loaded], [[str(val) for val in ex] for ex in data])
+        miscUtilities.removeDir(scratchdir)
+        self.assertEqual(dataUtilities.loadColumnarArrays(scratchdir), None)
+
+
     def test_concatenate(self):
         """ Test the concatenate functionality"""
         #Avtivity = NEG; Attrs: 1,2,3,6,4; attr3=Discrete
@@ -301,6 +343,50 @@ class dataUtilitiesTest(unittest.TestCase):
             for attr in res[0][idx].domain:
                 self.assertEqual(res[0][idx][attr.name],ex[attr.name],"C3: Examples values do not match")
 
+    def test_ExampleTable2CvMat(self):
+        """Test the bulk conversion of an ExampleTable to CvMat objects"""
+        # Data with missing values
+        CvMatrices = dataUtilities.ExampleTable2CvMat(self.missValsData)
+        self.assertEqual(CvMatrices["varNames"], [attr.name for attr in self.missValsData.domain.attributes])
+        self.assertEqual(CvMatrices["matrix"].rows, len(self.missValsData))
+        self.assertEqual(CvMatrices["matrix"].cols, len(self.missValsData.domain.attributes))
+        self.assert_(CvMatrices["missing_data_mask"] is not None)
+        for idxEx,ex in enumerate(self.missValsData):
+            for idx in range(len(self.missValsData.domain.attributes)):
+                if ex[idx].isSpecial():
+                    self.assertEqual(CvMatrices["missing_data_mask"][idxEx,idx], 1)
+                else:
+                    self.assertEqual(CvMatrices["missing_data_mask"][idxEx,idx], 0)
+                    self.assertAlmostEqual(CvMatrices["matrix"][idxEx,idx], float(ex[idx]), 5)
+            if not ex.getclass().isSpecial():
+                self.assertEqual(CvMatrices["responses"][idxEx,0], int(ex.getclass()))
+
+        # Data without missing values and unfolded class
+        CvMatrices = dataUtilities.ExampleTable2CvMat(self.multiClassData, True)
+        self.assertEqual(CvMatrices["missing_data_mask"], None)
+        self.assertEqual(CvMatrices["missing_res_mask"], None)
+        self.assertEqual(CvMatrices["responses"].cols, len(self.multiClassData.domain.classVar.values))
+        for idxEx,ex in enumerate(self.multiClassData):
+            for idx in range(len(self.multiClassData.domain.attributes)):
+                self.assertAlmostEqual(CvMatrices["matrix"][idxEx,idx], float(ex[idx]), 5)
+            for idxVal in range(CvMatrices["responses"].cols):
+                self.assertEqual(CvMatrices["responses"][idxEx,idxVal], int(idxVal == int(ex.getclass())))
+
+
+    def test_SeedDataSampler(self):
+        """Test the fold indices of the SeedDataSampler"""
+        # The original sampling of the iris data (150 examples) in 5 folds
+        foldsIdxs = dataUtilities.SeedDataSampler(self.multiClassData, 5)
+        self.assertEqual(foldsIdxs[:20], [2, 5, 1, 5, 1, 1, 3, 4, 3, 3, 2, 2, 2, 3, 1, 2, 5, 5, 4, 3])
+        for version in (1, 2):
+            foldsIdxs = dataUtilities.SeedDataSampler(self.multiClassData, 7, version)
+            self.assertEqual(foldsIdxs, dataUtilities.SeedDataSampler(self.multiClassData, 7, version))
+            self.assertEqual(len(foldsIdxs), 150)
+            # 150/7 = 21 examples in each test fold and 3 never used in a test fold
+            self.assertEqual([foldsIdxs.count(fold) for fold in range(8)], [3] + [21]*7)
+        self.assertEqual(dataUtilities.SeedDataSampler(self.multiClassData, 200), None)
+
+
     def test_Duplicates_and_Same_Attr(self):
         """Test Duplicates and Same attributes fix"""
         data = orange.ExampleTable(os.path.join(AZOC.AZORANGEHOME,"tests/source/data/DupAndSameVars.tab"))
@@ -321,6 +407,55 @@ class dataUtilitiesTest(unittest.TestCase):
         self.assertEqual(str(data.domain),"[SEIMLS_1_1, MNOLAME, number, ACDC, window, nonSel, winter, bio, specif, SEIMLS_1, Activity]","Wrong attribute names: "+str(data.domain))
 
 
+    def test_DataChunkReader(self):
+        """Test the reading of files in chunks with the same domain"""
+        smiPath = os.path.join(AZOC.AZORANGEHOME,"tests/source/data/sample.smi")
+        SMIdata = dataUtilities.loadSMI(smiPath)
+        reader = dataUtilities.DataChunkReader(smiPath, 1000)
+        self.assertEqual(reader.nEx, 2500)
+        self.assertEqual(str(reader.domain),"[SMILES, MOLNAME]")
+        chunks = [chunk for chunk in reader]
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 500])
+        for idx, chunk in enumerate(chunks):
+            self.assert_(chunk.domain is reader.domain)
+            for idxEx, ex in enumerate(chunk):
+                for attr in chunk.domain:
+                    self.assertEqual(str(ex[attr]), str(SMIdata[idx*1000+idxEx][attr.name]))
+
+        tabPath = os.path.join(AZOC.AZORANGEHOME,"tests/source/data/BinClass_No_metas_SmallTest.tab")
+        reader = dataUtilities.DataChunkReader(tabPath, 7)
+        self.assertEqual(reader.nEx, len(self.testData))
+        self.assertEqual([attr.name for attr in reader.domain], [attr.name for attr in self.testData.domain])
+        self.assertEqual(reader.domain.classVar.name, self.testData.domain.classVar.name)
+        readData = [ex for chunk in reader for ex in chunk]
+        self.assertEqual(len(readData), len(self.testData))
+        for exRead, ex in zip(readData, self.testData):
+            for attr in self.testData.domain:
+                if ex[attr].isSpecial():
+                    self.assert_(exRead[attr.name].isSpecial())
+                elif attr.varType == orange.VarTypes.Continuous:
+                    self.assertAlmostEqual(float(exRead[attr.name]), float(ex[attr]), 4)
+                else:
+                    self.assertEqual(str(exRead[attr.name]), str(ex[attr]))
+
+        # The names are fixed as when loading the whole file
+        scratchdir = miscUtilities.createScratchDir(desc="DataChunkReaderNames")
+        txtPath = os.path.join(scratchdir, "names.txt")
+        fileh = open(txtPath, "w")
+        fileh.write("Conc_"+chr(181)+"M\t\tDesc\tDesc\t\tActivity\n")
+        for idx in range(5):
+            fileh.write("\t".join([str(idx + x) for x in range(5)] + [str(idx % 2)]) + "\n")
+        fileh.close()
+        reader = dataUtilities.DataChunkReader(txtPath, 2)
+        data = dataUtilities.DataTable(txtPath)
+        self.assertEqual([attr.name for attr in reader.domain], [attr.name for attr in data.domain])
+        self.assertEqual(reader.domain[0].name, "Conc_uM")
+        self.assertEqual(reader.unnamedFixedVars, data.unnamedFixedVars)
+        self.assertEqual(reader.duplicatedFixedVars, data.duplicatedFixedVars)
+        self.assertEqual(len([ex for chunk in reader for ex in chunk]), 5)
+        miscUtilities.removeDir(scratchdir)
+
+
     def test_SMI(self):
         """Test loader os SMI files"""
         SMIdata = dataUtilities.loadSMI(os.path.join(AZOC.AZORANGEHOME,"tests/source/data/sample.smi"))
@@ -692,6 +827,50 @@ class dataUtilitiesTest(unittest.TestCase):
         self.assert_(ExampleFix.fixExample(exKO)[1]=='?',"BadVarType: It shouldn't be able to do this convertion!")
         self.assert_(ExampleFix.fixExample(exKO2)==None,"BadVarName: It shouldn't be able to do this convertion!")
         self.assert_(ExampleFix.fixExample(exKO3)==None,"BadVarCount: It shouldn't be able to do this convertion!")
+
+    def test_ExFixTable(self):
+        """Test the fix of a whole table with the compiled domain map against the fix of each example"""
+        for data in [self.badVarOrderData, self.badVarTypeData, self.badVarType2Data]:
+            exLog = {}
+            ExampleFix = dataUtilities.ExFix(self.testData.domain, exLog, True)
+            fixedEx = [str(ExampleFix.fixExample(ex)) for ex in data]
+            tableLog = {}
+            TableFix = dataUtilities.ExFix(self.testData.domain, tableLog, True)
+            fixedTable = TableFix.fixTable(data)
+            self.assert_(fixedTable.domain is self.testData.domain)
+            self.assertEqual([str(ex) for ex in fixedTable], fixedEx)
+            self.assertEqual(tableLog, exLog)
+            # The compiled map is reused for the same pair of domains
+            self.assert_(TableFix.compileDomainMap(data.domain) is TableFix.compileDomainMap(data.domain))
+            matrix = TableFix.fixMatrix(fixedTable.toNumpyMA()[0], fixedTable.domain)
+            self.assertEqual(matrix.shape, (len(data), len(self.testData.domain)))
+
+        self.assert_(TableFix.fixTable(self.testData) is self.testData)
+        # The class is not fixed by default
+        fixedTable = dataUtilities.ExFix(self.testData.domain).fixTable(self.badVarOrderData)
+        self.assertEqual(fixedTable[0].getclass().isSpecial(), True)
+        # Missing attributes
+        domain = orange.Domain(self.testData.domain.attributes[1:], self.testData.domain.classVar)
+        missingData = dataUtilities.DataTable(domain, self.testData)
+        tableLog = {}
+        self.assertEqual(dataUtilities.ExFix(self.testData.domain, tableLog).fixTable(missingData), None)
+        exLog = {}
+        self.assertEqual(dataUtilities.ExFix(self.testData.domain, exLog).fixExample(missingData[0]), None)
+        self.assertEqual(tableLog, {"Missing Attributes": {self.testData.domain.attributes[0].name: 1}})
+        self.assertEqual(tableLog, exLog)
+
+    def test_ExFixTableNewValues(self):
+        """Test the fix of tables whose discrete variable got new values after the domain map was compiled"""
+        srcVar = orange.EnumVariable("D", values = ["a", "b"])
+        srcDomain = orange.Domain([srcVar, orange.FloatVariable("X")], None)
+        domain = orange.Domain([orange.EnumVariable("D", values = ["b", "a", "c"]), orange.FloatVariable("X")], None)
+        TableFix = dataUtilities.ExFix(domain, None, True)
+        fixedTable = TableFix.fixTable(dataUtilities.DataTable(srcDomain, [["a", 1.0], ["b", 2.0]]))
+        self.assertEqual([(ex["D"].value, float(ex["X"])) for ex in fixedTable], [("a", 1.0), ("b", 2.0)])
+        # As done by DataChunkReader between chunks
+        srcVar.addValue("c")
+        fixedTable = TableFix.fixTable(dataUtilities.DataTable(srcDomain, [["c", 3.0], ["a", 4.0]]))
+        self.assertEqual([(ex["D"].value, float(ex["X"])) for ex in fixedTable], [("c", 3.0), ("a", 4.0)])
     def test_rmAllExMeta(self):
         """Test the remove of all meta attributes in one single example"""
         ex = self.wMetaData[0] 
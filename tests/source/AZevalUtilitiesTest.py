@@ -50,6 +50,69 @@ class evalUtilitiesTest(unittest.TestCase):
                 self.assert_(abs(MD1[idx][d]-x[d]) < 0.00001, "MD1: idx "+str(idx) +"    diff = "+str(MD1[idx][d]-x[d]))
 
 
+    def testMahalanobisBatch(self):
+        """Test that the batch distances are the same as the ones calculated for each example"""
+        from AZutilities import Mahalanobis
+        trainingSet = similarityMetrics.getTrainingSet(self.trainData)
+        calculator = Mahalanobis.MahalanobisDistanceCalculator(trainingSet)
+        descriptorMatrix = similarityMetrics.getDescriptorMatrix(self.testData, trainingSet.descr_names)
+        batchMD = calculator.calculateBatchDistances(descriptorMatrix, 3, chunkSize = 4)
+        self.assertEqual(len(batchMD), len(self.testData))
+        for idx, descriptorValues in enumerate(descriptorMatrix):
+            MD = calculator.calculateDistances(list(descriptorValues), 3)
+            self.assertEqual(sorted(MD.keys()), sorted(batchMD[idx].keys()))
+            for key in ["_MD",'_train_dist_near1','_train_dist_near2','_train_dist_near3','_train_av3nearest']:
+                self.assert_(abs(MD[key] - batchMD[idx][key]) < 0.00001, "idx "+str(idx)+" "+key+": "+str(MD[key])+" != "+str(batchMD[idx][key]))
+
+
+    def testFingerprintStore(self):
+        """Test that the bulk Tanimoto similarities of the FingerprintStore are the same as the ones of tanimotoSimilarity"""
+        import random
+        from AZutilities import FingerprintStore
+        random.seed(42)
+        fps = ["".join([random.choice("0001") for b in range(2048)]) for idx in range(50)]
+        fps.append("0"*2048)
+        queries = fps[:3] + ["".join([random.choice("01") for b in range(2048)])]
+        store = FingerprintStore.FingerprintStore(fps)
+        self.assertEqual(len(store), len(fps))
+        simMatrix = store.tanimotoMatrix(queries, chunkSize = 3)
+        for qIdx, query in enumerate(queries):
+            sims = store.tanimoto(query)
+            for idx, fp in enumerate(fps):
+                expected = evalUtilities.tanimotoSimilarity(query, fp)
+                self.assert_(abs(sims[idx] - expected) < 1e-10, "tanimoto "+str(qIdx)+","+str(idx)+": "+str(sims[idx])+" != "+str(expected))
+                self.assert_(abs(simMatrix[qIdx][idx] - expected) < 1e-10, "tanimotoMatrix "+str(qIdx)+","+str(idx))
+            top = store.nearest(query, 5)
+            self.assertEqual(len(top), 5)
+            self.assertEqual([round(sim, 10) for i, sim in top], [round(sim, 10) for sim in sorted(sims, reverse = True)[:5]])
+        # The same fingerprint given as a long integer
+        self.assertEqual(store.nearest(long(fps[1], 2), 1)[0], (1, 1.0))
+        self.assertEqual(store.nearest(fps[0], 1), store.nearestMatrix([fps[0]], 1)[0])
+
+
+    def testNearestNeighbors(self):
+        """Test the search of the nearest neighbors in a fingerprint file in the text format"""
+        NNDataPath = os.path.join(AZOC.AZORANGEHOME,"tests/source/data/NN_Data.txt")
+        FPPath = os.path.join(AZOC.AZORANGEHOME,"tests/source/data/NN_Fingerprints.txt")
+        res = evalUtilities.getNearestNeighbors("1100110000111001", 4, NNDataPath, FPPath)
+        self.assertEqual([nn["id"] for nn in res], ["NN001", "NN005", "NN002", "NN003"])
+        self.assertEqual([nn["similarity"] for nn in res], ["0.8750", "0.7500", "0.3333", "0.3333"])
+        self.assertEqual([nn["expVal"] for nn in res], ["3.48", "0.33", "1.25", "2.7"])
+        self.assertEqual(res[1]["smi"], "CN1CCC[C@H]1c1cccnc1")
+        self.assertEqual([nn["imgPath"] for nn in res], [""]*4)
+        for nn in res:
+            self.assertEqual(float(nn["similarity"]), round(evalUtilities.tanimotoSimilarity("1100110000111001", \
+                    open(FPPath).readlines()[int(nn["id"][2:])-1].strip()), 4))
+        # Files not in the text format, or not aligned with the data rows, are left to the fpin tool
+        self.assertEqual(evalUtilities.getFingerprintStore(NNDataPath, NNDataPath), (None, None))
+        self.assertEqual(evalUtilities.getFingerprintStore(FPPath, FPPath), (None, None))
+        self.assert_((FPPath, FPPath) in evalUtilities._fpStores)
+        self.assertEqual(evalUtilities.getFingerprintStore(FPPath, FPPath), (None, None))
+        store, rows = evalUtilities.getFingerprintStore(FPPath, NNDataPath)
+        self.assertEqual(len(store), 6)
+        self.assertEqual(rows[0], ["CCO", "NN001", "2009-12-02", "3.480007"])
+
+
     def test_VarCtrlVal(self):
         """Test of Variable Control Validation"""
         data = dataUtilities.DataTable(os.path.join(AZOC.AZORANGEHOME,"tests/source/data/iris_W_dataOrigin.tab"))
@@ -21,6 +21,46 @@ class evalUtilitiesTest(unittest.TestCase):
         resD = getCinfonyDesc.getCinfonyDescResults(self.smiData,descs)
         self.assertEqual(len(resD),len(self.smiData))
 
+
+    def test_descCache(self):
+        """Test that the descriptors retrieved from the cache are the same as the calculated ones"""
+        from AZutilities import descCache
+        from AZutilities import miscUtilities
+        cacheDir = miscUtilities.createScratchDir(desc = "descCacheTest")
+        getCinfonyDesc._descCache = descCache.DescCache(os.path.join(cacheDir, "descCache.sqlite"))
+        descs = ["rdk.TPSA","rdk.Chi0n","rdk.MolWt","rdk.FingerPrints"]
+        try:
+            noCache = getCinfonyDesc.getCinfonyDescResults(self.smiData, descs, useCache = False)
+            firstRun = getCinfonyDesc.getCinfonyDescResults(self.smiData, descs)
+            cachedRun = getCinfonyDesc.getCinfonyDescResults(self.smiData, descs)
+        finally:
+            getCinfonyDesc._descCache = None
+            miscUtilities.removeDir(cacheDir)
+        for resD in [firstRun, cachedRun]:
+            self.assertEqual([attr.name for attr in resD.domain], [attr.name for attr in noCache.domain])
+            self.assertEqual(len(resD), len(noCache))
+            for idx in range(len(noCache)):
+                self.assertEqual(str(resD[idx]), str(noCache[idx]))
+
+
+    def test_descCacheForked(self):
+        """Test that the descriptors cache opens a new connection when used by a forked process"""
+        from AZutilities import descCache
+        from AZutilities import miscUtilities
+        cacheDir = miscUtilities.createScratchDir(desc = "descCacheTest")
+        try:
+            cache = descCache.DescCache(os.path.join(cacheDir, "descCache.sqlite"))
+            self.assertEqual(cache.getDescs(["CCC"], "test", "1", ["len"], len), {"CCC": 3})
+            pid = os.fork()
+            if pid == 0:
+                # The child uses the cache opened by the parent
+                res = cache.getDescs(["CCC", "CCCC"], "test", "1", ["len"], lambda smi: None)
+                os._exit(int(res != {"CCC": 3, "CCCC": None} or cache.pid != os.getpid()))
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+            self.assertEqual(cache.getDescs(["CCC"], "test", "1", ["len"], lambda smi: None), {"CCC": 3})
+        finally:
+            miscUtilities.removeDir(cacheDir)
+
         
     def test_webel(self):
         from cinfony import webel
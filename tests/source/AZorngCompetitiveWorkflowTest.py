@@ -6,6 +6,25 @@ import time
 import AZOrangeConfig as AZOC
 import AZorngTestUtil
 import pprint
+import signal
+from AZutilities import miscUtilities
+
+
+def _poolTask(task):
+    """Task for runInLocalPool that fails the first time it runs, raising an exception or killing its worker"""
+    kind, markerFile = task
+    if kind != "ok" and not os.path.isfile(markerFile):
+        open(markerFile, "w").close()
+        if kind == "raise":
+            raise ValueError("Task failing on purpose")
+        os.kill(os.getpid(), signal.SIGSEGV)
+    return kind + str(miscUtilities.getLocalPoolArgs())
+
+def _nestedPoolTask(task):
+    """Task for runInLocalPool that runs its own local pool from the worker process"""
+    args = miscUtilities.getLocalPoolArgs()
+    res = miscUtilities.runInLocalPool(_poolTask, [("ok", None)] * task, 2, args = task)
+    return (res, miscUtilities.getLocalPoolArgs() == args)
 
 class competitiveWFTest(AZorngTestUtil.AZorngTestUtil):
 
@@ -50,6 +69,54 @@ class competitiveWFTest(AZorngTestUtil.AZorngTestUtil):
         self.assert_(res["statistics"]["selectedML"]["Q2"] > 0 )
 
 
+    def testClass_Local(self):
+        """Test classification with the folds running in the local process pool
+        """
+        res = competitiveWorkflow.competitiveWorkflow(self.Dtrain_data, queueType = "Local")
+        print "Results :  ",res
+        self.assert_("statistics" in res)
+        self.assert_("model" in res)
+        self.assert_("selectedML" in res["statistics"])
+        self.assert_(res["model"][res["model"].keys()[0]] is not None)
+        self.assertEqual(res["statistics"]["selectedML"]["responseType"], "Classification")
+        self.assert_(res["statistics"]["selectedML"]["CA"] > 0 )
+
+    def testLocalPoolFailures(self):
+        """Test that the local pool reports and restarts the tasks that raise or whose worker dies
+        """
+        scratchdir = miscUtilities.createScratchDir(desc="competitiveWFTest")
+        tasks = [(kind, os.path.join(scratchdir, kind+str(idx))) for idx, kind in enumerate(["ok", "raise", "segfault", "ok"])]
+        # Without restarts the failed tasks get the result of onError
+        errors = []
+        def onError(task, error):
+            errors.append(task)
+            return "failed"
+        res = miscUtilities.runInLocalPool(_poolTask, tasks, 2, args = 1, onError = onError)
+        self.assertEqual(res, ["ok1", "failed", "failed", "ok1"])
+        self.assertEqual(sorted(errors), sorted(tasks[1:3]))
+        # With restarts they run again, and succeed since their marker file exists 
+        for task in tasks:
+            if os.path.isfile(task[1]):
+                os.remove(task[1])
+        restarts = []
+        done = []
+        res = miscUtilities.runInLocalPool(_poolTask, tasks, 2, args = 2, maxRestarts = 1, \
+                onRestart = lambda idx, result, n: restarts.append(idx), onResult = lambda idx, result, nDone: done.append(nDone))
+        self.assertEqual(res, ["ok2", "raise2", "segfault2", "ok2"])
+        self.assertEqual(sorted(restarts), [1, 2])
+        self.assertEqual(done, [1, 2, 3, 4])
+        # onResult stops the pool
+        res = miscUtilities.runInLocalPool(_poolTask, tasks, 2, onResult = lambda idx, result, nDone: False)
+        self.assertEqual(res, None)
+        miscUtilities.removeDir(scratchdir)
+
+    def testNestedLocalPool(self):
+        """Test that a task of the local pool can use a local pool, running its tasks serially in the worker
+        """
+        res = miscUtilities.runInLocalPool(_nestedPoolTask, [1, 2, 3], 2, args = "outer")
+        self.assertEqual(res, [(["ok1"], True), (["ok2", "ok2"], True), (["ok3", "ok3", "ok3"], True)])
+
+
 if __name__ == "__main__":
         suite = unittest.TestLoader().loadTestsFromTestCase(competitiveWFTest)
         unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,103 @@
+import unittest
+import os
+
+import orange
+from AZutilities import dataUtilities
+from AZutilities import miscUtilities
+from AZutilities import ConfPredClass
+import AZOrangeConfig as AZOC
+
+
+class ConfPredTest(unittest.TestCase):
+
+    def setUp(self):
+        dataPath = os.path.join(AZOC.AZORANGEHOME,"tests/source/data/BinClass_No_metas_Train.tab")
+        smilesDataPath = os.path.join(AZOC.AZORANGEHOME,"tests/source/data/BinClass_W_metas_Train.tab")
+        data = dataUtilities.DataTable(dataPath)
+        self.train = dataUtilities.DataTable(data.domain, data[0:40])
+        # The examples to predict are taken from the training set so that the attribute ranges used
+        #    by the Euclidean distance are the same with and without the NeighbourIndex
+        self.work = dataUtilities.DataTable(self.train.domain, [self.train[idx] for idx in (0, 7, 21, 39)])
+
+        # Data with the SMILES_1 attribute used by kNNratioStruct
+        smilesData = dataUtilities.DataTable(smilesDataPath)
+        domain = orange.Domain([orange.StringVariable("SMILES_1")], smilesData.domain.classVar)
+        self.smilesTrain = dataUtilities.DataTable(domain, [[ex["smiles"].value, ex.getclass().value] for ex in smilesData[0:40]])
+        self.smilesWork = dataUtilities.DataTable(domain, [self.smilesTrain[idx] for idx in (0, 7, 21, 39)])
+        self.scratchdir = miscUtilities.createScratchDir(desc="ConfPredTest")
+        self.origDir = os.getcwd()
+        os.chdir(self.scratchdir)
+
+    def tearDown(self):
+        os.chdir(self.origDir)
+        miscUtilities.removeDir(self.scratchdir)
+
+    def getData(self, method):
+        if method == "kNNratioStruct":
+            return self.smilesTrain, self.smilesWork
+        return self.train, self.work
+
+    def test_NeighbourIndexScores(self):
+        """Test that the non-conformity scores of the NeighbourIndex are the scores computed pair by pair"""
+        for method in ConfPredClass.INDEXMETHODS:
+            train, work = self.getData(method)
+            index = ConfPredClass.NeighbourIndex(train, structural = method == "kNNratioStruct")
+            for predEx in work:
+                for label in train.domain.classVar.values:
+                    newPredEx = dataUtilities.DataTable(predEx.domain, [predEx])
+                    newPredEx[0][newPredEx.domain.classVar] = label
+                    extTrain = dataUtilities.concatenate([train, newPredEx])[0]
+                    expected = [ConfPredClass.getScore(idx, extTrain, method) for idx in range(len(extTrain))]
+                    scores = index.getScores(predEx, label, method)
+                    self.assertEqual(len(scores), len(expected))
+                    self.assertEqual([round(x,5) for x in scores], [round(x,5) for x in expected], method)
+
+    def test_NeighbourIndexOutOfRange(self):
+        """Test that the NeighbourIndex scores use the ranges of the training set and the example to predict"""
+        contAttrs = [attr for attr in self.train.domain.attributes if attr.varType == orange.VarTypes.Continuous]
+        work = dataUtilities.DataTable(self.train.domain, [self.train[idx] for idx in (3, 12)])
+        maxValue = max([float(ex[contAttrs[0]]) for ex in self.train if not ex[contAttrs[0]].isSpecial()])
+        minValue = min([float(ex[contAttrs[1]]) for ex in self.train if not ex[contAttrs[1]].isSpecial()])
+        work[0][contAttrs[0]] = maxValue + 10
+        work[1][contAttrs[1]] = minValue - 5
+        # The last example, in range, must use again the statistics of the training set
+        work.append(self.train[21])
+        for method in ConfPredClass.INDEXMETHODS:
+            if method == "kNNratioStruct":
+                continue
+            index = ConfPredClass.NeighbourIndex(self.train)
+            for predEx in work:
+                for label in self.train.domain.classVar.values:
+                    newPredEx = dataUtilities.DataTable(predEx.domain, [predEx])
+                    newPredEx[0][newPredEx.domain.classVar] = label
+                    extTrain = dataUtilities.concatenate([self.train, newPredEx])[0]
+                    expected = [ConfPredClass.getScore(idx, extTrain, method) for idx in range(len(extTrain))]
+                    scores = index.getScores(predEx, label, method)
+                    self.assertEqual([round(x,5) for x in scores], [round(x,5) for x in expected], method)
+                    self.assertEqual(round(ConfPredClass.getPvalue(self.train, predEx, label, method, index = index),5), \
+                                     round(ConfPredClass.getPvalue(self.train, predEx, label, method, useIndex = False),5), method)
+
+    def test_NeighbourIndexPvalues(self):
+        """Test that getPvalue and getConfPred give the same results with and without the NeighbourIndex"""
+        for method in ConfPredClass.INDEXMETHODS:
+            train, work = self.getData(method)
+            index = ConfPredClass.NeighbourIndex(train, structural = method == "kNNratioStruct")
+            for predEx in work:
+                for label in train.domain.classVar.values:
+                    pvalue = ConfPredClass.getPvalue(train, predEx, label, method, useIndex = False)
+                    self.assertEqual(round(ConfPredClass.getPvalue(train, predEx, label, method, index = index),5), round(pvalue,5), method)
+                    self.assertEqual(round(ConfPredClass.getPvalue(train, predEx, label, method),5), round(pvalue,5), method)
+
+            resultsFiles = []
+            for useIndex in (True, False):
+                resultsFiles.append(os.path.join(self.scratchdir, method+str(useIndex)+".txt"))
+                ConfPredClass.getConfPred(train, work, method, resultsFile = resultsFiles[-1], useIndex = useIndex)
+            results = [open(resultsFile).read() for resultsFile in resultsFiles]
+            self.assertEqual(len(results[0].strip().split("\n")), len(work))
+            self.assertEqual(results[0], results[1], method)
+
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(ConfPredTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -6,6 +6,8 @@ from trainingMethods import AZorngConsensus
 from trainingMethods import AZorngCvSVM
 from trainingMethods import AZorngCvANN
 from trainingMethods import AZorngRF
+from trainingMethods import AZorngPLS
+from trainingMethods import AZBaseClasses
 from AZutilities import dataUtilities
 
 import orange
@@ -19,6 +21,18 @@ import orngImpute
 def float_compare(a, b):
     return abs(a-b)<0.0001
 
+class _UnknownPredictor(object):
+    """Member classifier that cannot predict: returns '?' or None"""
+    def __init__(self, classVar, returnNone = False):
+        self.classVar = classVar
+        self.returnNone = returnNone
+
+    def __call__(self, ex, resultType = orange.GetValue):
+        if self.returnNone:
+            return None
+        return orange.Value(self.classVar, "?")
+
+
 class ConsensusClassifierTest(AZorngTestUtil.AZorngTestUtil):
     def setUp(self):
         """Creates the training and testing data set attributes. """
@@ -374,6 +388,36 @@ class ConsensusClassifierTest(AZorngTestUtil.AZorngTestUtil):
         self.assertEqual(Loaded.NTrainEx, len(self.DataReg))
 
         miscUtilities.removeDir(scratchdir)
+
+
+    def test_ModelCacheNestedModels(self):
+        """Test that a cached consensus model is loaded again when it or one of the models in it changes"""
+        classifier = AZorngConsensus.ConsensusLearner(learners = [AZorngRF.RFLearner(), AZorngCvSVM.CvSVMLearner()])(self.DataReg)
+        scratchdir = miscUtilities.createScratchDir(desc="ConsensusModelCacheTest")
+        modelPath = os.path.join(scratchdir, "CM.model")
+        classifier.write(modelPath)
+        self.assert_(os.path.isfile(os.path.join(modelPath, AZBaseClasses.MODELMANIFEST)))
+        AZBaseClasses.evictModel()
+        model = AZBaseClasses.modelRead(modelPath, useCache = True)
+        self.assert_(model is not None)
+        self.assert_(AZBaseClasses.modelRead(modelPath, useCache = True) is model)
+        # Saving the model again writes its manifest again
+        time.sleep(1.1)
+        classifier.write(modelPath)
+        self.assert_(AZBaseClasses.modelRead(modelPath, useCache = True) is not model)
+        # The models saved without manifest use all the files in them. Change a file of a member model, 
+        #   which does not change the modification time of the consensus dir
+        os.remove(os.path.join(modelPath, AZBaseClasses.MODELMANIFEST))
+        model = AZBaseClasses.modelRead(modelPath, useCache = True)
+        self.assert_(AZBaseClasses.modelRead(modelPath, useCache = True) is model)
+        nestedFiles = [os.path.join(root, fileName) for root, dirs, files in os.walk(modelPath) for fileName in files \
+                       if root != modelPath]
+        self.assert_(len(nestedFiles) > 0)
+        mtime = os.path.getmtime(nestedFiles[0]) + 10
+        os.utime(nestedFiles[0], (mtime, mtime))
+        self.assert_(AZBaseClasses.modelRead(modelPath, useCache = True) is not model)
+        AZBaseClasses.evictModel()
+        miscUtilities.removeDir(scratchdir)
  
         
     def test_CreateLearnerWithObjectMapping(self):
@@ -725,6 +769,66 @@ class ConsensusClassifierTest(AZorngTestUtil.AZorngTestUtil):
                 print "Delta: ", abs(result[index].value - verifiedResult[index])
             self.assertEqual(float_compare(result[index].value, verifiedResult[index]), True)
 
+    def test_CustomExpressionPredictBatch(self):
+        """ Test that the vectorized custom expressions predict the same as the example by example predictions """
+        learners = {'a':AZorngCvSVM.CvSVMLearner(),
+                    'b':AZorngCvANN.CvANNLearner(),
+                    'c':AZorngRF.RFLearner()}
+        discreteExpression = ["a == Iris-setosa and c == Iris-virginica or not b == Iris-setosa -> Iris-setosa", "-> Iris-virginica"]
+        discreteClassifier = AZorngConsensus.ConsensusLearner(learners = learners, expression = discreteExpression)(self.irisData)
+        values = discreteClassifier.predictBatch(self.irisData)
+        for idx, ex in enumerate(self.irisData):
+            self.assertEqual(discreteClassifier.classVar.values[int(values[idx])], discreteClassifier(ex).value)
+
+        weights = { 'a': lambda x: 1,
+                    'b': lambda x: 2,
+                    'c': lambda x: 3 }
+        regressionExpression = "IF0( a - b , c ) / 3 if a > b else ( a + b + c ) / 6"
+        regressionClassifier = AZorngConsensus.ConsensusLearner(learners = learners, expression = regressionExpression, weights = weights)(self.DataReg)
+        values = regressionClassifier.predictBatch(self.DataReg)
+        for idx, ex in enumerate(self.DataReg):
+            self.assert_(float_compare(values[idx], regressionClassifier(ex).value), "idx "+str(idx)+": "+str(values[idx]))
+
+        # and/or return one of their operands in regression expressions
+        regressionClassifier.expression = "( a > b and a ) or b"
+        values = regressionClassifier.predictBatch(self.DataReg)
+        for idx, ex in enumerate(self.DataReg):
+            self.assert_(float_compare(values[idx], regressionClassifier(ex).value), "idx "+str(idx)+": "+str(values[idx]))
+        self.assert_(len([value for value in values if value not in (0.0, 1.0)]) > 0)
+
+        # Changing the expression recompiles it
+        regressionClassifier.expression = "(a + b + 3cd45 + c) / 3"
+        self.assertEqual(regressionClassifier.predictBatch(self.DataReg), None)
+        self.assertEqual(regressionClassifier(self.DataReg[0]), None)
+
+    def test_CustomRegressionExpressionUnknownMember(self):
+        """ Test that a custom regression expression predicts None when a member cannot predict """
+        learners = {'a':AZorngRF.RFLearner(), 'b':AZorngCvSVM.CvSVMLearner()}
+        classifier = AZorngConsensus.ConsensusLearner(learners = learners, expression = "( a + b ) / 2")(self.DataReg)
+        self.assertNotEqual(classifier(self.DataReg[0]), None)
+        for returnNone in (False, True):
+            classifier.classifiers['b'] = _UnknownPredictor(self.DataReg.domain.classVar, returnNone)
+            self.assertEqual(classifier(self.DataReg[0]), None)
+
+    def test_ParallelMemberTraining(self):
+        """ Test that the members trained in parallel processes predict the same as the ones trained serially """
+        learners = {'a':AZorngCvSVM.CvSVMLearner(),
+                    'b':AZorngPLS.PLSLearner()}
+        regressionExpression = "(a + b) / 2"
+        serialClassifier = AZorngConsensus.ConsensusLearner(learners = learners, expression = regressionExpression)(self.DataReg)
+        parallelClassifier = AZorngConsensus.ConsensusLearner(learners = learners, expression = regressionExpression, nWorkers = 2)(self.DataReg)
+        self.assertEqual(sorted(parallelClassifier.classifiers.keys()), ['a', 'b'])
+        self.assertEqual(parallelClassifier.NTrainEx, len(self.DataReg))
+        for ex in self.DataReg:
+            self.assert_(float_compare(serialClassifier(ex).value, parallelClassifier(ex).value))
+
+        learners = [AZorngCvSVM.CvSVMLearner(), AZorngPLS.PLSLearner()]
+        serialClassifier = AZorngConsensus.ConsensusLearner(learners = learners)(self.irisData)
+        parallelClassifier = AZorngConsensus.ConsensusLearner(learners = learners, nWorkers = 0)(self.irisData)
+        self.assertEqual(len(parallelClassifier.classifiers), 2)
+        for ex in self.irisData:
+            self.assertEqual(serialClassifier(ex).value, parallelClassifier(ex).value)
+
     def test_InvalidCustomRegressionExpression(self):
         """ Test invalid custom expression """
         # Arrange
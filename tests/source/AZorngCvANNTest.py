@@ -222,6 +222,26 @@ class CvANNClassifierTest(AZorngTestUtil.AZorngTestUtil):
         self.assert_(sum1-int(sum1) > 0)
 
 
+    def test_PredictBatch(self):
+        """Test that the batch prediction matches the single example predictions"""
+        for trainData, testData in ((self.LdataTrain, self.LdataTest), (self.noBadDataTrain, self.badVarOrderData), (self.missingTrain, self.missingTest)):
+            CvANN = AZorngCvANN.CvANNLearner(trainData, randomWeights = False, stopUPs = 0)
+            values, probs = CvANN.predictBatch(testData, returnProbs = True)
+            self.assertEqual(len(values), len(testData))
+            for idx,ex in enumerate(testData):
+                if CvANN.classVar.varType == orange.VarTypes.Continuous:
+                    self.assertEqual(probs, None)
+                    self.assertEqual(round(values[idx],5), round(CvANN(ex).value,5))
+                else:
+                    value, prob = CvANN(ex, resultType = orange.GetBoth)
+                    self.assertEqual(int(values[idx]), int(value))
+                    self.assertEqual([round(p,5) for p in probs[idx]], [round(p,5) for p in prob])
+            # A table without examples gives an empty prediction
+            values, probs = CvANN.predictBatch(dataUtilities.DataTable(testData.domain), returnProbs = True)
+            self.assertEqual(len(values), 0)
+            if probs is not None:
+                self.assertEqual(probs.shape, (0, len(CvANN.classVar.values)))
+
     def test_TwoWays(self):
         """
         Test that an ann created in one or two steps give the same results
@@ -540,6 +560,18 @@ class CvANNClassifierTest(AZorngTestUtil.AZorngTestUtil):
         self.assertEqual(round(0.109667,6),round(Acc,6))  #opencv1.1: 0.168131
 
 
+    def test_ParallelDiffIniWeights(self):
+        """
+        Assure that the model selected when training the initial weights in parallel is the same as in serial.
+        """
+        serialModel = AZorngCvANN.CvANNLearner(self.LdataTrain, nHidden = [3], nDiffIniWeights = 4)
+        parallelModel = AZorngCvANN.CvANNLearner(self.LdataTrain, nHidden = [3], nDiffIniWeights = 4, nWorkers = 4)
+        self.assertEqual(serialModel.seed, parallelModel.seed)
+        self.assertEqual(serialModel.nIter, parallelModel.nIter)
+        for ex in self.LdataTest:
+            self.assertEqual(serialModel(ex, returnDFV = True)[1], parallelModel(ex, returnDFV = True)[1])
+
+
 
 
 if __name__ == "__main__":
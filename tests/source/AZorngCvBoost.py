@@ -179,6 +179,21 @@ class CvBoostClassifierTest(AZorngTestUtil.AZorngTestUtil):
         #self.assert_(sum1-int(sum1) > 0)
 
 
+    def test_PredictBatch(self):
+        """Test that the batch prediction matches the single example predictions"""
+        for trainData, testData in ((self.LdataTrain, self.LdataTest), (self.noBadDataTrain, self.badVarOrderData), (self.missingTrain, self.missingTest)):
+            CvBoost = AZorngCvBoost.CvBoostLearner(trainData)
+            values, probs = CvBoost.predictBatch(testData, returnProbs = True)
+            self.assertEqual(len(values), len(testData))
+            for idx,ex in enumerate(testData):
+                if CvBoost.classVar.varType == orange.VarTypes.Continuous:
+                    self.assertEqual(probs, None)
+                    self.assertEqual(round(values[idx],5), round(CvBoost(ex).value,5))
+                else:
+                    value, prob = CvBoost(ex, resultType = orange.GetBoth)
+                    self.assertEqual(int(values[idx]), int(value))
+                    self.assertEqual([round(p,5) for p in probs[idx]], [round(p,5) for p in prob])
+
     def test_TwoWays(self):
         """
         Test that an Boost created in one or two steps give the same results
@@ -381,6 +381,21 @@ class SVMClassifierTest(AZorngTestUtil.AZorngTestUtil):
 
 
 
+    def test_PredictBatch(self):
+        """Test that the batch prediction matches the single example predictions"""
+        for trainData, testData in ((self.noBadDataTrain, self.badVarOrderData), (self.missingTrain, self.missingTest), (self.regTrainData, self.regTrainData)):
+            svm = AZorngCvSVM.CvSVMLearner(trainData)
+            values, probs = svm.predictBatch(testData, returnProbs = True)
+            self.assertEqual(len(values), len(testData))
+            for idx,ex in enumerate(testData):
+                if svm.classVar.varType == orange.VarTypes.Continuous:
+                    self.assertEqual(probs, None)
+                    self.assertEqual(round(values[idx],5), round(svm(ex).value,5))
+                else:
+                    value, prob = svm(ex, resultType = orange.GetBoth)
+                    self.assertEqual(int(values[idx]), int(value))
+                    self.assertEqual([round(p,5) for p in probs[idx]], [round(p,5) for p in prob])
+
     def test_TwoWays(self):
         """Test two ways svm creation
         Test that an svm created in one or two steps give the same results
@@ -35,6 +35,25 @@ class GetAccWOptParam(AZorngTestUtil.AZorngTestUtil):
                 self.assert_(abs(l-expected[i][j]) < 3)
 
 
+    def test_ParallelFolds(self):
+        """Testing the folds running in parallel local processes"""
+        learners = {"RF":AZorngRF.RFLearner(), "RF2":AZorngRF.RFLearner(nTrees = 50)}
+        evaluator = getUnbiasedAccuracy.UnbiasedAccuracyGetter(data = self.iris2Data, learner = learners, nExtFolds = 3, nInnerFolds = 3, nWorkers = 3)
+        res = evaluator.getAcc()
+        for ml in learners:
+            self.assert_(res[ml]["CA"] is not None, "ML method "+ml+" failed")
+            self.assertEqual(len(res[ml]["foldStat"]["CA"]), 3)
+            self.assertEqual(sum(res[ml]["foldStat"]["nTestCmpds"]), len(self.iris2Data))
+            self.assertEqual(sum([sum(line) for line in res[ml]["CM"]]), len(self.iris2Data))
+            self.assert_(res[ml]["CA"] > 0.9)
+        # The folds running in the parent process must give the same results
+        evaluator = getUnbiasedAccuracy.UnbiasedAccuracyGetter(data = self.iris2Data, learner = learners, nExtFolds = 3, nInnerFolds = 3, nWorkers = 1)
+        serialRes = evaluator.getAcc()
+        for ml in learners:
+            self.assertEqual(serialRes[ml]["CM"], res[ml]["CM"])
+            self.assertEqual(serialRes[ml]["foldStat"]["CA"], res[ml]["foldStat"]["CA"])
+
+
     def test_Classification2CVal(self):
         """Testing Classification problem with 2 class values"""
         learner = AZorngRF.RFLearner()
@@ -7,6 +7,7 @@ import orange
 from trainingMethods import AZorngPLS
 from AZutilities import dataUtilities
 from AZutilities import evalUtilities
+from AZutilities import miscUtilities
 import AZOrangeConfig as AZOC
 import AZorngTestUtil
 
@@ -143,6 +144,63 @@ class PLSClassifierTest(AZorngTestUtil.AZorngTestUtil):
         os.system("/bin/rm -rf "+scratchdir)
 
 
+    def testBufferPredictions(self):
+        """Test that the predictions of the buffer interface are the same as the ones of the text interface"""
+        for trainData, testData in ((self.NoMetaTrain, self.NoMetaTest), (self.contTrain, self.contTest)):
+            pls = AZorngPLS.PLSLearner(trainData)
+            values = pls.predictBatch(testData)
+            examplesImp = pls._getBatchData(testData)
+            for idx, ex in enumerate(examplesImp):
+                textValue = pls._runPLS(pls.getFeatureVector(ex))
+                if trainData.domain.classVar.varType == orange.VarTypes.Discrete:
+                    self.assertEqual(values[idx], float(textValue))
+                else:
+                    self.assert_(abs(values[idx] - float(textValue)) < 1e-4, str(values[idx])+" != "+str(textValue))
+                self.assertEqual(pls(testData[idx]), pls._float2value(values[idx]))
+
+    def testTrainBufferAsFile(self):
+        """Test that the models trained from a buffer predict as the ones trained from a file, also with discrete attributes of numeric values"""
+        # The regression data has the discrete attributes Attr3 with numeric values and YetOther with mixed values
+        # Add to the classification data a discrete attribute with the values 0 and 1
+        numVar = orange.EnumVariable("NumDisc", values = ["0", "1"])
+        domain = orange.Domain(list(self.NoMetaTrain.domain.attributes) + [numVar], self.NoMetaTrain.domain.classVar)
+        attr = self.NoMetaTrain.domain.attributes[0]
+        threshold = sorted([float(ex[attr]) for ex in self.NoMetaTrain if not ex[attr].isSpecial()])[len(self.NoMetaTrain)/2]
+        classTrain = dataUtilities.DataTable(domain, self.NoMetaTrain)
+        classTest = dataUtilities.DataTable(domain, self.NoMetaTest)
+        for data in (classTrain, classTest):
+            for ex in data:
+                ex["NumDisc"] = str(int(not ex[attr].isSpecial() and float(ex[attr]) > threshold))
+
+        scratchdir = miscUtilities.createScratchDir(desc="PLSTrainBufferTest")
+        for trainData, testData in ((classTrain, classTest), (self.contTrain, self.contTest)):
+            bufferModel = AZorngPLS.PLSLearner(trainData)
+            # Train the same PLS from the file with the imputed data, as done when TrainBuffer is not available
+            fileName = os.path.join(scratchdir, "OrngData.tab")
+            cleanedData = dataUtilities.getDataWithoutUnusedValues(trainData, True)
+            orange.saveTabDelimited(fileName, orange.ImputerConstructor_average(cleanedData)(cleanedData))
+            learner = AZorngPLS.PLSLearner()
+            PlsAPI = AZorngPLS.pls.PlsAPI()
+            PlsAPI.SetParameter('method', learner.method)
+            PlsAPI.SetParameter('k', learner.k)
+            PlsAPI.SetParameter('precision', learner.precision)
+            PlsAPI.SetParameter('sDir', scratchdir)
+            self.assert_(PlsAPI.Train(fileName))
+            fileModel = AZorngPLS.PLSClassifier(classifier = PlsAPI, classVar = trainData.domain.classVar, \
+                        imputeData = bufferModel.imputeData, varNames = [a.name for a in trainData.domain.attributes], \
+                        NTrainEx = len(trainData))
+            bufferValues = bufferModel.predictBatch(testData)
+            fileValues = fileModel.predictBatch(testData)
+            for idx, ex in enumerate(testData):
+                if trainData.domain.classVar.varType == orange.VarTypes.Discrete:
+                    self.assertEqual(bufferValues[idx], fileValues[idx])
+                    self.assertEqual(bufferModel(ex), fileModel(ex))
+                else:
+                    self.assert_(abs(bufferValues[idx] - fileValues[idx]) < 1e-4, str(bufferValues[idx])+" != "+str(fileValues[idx]))
+        miscUtilities.removeDir(scratchdir)
+
+
+
 #Datasets for testing Bad Data format
 # self.noBadDataTrain
 # self.noBadDataTest
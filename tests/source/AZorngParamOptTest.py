@@ -282,6 +282,62 @@ class optimizerTest(AZorngTestUtil.AZorngTestUtil):
 
         miscUtilities.removeDir(runPath)
 
+    def test_PLS_Regression_PersistentEvaluator(self):
+        """PLS - Test of optimizer using the persistent evaluator
+           The results must be the same as when evaluating each point in a new process
+        """
+        expectedRes = [3.27, 3.2599999999999998] #Ver 0.3 - Artifact: The second value can be expected on other Systems
+        opt=paramOptUtilities.Appspack()
+        learner=AZorngPLS.PLSLearner()
+        runPath = miscUtilities.createScratchDir(desc="ParamOptTest_PersistentEval")
+        tunedPars = opt(learner=learner,\
+                        dataSet=self.contTrainDataPath,\
+                        evaluateMethod = "AZutilities.evalUtilities.RMSE",\
+                        findMin=True,\
+                        runPath = runPath,\
+                        useStd = False,\
+                        usePersistentEvaluator = True,\
+                        verbose = 0)
+        print "Returned: ", tunedPars
+        self.assertEqual(opt.usedMPI,False)
+        self.assertEqual(learner.optimized,True)
+        self.assert_(round(tunedPars[0],2) in [round(x,2) for x in expectedRes]) #Ver 0.3
+        # The evaluator must be terminated when the optimization finishes
+        self.assertEqual(opt.evalServerPID,0)
+        self.assert_(not os.path.exists(opt.evalServerSocket))
+
+        miscUtilities.removeDir(runPath)
+
+    def test_PersistentEvaluatorLocalRun(self):
+        """Test that the persistent evaluator is only allowed when all the processes run in this host"""
+        opt=paramOptUtilities.Appspack()
+        isLocalRun = opt._Appspack__IsLocalRun
+        opt.machinefile = None
+        self.assertEqual(isLocalRun(), True)
+        opt.machinefile = 4
+        self.assertEqual(isLocalRun(), True)
+        opt.machinefile = ["localhost", "localhost:2"]
+        self.assertEqual(isLocalRun(), True)
+        opt.machinefile = ["localhost", "computeNode1"]
+        self.assertEqual(isLocalRun(), False)
+        opt.machinefile = "qsub"
+        self.assertEqual(isLocalRun(), False)
+        runPath = miscUtilities.createScratchDir(desc="ParamOptTest_LocalRun")
+        machinesFile = os.path.join(runPath, "machines")
+        fileh = open(machinesFile, "w")
+        fileh.write("# Local machines\nlocalhost slots=2\n127.0.0.1\n")
+        fileh.close()
+        opt.machinefile = machinesFile
+        self.assertEqual(isLocalRun(), True)
+        fileh = open(machinesFile, "a")
+        fileh.write("computeNode1\n")
+        fileh.close()
+        self.assertEqual(isLocalRun(), False)
+        opt.machinefile = None
+        opt.advancedMPIoptions = "-host computeNode1"
+        self.assertEqual(isLocalRun(), False)
+        miscUtilities.removeDir(runPath)
+
     def test_RFClassification(self):
         """RF - Test of optimizer with discrete class data
         """
@@ -32,6 +32,129 @@ class AZOrangePredictorTest(unittest.TestCase):
         self.assertEqual(significance, None)    # All gradients are 0
 
 
+    def test_predictBatch(self):
+        """ Test that the batch predictions are the same as predicting the compounds one by one
+        """
+        self.modelPath = "data/QTcB_SVM_Sign_Model"  # Signatures hight 3
+        train = dataUtilities.DataTable("data/QTcB_sign.txt")
+        data = dataUtilities.DataTable([ex for ex in train][:10])
+
+        predictor = AZOrangePredictor.AZOrangePredictor(self.modelPath)
+        predictor.setDescriptors(data)
+        predictions = predictor.predictBatch()
+        self.assertEqual(len(predictions), len(data))
+        for idx in range(len(data)):
+            predictor.setDescriptors(dataUtilities.DataTable([data[idx]]))
+            self.assertEqual(round(predictions[idx], 5), round(predictor.predict(), 5))
+
+
+    def test_readSmiles(self):
+        """ Test the reading of the SMILES sent to the batch predictions
+        """
+        text = "# Compounds to predict\nCCC id1\n\n  c1ccccc1\tid2\nCCO\n"
+        self.assertEqual(AZOrangePredictor.readSmiles(text), ["CCC", "c1ccccc1", "CCO"])
+
+
+    def assertSamePrediction(self, prediction, expected):
+        if isinstance(expected, float):
+            self.assertEqual(round(prediction, 5), round(expected, 5))
+        else:
+            self.assertEqual(prediction, expected)
+
+
+    def test_predictSmilesList(self):
+        """ Test the descriptors and predictions of a list of SMILES with an invalid one, keeping their order and number
+        """
+        smilesList = ["CCC", "c1ccccc1O", "NotASmiles((", "CCO"]
+        predictor = AZOrangePredictor.AZOrangePredictor("data/DescModel.model")
+        predictor.getDescriptors(smilesList)
+        self.assertEqual([str(ex["SMILEStoPred"].value) for ex in predictor.exToPred], smilesList)
+
+        predictions, stats = predictor.predictSmilesList(smilesList)
+        self.assertEqual(len(predictions), len(smilesList))
+        self.assertEqual(stats["nCmpds"], len(smilesList))
+        for idx in (0, 1, 3):
+            predictor.getDescriptors(smilesList[idx])
+            self.assertSamePrediction(predictions[idx], predictor.predict())
+
+        # The same predictions from a file
+        from AZutilities import miscUtilities
+        scratchdir = miscUtilities.createScratchDir(desc="PredictorSmilesFileTest")
+        smilesFile = os.path.join(scratchdir, "cmpds.smi")
+        fileh = open(smilesFile, "w")
+        fileh.write("# Compounds to predict\n" + "\n".join([smi+"\tid"+str(idx) for idx, smi in enumerate(smilesList)]) + "\n")
+        fileh.close()
+        filePredictions, fileStats = predictor.predictSmilesFile(smilesFile)
+        miscUtilities.removeDir(scratchdir)
+        self.assertEqual(fileStats["nCmpds"], len(smilesList))
+        for filePrediction, prediction in zip(filePredictions, predictions):
+            if prediction is None:
+                self.assertEqual(filePrediction, None)
+            else:
+                self.assertSamePrediction(filePrediction, prediction)
+
+
+    def test_server(self):
+        """ Test a round trip of predictions and stats requests to the predictor server on a local port
+        """
+        import threading
+        import urllib2
+        import json
+        smilesList = ["CCC", "c1ccccc1O", "CCO"]
+        server = AZOrangePredictor.createServer("data/DescModel.model", 0)
+        self.assert_(server is not None)
+        thread = threading.Thread(target = server.serve_forever)
+        thread.start()
+        try:
+            url = "http://localhost:"+str(server.server_port)
+            result = json.loads(urllib2.urlopen(url+"/predict", "\n".join(smilesList)).read())
+            stats = json.loads(urllib2.urlopen(url+"/stats").read())
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen, url+"/predict", "")
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.assertEqual([res["smiles"] for res in result["predictions"]], smilesList)
+        predictions, localStats = AZOrangePredictor.AZOrangePredictor("data/DescModel.model").predictSmilesList(smilesList)
+        for res, prediction in zip(result["predictions"], predictions):
+            self.assertSamePrediction(res["prediction"], prediction)
+        self.assertEqual(result["stats"]["nCmpds"], len(smilesList))
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["nCmpds"], len(smilesList))
+
+    def test_NNsearch(self):
+        """ Test the search of the nearest neighbors in the NN dataset defined in modelDef.ini
+        """
+        import ConfigParser
+        from rdkit import Chem
+        from rdkit.Chem.Fingerprints import FingerprintMols
+        from AZutilities import miscUtilities
+        predictor = AZOrangePredictor.AZOrangePredictor("data/QTcB_SVM_Sign_Model")
+        self.assertEqual(predictor.NNsearch("CCO"), [])
+
+        scratchdir = miscUtilities.createScratchDir(desc="PredictorNNTest")
+        os.mkdir(os.path.join(scratchdir, "data"))
+        NNData = open("data/NN_Data.txt").read()
+        open(os.path.join(scratchdir, "data", "NN_Data.txt"), "w").write(NNData)
+        fpFile = open(os.path.join(scratchdir, "data", "NN_RDKFP.txt"), "w")
+        for line in NNData.strip().split("\n")[1:]:
+            fpFile.write(FingerprintMols.FingerprintMol(Chem.MolFromSmiles(line.split("\t")[0])).ToBitString()+"\n")
+        fpFile.close()
+        predictor.mountPoint = scratchdir
+        predictor.modelDef = ConfigParser.ConfigParser()
+        predictor.modelDef.add_section("NN")
+        predictor.modelDef.set("NN", "data", "NN_Data.txt")
+        predictor.modelDef.set("NN", "fingerprints", "NN_RDKFP.txt")
+        predictor.modelDef.set("NN", "n", "3")
+        res = predictor.NNsearch("CN1CCC[C@H]1c1cccnc1")
+        self.assertEqual(len(res), 3)
+        self.assertEqual(res[0]["id"], "NN005")
+        self.assertEqual(res[0]["similarity"], "1.0000")
+        self.assertEqual(len(predictor.NNsearch("CCO", n = 6)), 6)
+        self.assertEqual(predictor.NNsearch("invalidSMILES"), [])
+        miscUtilities.removeDir(scratchdir)
+
+
     def test_signHeight1(self):
 
         self.modelPath = "data/QTcB_SVM_Sign1_Model"  # Signatures hight 1
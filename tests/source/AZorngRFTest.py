@@ -6,7 +6,9 @@ import time
 import orange
 from AZutilities import evalUtilities
 from AZutilities import miscUtilities
+from AZutilities import threadPolicy
 from trainingMethods import AZorngRF
+from trainingMethods import AZBaseClasses
 import AZOrangeConfig as AZOC
 import AZorngTestUtil
 
@@ -190,6 +192,109 @@ class RFClassifierTest(AZorngTestUtil.AZorngTestUtil):
         self.assert_(sum0-int(sum0) > 0)
         self.assert_(sum1-int(sum1) > 0)
 
+    def test_PredictBatch(self):
+        """Test that the batch prediction matches the single example predictions"""
+        RF = AZorngRF.RFLearner(self.trainData)
+        values, probs = RF.predictBatch(self.testData, returnProbs = True)
+        self.assertEqual(len(values), len(self.testData))
+        for idx,ex in enumerate(self.testData):
+            value, prob = RF(ex, resultType = orange.GetBoth)
+            self.assertEqual(int(values[idx]), int(value))
+            self.assertEqual([round(p,5) for p in probs[idx]], [round(p,5) for p in prob])
+
+        RF = AZorngRF.RFLearner(self.trainDataReg)
+        values, probs = RF.predictBatch(self.testDataReg, returnProbs = True)
+        self.assertEqual(probs, None)
+        for idx,ex in enumerate(self.testDataReg):
+            self.assertEqual(round(values[idx],5), round(RF(ex).value,5))
+        # A table without examples gives an empty prediction
+        emptyData = dataUtilities.DataTable(self.testDataReg.domain)
+        self.assertEqual(len(RF.predictBatch(emptyData)), 0)
+        self.assertEqual(len(RF.predictBatchDFV(emptyData)), 0)
+        self.assertEqual(RF.predictBatch(None), None)
+
+    def test_VoteFractions(self):
+        """Test that the class predicted from the vote fractions is the one predicted by the forest"""
+        RF = AZorngRF.RFLearner(self.trainData, nTrees = 50)
+        votes = RF.getVoteFractions(self.testData)
+        self.assertEqual(votes.shape, (len(self.testData), 2))
+        for idx,ex in enumerate(self.testData):
+            self.assertEqual(round(sum(votes[idx]),5), 1)
+            exampleCvMat = dataUtilities.Example2CvMat(RF.imputer(ex), RF.varNames, RF.thisVer)
+            forestPrediction = dataUtilities.CvMat2orangeResponse(RF.classifier.predict(exampleCvMat), RF.classVar)
+            self.assertEqual(RF(ex), forestPrediction)
+            self.assertEqual([round(p,5) for p in votes[idx]], [round(p,5) for p in RF(ex, resultType = orange.GetProbabilities)])
+        self.assertEqual(AZorngRF.RFLearner(self.irisData).getVoteFractions(self.irisData), None)
+
+    def test_PredictBatchDFV(self):
+        """Test that the batch DFVs used by getTopImportantVars are the DFVs of the single predictions"""
+        for trainData, testData in ((self.trainData, self.testData), (self.trainDataReg, self.testDataReg)):
+            RF = AZorngRF.RFLearner(trainData)
+            DFVs = RF.predictBatchDFV(testData)
+            self.assertEqual(len(DFVs), len(testData))
+            for idx,ex in enumerate(testData):
+                self.assertEqual(round(DFVs[idx],5), round(RF(ex, returnDFV = True)[1],5))
+
+    def test_ThreadPolicy(self):
+        """Test that the number of threads does not change the RF predictions"""
+        # The RF learners use one thread unless they opt in to the thread policy with NumThreads "auto"
+        self.assertEqual(AZorngRF.RFLearner().NumThreads, "1")
+        RF = AZorngRF.RFLearner(self.trainData, NumThreads = "1")
+        predictions = RF.predictBatch(self.testData)
+        threadPolicy.setThreadPolicy(2)
+        try:
+            self.assertEqual(threadPolicy.getNumThreads(), 2)
+            self.assertEqual(threadPolicy.getNumThreads("3"), 3)
+            self.assertEqual(list(RF.predictBatch(self.testData)), list(predictions))
+        finally:
+            threadPolicy.setThreadPolicy(AZOC.OPENCVNTHREADS)
+        self.assert_(threadPolicy.getNumThreads() <= threadPolicy.getAvailableCPUs())
+        # The models trained with one or more threads are the same
+        for trainData, testData in ((self.trainData, self.testData), (self.trainDataReg, self.testDataReg)):
+            values, probs = AZorngRF.RFLearner(trainData, NumThreads = "1").predictBatch(testData, returnProbs = True)
+            RF = AZorngRF.RFLearner(trainData, NumThreads = "4")
+            self.assertEqual(list(RF.predictBatch(testData)), list(values))
+            if probs is not None:
+                self.assertEqual([[round(p,5) for p in prob] for prob in RF.predictBatch(testData, returnProbs = True)[1]], \
+                                 [[round(p,5) for p in prob] for prob in probs])
+
+    def test_ModelCache(self):
+        """Test the cache of the models loaded by modelRead"""
+        RF = AZorngRF.RFLearner(self.trainData)
+        scratchdir = miscUtilities.createScratchDir(desc="RFModelCacheTest")
+        modelPath = os.path.join(scratchdir, "model.RF")
+        RF.write(modelPath)
+        AZBaseClasses.evictModel()
+        model = AZBaseClasses.modelRead(modelPath, useCache = True)
+        self.assert_(model is not None)
+        self.assert_(AZBaseClasses.modelRead(modelPath, useCache = True) is model)
+        self.assert_(AZBaseClasses.modelRead(modelPath) is not model)
+        for ex in self.testData:
+            self.assertEqual(model(ex), RF(ex))
+        # A changed model is loaded again
+        time.sleep(1.1)
+        RF.write(modelPath)
+        self.assert_(AZBaseClasses.modelRead(modelPath, useCache = True) is not model)
+        model = AZBaseClasses.modelRead(modelPath, useCache = True)
+        AZBaseClasses.evictModel(modelPath)
+        self.assert_(AZBaseClasses.modelRead(modelPath, useCache = True) is not model)
+        AZBaseClasses.evictModel()
+        miscUtilities.removeDir(scratchdir)
+
+    def test_ModelBundle(self):
+        """Test saving and loading a model in a single file bundle"""
+        RF = AZorngRF.RFLearner(self.trainData)
+        scratchdir = miscUtilities.createScratchDir(desc="RFModelBundleTest")
+        bundlePath = os.path.join(scratchdir, "model.azo")
+        self.assert_(RF.writeBundle(bundlePath))
+        self.assert_(os.path.isfile(bundlePath))
+        self.assertEqual(AZBaseClasses.modelRead(bundlePath, retrunClassifier = False), "RF")
+        loadedRF = AZBaseClasses.modelRead(bundlePath)
+        self.assert_(loadedRF is not None)
+        for ex in self.testData:
+            self.assertEqual(loadedRF(ex), RF(ex))
+        miscUtilities.removeDir(scratchdir)
+
     def test_save_load_Regression_D_Attr(self):
         """ Test Save/Load Regression model with Discrete Attribute"""
 
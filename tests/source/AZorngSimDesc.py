@@ -2,6 +2,7 @@ import unittest
 import os
 import time
 
+import orange
 from AZutilities import dataUtilities
 from AZutilities import SimBoostedQSAR
 import AZOrangeConfig as AZOC
@@ -33,6 +34,24 @@ class evalUtilitiesTest(unittest.TestCase):
         self.assertEqual(len(newData),len(self.smiData))
         self.assertEqual(newData.has_missing_values(),0)
 
+    def test_SimDesc_cached_fingerprints(self):
+        """Test that the descriptors with the cached fingerprints are the same as the ones of the orng_sim_* methods"""
+        actives = [str(ex["SMILES"].value) for ex in self.activesData][0:2]
+        methods = SimBoostedQSAR.methods.values()
+        data = dataUtilities.DataTable(self.smiData.domain, self.smiData[0:10])
+        newData = SimBoostedQSAR.getSimDescriptors(actives, data, methods)
+        self.assertEqual(len(newData),len(data))
+        for m in methods:
+            simFunc = getattr(SimBoostedQSAR, "orng_sim_" + m)
+            for aIdx, a in enumerate(actives):
+                attName = m + '(active_'+ str(aIdx+1)+ ')'
+                for idx, ex in enumerate(data):
+                    self.assertEqual(round(newData[idx][attName].value, 5), round(simFunc(a, ex), 5))
+        # The SMILES in a meta attribute are not kept in the data with the descriptors
+        domain = orange.Domain([attr for attr in data.domain.variables if attr.name != "SMILES"], data.domain.classVar is not None)
+        domain.addmeta(orange.newmetaid(), data.domain["SMILES"])
+        self.assertEqual(SimBoostedQSAR.getSimDescriptors(actives, dataUtilities.DataTable(domain, data), methods), None)
+
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(evalUtilitiesTest)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -14,7 +14,7 @@ mkdir $OUTPUTDIR
 OUTPUT_LOG=$OUTPUTDIR/test.log
 OUTPUT_PIPE=$OUTPUTDIR/output.pipe
   # NTESTS = Number of tests to perform.  Please, update this value if tests are added or deleted
-NTESTS=17
+NTESTS=18
 
 # When adding a new test, insert after the last test and before "PrintReport" statement:
 
@@ -183,6 +183,11 @@ echo "-+-+-+-+-+-+-+-+-+-+-+ AZorngPredictorTest +-+-+-+-+-+-+-+-+-+-+-" >> $OUT
 cat $OUTPUT_PIPE >> $OUTPUT_LOG
 CheckErrors "AZorngPredictorTest"
 
+python AZorngConfPredTest.py &>$OUTPUT_PIPE
+echo "-+-+-+-+-+-+-+-+-+-+-+ AZorngConfPredTest +-+-+-+-+-+-+-+-+-+-+-" >> $OUTPUT_LOG
+cat $OUTPUT_PIPE >> $OUTPUT_LOG
+CheckErrors "AZorngConfPredTest"
+
 #python AZorngAppsPackMPITest.py &>$OUTPUT_PIPE
 #echo "-+-+-+-+-+-+-+-+-+-+-+ AZorngAppsPackMPITest +-+-+-+-+-+-+-+-+-+-+-" >> $OUTPUT_LOG
 #cat $OUTPUT_PIPE >> $OUTPUT_LOG